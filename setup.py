@@ -55,6 +55,8 @@ setup(
         # Versions based on Lucid, where packaged.
         "django >= 1.1.1",
         "fixtures >= 0.3.5",
+        # concurrent.futures and asyncio as backported to Python 2.
+        "futures >= 2.1.3",
         # pgbouncer (the Python module) is not yet packaged in Ubuntu.
         "pgbouncer >= 0.0.7",
         "psycopg2 >= 2.0.13",
@@ -63,6 +65,7 @@ setup(
         # timeline is not yet packaged in Ubuntu.
         "timeline >= 0.0.2",
         "transaction >= 1.0.0",
+        "trollius >= 1.0",
         "twisted >= 10.0.0",
         "zope.component >= 3.8.0",
         # zope.component 3.11.0 requires a version of zope.interface that no
@@ -0,0 +1,297 @@
+"""An asyncio front-end to L{Store}.
+
+Database calls are run by an executor, so that coroutines can wait for
+them without blocking the event loop::
+
+    store = AsyncStore(database)
+    person = yield From(store.get(Person, 1))
+    people = yield From(store.find(Person, Person.age > 30)
+                             .order_by(Person.name).all())
+    yield From(store.commit())
+
+With Python 3, C{await} is used instead of C{yield From(...)}.
+"""
+import threading
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+from storm.exceptions import ClosedError
+from storm.store import Store
+
+
+__all__ = ["AsyncStore", "AsyncResultSet"]
+
+
+class AsyncStore(object):
+    """Run the operations of a L{Store} in an executor.
+
+    Methods which may access the database return awaitable futures.
+    Calls are run one at a time for a given L{AsyncStore}, but calls
+    on different ones run concurrently, as far as the executor allows,
+    so a bounded executor, and possibly a L{ConnectionPool}, limit the
+    resources used by many concurrent stores.
+
+    Between calls, access to the database is blocked, so touching
+    attributes of objects which would need to be loaded from the
+    database, as after a commit, raises L{ConnectionBlockedError}
+    instead of blocking the event loop.
+
+    Calls such as L{flush} and L{commit} read and update the objects of
+    the store in the executor, so objects obtained from an L{AsyncStore}
+    must not be read or changed while one of its calls is pending, that
+    is, until the future it returned is done.  Changes may be made
+    safely from the event loop between calls, or within a call with
+    L{run}.
+
+    @note: As calls may run in different threads, the database module
+        must allow connections to be shared between threads.  With
+        SQLite, use an executor with a single worker.
+
+    @param database: The L{Database} to connect to.
+    @param executor: The C{concurrent.futures.Executor} to run calls
+        with, or C{None} to use the default executor of the loop.
+    @param loop: The event loop, or C{None} to use the current one.
+    @param cache: The cache of the underlying L{Store}.
+    """
+
+    def __init__(self, database, executor=None, loop=None, cache=None):
+        self._database = database
+        self._executor = executor
+        self._loop = loop
+        self._cache = cache
+        self._store = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def run(self, function, *args, **kwargs):
+        """Run a function taking the underlying L{Store} in the executor.
+
+        This allows using any functionality of the store which isn't
+        wrapped by this class.
+
+        @param function: A callable taking the store and the given
+            arguments, which shouldn't return lazy objects such as
+            L{ResultSet}s.
+        @return: A future with the result of the call.
+        """
+        return self._run_in_executor(self._call, function, args, kwargs)
+
+    def _run_in_executor(self, function, *args):
+        loop = self._loop
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self._executor, function, *args)
+
+    def _call(self, function, args, kwargs):
+        self._lock.acquire()
+        try:
+            if self._store is None:
+                if self._closed:
+                    raise ClosedError("Store is closed")
+                self._store = Store(self._database, self._cache)
+            else:
+                self._store.unblock_access()
+            try:
+                return function(self._store, *args, **kwargs)
+            finally:
+                self._store.block_access()
+        finally:
+            self._lock.release()
+
+    def get(self, cls, key):
+        """See L{Store.get}."""
+        return self.run(Store.get, cls, key)
+
+    def get_many(self, cls, keys):
+        """See L{Store.get_many}."""
+        return self.run(Store.get_many, cls, keys)
+
+    def find(self, cls_spec, *args, **kwargs):
+        """Return an L{AsyncResultSet} for the given query.
+
+        No query is made until a method returning a future is called
+        on the result set.  See L{Store.find}.
+        """
+        return AsyncResultSet(self, (cls_spec,) + args, kwargs)
+
+    def execute(self, statement, params=None, noresult=False):
+        """Execute a statement, returning all the rows of its result.
+
+        @return: A future with a list of rows, or C{None} if C{noresult}
+            is true.  See L{Store.execute}.
+        """
+        return self.run(_execute, statement, params, noresult)
+
+    def add(self, obj):
+        """See L{Store.add}.  The database isn't touched until a flush."""
+        return self.run(Store.add, obj)
+
+    def remove(self, obj):
+        """See L{Store.remove}.  The database isn't touched until a flush."""
+        return self.run(Store.remove, obj)
+
+    def reload(self, obj):
+        """See L{Store.reload}."""
+        return self.run(Store.reload, obj)
+
+    def flush(self):
+        """See L{Store.flush}."""
+        return self.run(Store.flush)
+
+    def commit(self):
+        """See L{Store.commit}."""
+        return self.run(Store.commit)
+
+    def rollback(self):
+        """See L{Store.rollback}."""
+        return self.run(Store.rollback)
+
+    def close(self):
+        """Close the underlying store, if it was created."""
+        return self._run_in_executor(self._close)
+
+    def _close(self):
+        self._lock.acquire()
+        try:
+            self._closed = True
+            if self._store is not None:
+                self._store.unblock_access()
+                self._store.close()
+        finally:
+            self._lock.release()
+
+
+def _execute(store, statement, params, noresult):
+    result = store.execute(statement, params, noresult)
+    if not noresult:
+        return result.get_all()
+
+
+class AsyncResultSet(object):
+    """The representation of the results of a query of an L{AsyncStore}.
+
+    Methods refining the query return a new L{AsyncResultSet}, while the
+    ones which run it return futures.  The query is built again, with
+    L{Store.find}, every time it runs.
+    """
+
+    def __init__(self, async_store, args, kwargs, operations=()):
+        self._async_store = async_store
+        self._args = args
+        self._kwargs = kwargs
+        self._operations = operations
+
+    def _refine(self, name, *args, **kwargs):
+        return AsyncResultSet(self._async_store, self._args, self._kwargs,
+                              self._operations + ((name, args, kwargs),))
+
+    def _build(self, store):
+        result = store.find(*self._args, **self._kwargs)
+        for name, args, kwargs in self._operations:
+            if name == "__getitem__":
+                result = result[args[0]]
+            else:
+                result = getattr(result, name)(*args, **kwargs)
+        return result
+
+    def _run(self, name, *args, **kwargs):
+        def run(store):
+            return getattr(self._build(store), name)(*args, **kwargs)
+        return self._async_store.run(run)
+
+    def __getitem__(self, index):
+        """Return a result set limited to a slice of the results.
+
+        Unlike with L{ResultSet}, only slices are supported.
+        """
+        if not isinstance(index, slice):
+            raise TypeError("AsyncResultSet only supports slices, use "
+                            "first() or one() to get single results")
+        return self._refine("__getitem__", index)
+
+    def order_by(self, *args):
+        """See L{ResultSet.order_by}."""
+        return self._refine("order_by", *args)
+
+    def config(self, **kwargs):
+        """See L{ResultSet.config}."""
+        return self._refine("config", **kwargs)
+
+    def group_by(self, *expr):
+        """See L{ResultSet.group_by}."""
+        return self._refine("group_by", *expr)
+
+    def having(self, *expr):
+        """See L{ResultSet.having}."""
+        return self._refine("having", *expr)
+
+    def prefetch(self, *references):
+        """See L{ResultSet.prefetch}."""
+        return self._refine("prefetch", *references)
+
+    def readonly(self):
+        """See L{ResultSet.readonly}."""
+        return self._refine("readonly")
+
+    def all(self):
+        """Return a future with a list of all the results."""
+        return self._async_store.run(lambda store: list(self._build(store)))
+
+    def any(self):
+        """See L{ResultSet.any}."""
+        return self._run("any")
+
+    def first(self):
+        """See L{ResultSet.first}."""
+        return self._run("first")
+
+    def last(self):
+        """See L{ResultSet.last}."""
+        return self._run("last")
+
+    def one(self):
+        """See L{ResultSet.one}."""
+        return self._run("one")
+
+    def is_empty(self):
+        """See L{ResultSet.is_empty}."""
+        return self._run("is_empty")
+
+    def count(self, *args, **kwargs):
+        """See L{ResultSet.count}."""
+        return self._run("count", *args, **kwargs)
+
+    def max(self, expr):
+        """See L{ResultSet.max}."""
+        return self._run("max", expr)
+
+    def min(self, expr):
+        """See L{ResultSet.min}."""
+        return self._run("min", expr)
+
+    def avg(self, expr):
+        """See L{ResultSet.avg}."""
+        return self._run("avg", expr)
+
+    def sum(self, expr):
+        """See L{ResultSet.sum}."""
+        return self._run("sum", expr)
+
+    def values(self, *columns):
+        """Return a future with a list of the values of the given columns.
+
+        See L{ResultSet.values}.
+        """
+        return self._async_store.run(
+            lambda store: list(self._build(store).values(*columns)))
+
+    def set(self, *args, **kwargs):
+        """See L{ResultSet.set}."""
+        return self._run("set", *args, **kwargs)
+
+    def remove(self):
+        """See L{ResultSet.remove}."""
+        return self._run("remove")
@@ -1,4 +1,12 @@
 import itertools
+from sys import getsizeof
+
+from storm.variables import Variable, MutableValueVariable
+from storm import Undef
+
+
+# Positions of the fields in the nodes of the Cache linked list.
+PREV, NEXT, OBJ_INFO, OBJ = 0, 1, 2, 3
 
 
 class Cache(object):
@@ -8,17 +16,27 @@ class Cache(object):
     even if the user isn't holding any strong references to it.  It does
     that by holding strong references to the objects referenced by the
     last C{N} C{obj_info}s added to it (where C{N} is the cache size).
+
+    Entries are kept in a circular doubly linked list, most recent first,
+    so that adding, bumping and removing an entry take constant time.
     """
 
     def __init__(self, size=1000):
         self._size = size
-        self._cache = {} # {obj_info: obj, ...}
-        self._order = [] # [obj_info, ...]
+        self._cache = {} # {obj_info: [prev, next, obj_info, obj], ...}
+        self._root = root = [] # Sentinel node of the linked list.
+        root[:] = [root, root, None, None]
+        self._evictions = 0
 
     def clear(self):
         """Clear the entire cache at once."""
+        # Break the references between nodes so that cached objects are
+        # deallocated right away rather than by the garbage collector.
+        for node in self._cache.itervalues():
+            del node[:]
         self._cache.clear()
-        del self._order[:]
+        root = self._root
+        root[:] = [root, root, None, None]
 
     def add(self, obj_info):
         """Add C{obj_info} as the most recent entry in the cache.
@@ -28,22 +46,65 @@ class Cache(object):
         (IOW, will be the last to leave).
         """
         if self._size != 0:
-            if obj_info in self._cache:
-                self._order.remove(obj_info)
-            else:
-                self._cache[obj_info] = obj_info.get_obj()
-            self._order.insert(0, obj_info)
+            self._bump(obj_info, obj_info.get_obj())
             if len(self._cache) > self._size:
-                del self._cache[self._order.pop()]
+                self._evict_oldest()
+
+    def changed(self, obj_info):
+        """Tell the cache that the object of C{obj_info} was changed.
+
+        This is called by the store when the object gets dirty, and
+        when values are loaded into it, as with lazy columns.  It does
+        nothing here, but lets caches which keep information about the
+        cached objects know that it must be computed again.  The store
+        doesn't require caches to implement it.
+        """
+
+    def _bump(self, obj_info, obj):
+        """Make C{obj_info} the most recent entry, adding it if needed.
+
+        @param obj: The object to be held for C{obj_info}, if it's added.
+        """
+        root = self._root
+        node = self._cache.get(obj_info)
+        if node is None:
+            node = [root, root[NEXT], obj_info, obj]
+            self._cache[obj_info] = node
+        else:
+            # Unlink the node from its current position.
+            prev, next = node[PREV], node[NEXT]
+            prev[NEXT] = next
+            next[PREV] = prev
+            node[PREV] = root
+            node[NEXT] = root[NEXT]
+        root[NEXT][PREV] = node
+        root[NEXT] = node
+
+    def _evict_oldest(self):
+        """Remove the least recently added C{obj_info} from the cache.
+
+        @return: The evicted C{obj_info}.
+        """
+        root = self._root
+        node = root[PREV]
+        prev = node[PREV]
+        prev[NEXT] = root
+        root[PREV] = prev
+        obj_info = node[OBJ_INFO]
+        del self._cache[obj_info]
+        self._evictions += 1
+        return obj_info
 
     def remove(self, obj_info):
         """Remove C{obj_info} from the cache, if present.
 
         @return: True if C{obj_info} was cached, False otherwise.
         """
-        if obj_info in self._cache:
-            self._order.remove(obj_info)
-            del self._cache[obj_info]
+        node = self._cache.pop(obj_info, None)
+        if node is not None:
+            prev, next = node[PREV], node[NEXT]
+            prev[NEXT] = next
+            next[PREV] = prev
             return True
         return False
 
@@ -58,7 +119,7 @@ class Cache(object):
         else:
             # Remove all entries above the new size.
             while len(self._cache) > size:
-                del self._cache[self._order.pop()]
+                self._evict_oldest()
         self._size = size
 
     def get_cached(self):
@@ -66,7 +127,273 @@ class Cache(object):
 
         The most recently added objects come first in the list.
         """
-        return list(self._order)
+        cached = []
+        root = self._root
+        node = root[NEXT]
+        while node is not root:
+            cached.append(node[OBJ_INFO])
+            node = node[NEXT]
+        return cached
+
+    def get_stats(self):
+        """Return statistics about the cache.
+
+        @return: A dict with the number of cached objects (C{"objects"})
+            and the number of objects evicted to respect the size limit
+            since the statistics were last reset (C{"evictions"}).
+        """
+        return {"objects": len(self._cache),
+                "evictions": self._evictions}
+
+    def reset_stats(self):
+        """Reset the counters reported by L{get_stats}."""
+        self._evictions = 0
+
+
+class NegativeCache(Cache):
+    """Remembers the keys of objects which aren't in the database.
+
+    Keys are C{(cls, primary_values)} tuples, like the ones used by the
+    store to find alive objects.  When more than C{size} keys are
+    remembered, the least recently added ones are forgotten first.
+    """
+
+    def __init__(self, size=1000):
+        super(NegativeCache, self).__init__(size)
+        self._classes = {} # {cls: set([key, ...]), ...}
+
+    def clear(self):
+        """See L{Cache.clear}."""
+        super(NegativeCache, self).clear()
+        self._classes.clear()
+
+    def add(self, key):
+        """Remember that there's no object for C{key}."""
+        if self._size != 0:
+            self._bump(key, None)
+            keys = self._classes.get(key[0])
+            if keys is None:
+                self._classes[key[0]] = set((key,))
+            else:
+                keys.add(key)
+            if len(self._cache) > self._size:
+                self._evict_oldest()
+
+    def _evict_oldest(self):
+        key = super(NegativeCache, self)._evict_oldest()
+        self._discard_class_key(key)
+        return key
+
+    def _discard_class_key(self, key):
+        keys = self._classes[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._classes[key[0]]
+
+    def remove(self, key):
+        """Forget about C{key}, if present.
+
+        @return: True if C{key} was remembered, False otherwise.
+        """
+        if super(NegativeCache, self).remove(key):
+            self._discard_class_key(key)
+            return True
+        return False
+
+    def remove_class(self, cls):
+        """Forget about all the keys for objects of class C{cls}."""
+        for key in self._classes.pop(cls, ()):
+            super(NegativeCache, self).remove(key)
+
+    def has(self, key):
+        """Return True if there's known to be no object for C{key}."""
+        return key in self._cache
+
+
+_size_estimators = {}
+_estimator_lookup = {}
+
+
+def register_size_estimator(variable_class, estimator):
+    """Register a function estimating the memory used by variables.
+
+    The estimator is used for instances of C{variable_class} and of its
+    subclasses, unless a more specific estimator is registered for them.
+
+    @param variable_class: A L{Variable} subclass.
+    @param estimator: A callable taking a variable and returning the
+        estimated number of bytes used by its value.
+    """
+    _size_estimators[variable_class] = estimator
+    _estimator_lookup.clear()
+
+
+def estimate_variable_size(variable):
+    """Return the estimated number of bytes used by the value of C{variable}.
+
+    This uses the estimator registered for the class of C{variable}
+    with L{register_size_estimator}.
+    """
+    variable_class = type(variable)
+    estimator = _estimator_lookup.get(variable_class)
+    if estimator is None:
+        for cls in variable_class.__mro__:
+            estimator = _size_estimators.get(cls)
+            if estimator is not None:
+                break
+        _estimator_lookup[variable_class] = estimator
+    return estimator(variable)
+
+
+def estimate_value_size(value):
+    """Estimate the number of bytes used by C{value}.
+
+    Unlike C{sys.getsizeof}, this accounts for the objects held by
+    dicts, lists, tuples and sets, recursively.
+    """
+    size = 0
+    seen = set()
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        size += getsizeof(value)
+        if isinstance(value, dict):
+            stack.extend(value.iterkeys())
+            stack.extend(value.itervalues())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            stack.extend(value)
+    return size
+
+
+def _estimate_shallow_size(variable):
+    value = variable._value
+    if value is Undef:
+        return 0
+    return getsizeof(value)
+
+
+def _estimate_deep_size(variable):
+    value = variable._value
+    if value is Undef:
+        return 0
+    return estimate_value_size(value)
+
+
+register_size_estimator(Variable, _estimate_shallow_size)
+register_size_estimator(MutableValueVariable, _estimate_deep_size)
+
+
+class MemoryBoundCache(Cache):
+    """LRU cache bounded by the estimated memory used by cached objects.
+
+    This works like L{Cache}, but its size is the number of bytes which
+    may be used by the values of the cached objects, as estimated by
+    L{estimate_variable_size}, rather than a number of objects.  The
+    size of an object is estimated when it's first added, and again
+    when it's added after being L{changed}, so that bumping an object
+    which is looked up again is cheap.  Objects bigger than the whole
+    cache aren't kept at all.
+    """
+
+    def __init__(self, size=64*1024*1024):
+        super(MemoryBoundCache, self).__init__(size)
+        self._sizes = {} # {obj_info: size, ...}
+        self._changed = set()
+        self._total_size = 0
+        self._evicted_size = 0
+
+    def clear(self):
+        """See L{Cache.clear}."""
+        super(MemoryBoundCache, self).clear()
+        self._sizes.clear()
+        self._changed.clear()
+        self._total_size = 0
+
+    def changed(self, obj_info):
+        """See L{Cache.changed}.
+
+        The size of the object is estimated again when it's next added.
+        """
+        if obj_info in self._sizes:
+            self._changed.add(obj_info)
+
+    def _estimate_size(self, obj_info):
+        size = getsizeof(obj_info.get_obj())
+        variables = obj_info.variables
+        # Don't build variables of compact objects just to measure them.
+        for variable in dict.itervalues(variables):
+            size += estimate_variable_size(variable)
+        if obj_info.cls_info.deferred_columns:
+            for value in variables.get_unbuilt_values():
+                size += estimate_value_size(value)
+        return size
+
+    def add(self, obj_info):
+        """See L{Cache.add}."""
+        if self._size != 0:
+            old_size = self._sizes.get(obj_info)
+            if old_size is None or obj_info in self._changed:
+                size = self._estimate_size(obj_info)
+                if size > self._size:
+                    # Keeping it would evict every other object, and
+                    # then the object itself.
+                    self.remove(obj_info)
+                    return
+                self._changed.discard(obj_info)
+                self._total_size += size - (old_size or 0)
+                self._sizes[obj_info] = size
+            self._bump(obj_info, obj_info.get_obj())
+            while self._total_size > self._size:
+                self._evict_oldest()
+
+    def _evict_oldest(self):
+        obj_info = super(MemoryBoundCache, self)._evict_oldest()
+        self._changed.discard(obj_info)
+        size = self._sizes.pop(obj_info)
+        self._total_size -= size
+        self._evicted_size += size
+        return obj_info
+
+    def remove(self, obj_info):
+        """See L{Cache.remove}."""
+        if super(MemoryBoundCache, self).remove(obj_info):
+            self._changed.discard(obj_info)
+            self._total_size -= self._sizes.pop(obj_info)
+            return True
+        return False
+
+    def set_size(self, size):
+        """Set the maximum number of bytes which may be used by the cache.
+
+        If the size is reduced, older C{obj_info}s may be dropped from
+        the cache to respect the new size.
+        """
+        if size == 0:
+            self.clear()
+        else:
+            while self._total_size > size:
+                self._evict_oldest()
+        self._size = size
+
+    def get_stats(self):
+        """See L{Cache.get_stats}.
+
+        The estimated number of bytes used by the cached objects
+        (C{"size"}) and by the evicted ones (C{"evicted_size"}) are
+        reported as well.
+        """
+        stats = super(MemoryBoundCache, self).get_stats()
+        stats["size"] = self._total_size
+        stats["evicted_size"] = self._evicted_size
+        return stats
+
+    def reset_stats(self):
+        """See L{Cache.reset_stats}."""
+        super(MemoryBoundCache, self).reset_stats()
+        self._evicted_size = 0
 
 
 class GenerationalCache(object):
@@ -97,6 +424,8 @@ class GenerationalCache(object):
         self._size = size
         self._new_cache = {}
         self._old_cache = {}
+        self._evictions = 0
+        self._generation_bumps = 0
 
     def clear(self):
         """See `storm.store.Cache.clear`.
@@ -118,7 +447,11 @@ class GenerationalCache(object):
         of actual people.
         """
         self._old_cache, self._new_cache = self._new_cache, self._old_cache
+        for obj_info in self._new_cache:
+            if obj_info not in self._old_cache:
+                self._evictions += 1
         self._new_cache.clear()
+        self._generation_bumps += 1
 
     def add(self, obj_info):
         """See `storm.store.Cache.add`."""
@@ -127,6 +460,9 @@ class GenerationalCache(object):
                 self._bump_generation()
             self._new_cache[obj_info] = obj_info.get_obj()
 
+    def changed(self, obj_info):
+        """See `storm.store.Cache.changed`."""
+
     def remove(self, obj_info):
         """See `storm.store.Cache.remove`."""
         in_new_cache = self._new_cache.pop(obj_info, None) is not None
@@ -140,11 +476,14 @@ class GenerationalCache(object):
         objects, but no more than twice that number.
         """
         self._size = size
+        cached = len(self.get_cached())
         cache = itertools.islice(itertools.chain(self._new_cache.iteritems(),
                                                  self._old_cache.iteritems()),
                                  0, size)
         self._new_cache = dict(cache)
         self._old_cache.clear()
+        if size != 0:
+            self._evictions += cached - len(self._new_cache)
 
     def get_cached(self):
         """See `storm.store.Cache.get_cached`.
@@ -160,3 +499,18 @@ class GenerationalCache(object):
         cached = self._new_cache.copy()
         cached.update(self._old_cache)
         return list(cached)
+
+    def get_stats(self):
+        """See `storm.store.Cache.get_stats`.
+
+        The number of generations started (C{"generation_bumps"}) is
+        reported as well.
+        """
+        return {"objects": len(self.get_cached()),
+                "evictions": self._evictions,
+                "generation_bumps": self._generation_bumps}
+
+    def reset_stats(self):
+        """See `storm.store.Cache.reset_stats`."""
+        self._evictions = 0
+        self._generation_bumps = 0
@@ -101,6 +101,7 @@ static PyObject *Undef = NULL;
 static PyObject *LazyValue = NULL;
 static PyObject *raise_none_error = NULL;
 static PyObject *get_cls_info = NULL;
+static PyObject *CompactVariables = NULL;
 static PyObject *EventSystem = NULL;
 static PyObject *SQLRaw = NULL;
 static PyObject *SQLToken = NULL;
@@ -211,6 +212,10 @@ initialize_globals(void)
     if (!get_cls_info)
         return 0;
 
+    CompactVariables = PyObject_GetAttrString(module, "CompactVariables");
+    if (!CompactVariables)
+        return 0;
+
     Py_DECREF(module);
 
     /* Import objects from storm.event module */
@@ -1844,8 +1849,10 @@ ObjectInfo_init(ObjectInfoObject *self, PyObject *args)
     PyObject *factory_kwargs = NULL;
     PyObject *columns = NULL;
     PyObject *primary_key = NULL;
+    PyObject *compact = NULL;
     PyObject *obj;
     Py_ssize_t i;
+    int is_compact;
 
     empty_args = PyTuple_New(0);
 
@@ -1873,8 +1880,18 @@ ObjectInfo_init(ObjectInfoObject *self, PyObject *args)
     CATCH(NULL,
           self->event = PyObject_CallFunctionObjArgs(EventSystem, self, NULL));
 
-    /* self->variables = variables = {} */
-    CATCH(NULL, self->variables = PyDict_New());
+    /* if self.cls_info.compact:
+           self.variables = variables = CompactVariables(self)
+       else:
+           self.variables = variables = {} */
+    CATCH(NULL, compact = PyObject_GetAttrString(self->cls_info, "compact"));
+    CATCH(-1, is_compact = PyObject_IsTrue(compact));
+    if (is_compact) {
+        CATCH(NULL, self->variables = PyObject_CallFunctionObjArgs(
+                        CompactVariables, self, NULL));
+    } else {
+        CATCH(NULL, self->variables = PyDict_New());
+    }
 
     CATCH(NULL, self_get_obj = PyObject_GetAttrString((PyObject *)self,
                                                       "get_obj"));
@@ -1883,8 +1900,9 @@ ObjectInfo_init(ObjectInfoObject *self, PyObject *args)
     CATCH(-1, PyDict_SetItemString(factory_kwargs, "validator_object_factory",
                                    self_get_obj));
 
-    /* for column in self.cls_info.columns: */
-    CATCH(NULL, columns = PyObject_GetAttrString(self->cls_info, "columns"));
+    /* for column in self.cls_info.immediate_columns: */
+    CATCH(NULL, columns = PyObject_GetAttrString(self->cls_info,
+                                                 "immediate_columns"));
     for (i = 0; i != PyTuple_GET_SIZE(columns); i++) {
         /*
            variables[column] = \
@@ -1927,6 +1945,7 @@ ObjectInfo_init(ObjectInfoObject *self, PyObject *args)
     Py_DECREF(factory_kwargs);
     Py_DECREF(columns);
     Py_DECREF(primary_key);
+    Py_DECREF(compact);
     return 0;
 
 error:
@@ -1935,6 +1954,7 @@ error:
     Py_XDECREF(factory_kwargs);
     Py_XDECREF(columns);
     Py_XDECREF(primary_key);
+    Py_XDECREF(compact);
     return -1;
 }
 
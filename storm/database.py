@@ -25,20 +25,25 @@ This is the common code for database support; specific databases are
 supported in modules in L{storm.databases}.
 """
 
-from storm.expr import Expr, State, compile
+from time import time
+from weakref import WeakKeyDictionary
+import threading
+
+from storm.expr import Expr, State, StatementCache, compile
 # Circular import: imported at the end of the module.
 # from storm.tracer import trace
 from storm.variables import Variable
 from storm.xid import Xid
 from storm.exceptions import (
     ClosedError, ConnectionBlockedError, DatabaseError, DisconnectionError,
-    Error, ProgrammingError)
+    Error, PoolTimeoutError, ProgrammingError, URIError)
 from storm.uri import URI
 import storm
 
 
-__all__ = ["Database", "Connection", "Result",
-           "convert_param_marks", "create_database", "register_scheme"]
+__all__ = ["Database", "Connection", "ConnectionPool", "Result",
+           "convert_param_marks", "create_database", "get_statement_cache",
+           "register_scheme"]
 
 
 STATE_CONNECTED = 1
@@ -54,7 +59,9 @@ class Result(object):
     def __init__(self, connection, raw_cursor):
         self._connection = connection # Ensures deallocation order.
         self._raw_cursor = raw_cursor
-        if raw_cursor.arraysize == 1:
+        if connection.fetch_size is not None:
+            self._raw_cursor.arraysize = connection.fetch_size
+        elif raw_cursor.arraysize == 1:
             # Default of 1 is silly.
             self._raw_cursor.arraysize = 10
 
@@ -93,32 +100,56 @@ class Result(object):
         """Fetch all results from the cursor.
 
         The results will be converted to an appropriate format via
-        L{from_database}.
+        L{rows_from_database}.
 
         @raise DisconnectionError: Raised when the connection is lost.
             Reconnection happens automatically on rollback.
         """
         result = self._connection._check_disconnect(self._raw_cursor.fetchall)
         if result:
-            return [tuple(self.from_database(row)) for row in result]
+            return self.rows_from_database(result)
         return result
 
+    def get_many(self):
+        """Fetch the next batch of results from the cursor.
+
+        Up to C{arraysize} rows are fetched, and converted to an
+        appropriate format via L{rows_from_database}.
+
+        @raise DisconnectionError: Raised when the connection is lost.
+            Reconnection happens automatically on rollback.
+
+        @return: A list of converted rows, which is empty if no data
+            is left.
+        """
+        rows = self._connection._check_disconnect(self._raw_cursor.fetchmany)
+        if rows:
+            return self.rows_from_database(rows)
+        return []
+
+    def set_arraysize(self, size):
+        """Set the number of rows fetched from the database at a time.
+
+        @param size: The number of rows requested from the raw cursor
+            on each fetch when iterating the result.
+        """
+        self._raw_cursor.arraysize = size
+
     def __iter__(self):
         """Yield all results, one at a time.
 
-        The results will be converted to an appropriate format via
-        L{from_database}.
+        Rows are fetched C{arraysize} at a time, and each batch is
+        converted to an appropriate format via L{rows_from_database}.
 
         @raise DisconnectionError: Raised when the connection is lost.
             Reconnection happens automatically on rollback.
         """
         while True:
-            results = self._connection._check_disconnect(
-                self._raw_cursor.fetchmany)
+            results = self.get_many()
             if not results:
                 break
             for result in results:
-                yield tuple(self.from_database(result))
+                yield result
 
     @property
     def rowcount(self):
@@ -160,6 +191,23 @@ class Result(object):
         """
         return row
 
+    def rows_from_database(self, rows):
+        """Convert a batch of rows fetched from the database.
+
+        This method is intended to be overridden in subclasses, but
+        not called externally.
+
+        By default each row is converted with L{from_database}.  Backends
+        may override it to convert a whole batch at once, for instance
+        by leaving alone the rows which need no conversion.
+
+        @return: A list with a tuple for each row.
+        """
+        from_database = self.from_database
+        if from_database is Result.from_database:
+            return map(tuple, rows)
+        return [tuple(from_database(row)) for row in rows]
+
 
 class Connection(object):
     """A connection to a database.
@@ -170,11 +218,25 @@ class Connection(object):
     @cvar param_mark: The dbapi paramstyle that the database backend expects.
     @type compile: L{storm.expr.Compile}
     @cvar compile: The compiler to use for connections of this type.
+    @type max_parameters: C{int}
+    @cvar max_parameters: The maximum number of parameters the backend
+        accepts in a single statement, or C{None} if there's no limit.
+    @type statement_cache_size: C{int}
+    @cvar statement_cache_size: The size of the L{StatementCache} shared
+        by connections using the same compiler, or 0 to compile every
+        statement.
+    @type fetch_size: C{int}
+    @cvar fetch_size: The number of rows fetched from the database at a
+        time when iterating results, or C{None} to use the cursor's
+        default.  It may be changed for a single connection too.
     """
 
     result_factory = Result
     param_mark = "?"
     compile = compile
+    max_parameters = None
+    statement_cache_size = 1000
+    fetch_size = None
 
     _blocked = False
     _closed = False
@@ -185,7 +247,12 @@ class Connection(object):
     def __init__(self, database, event=None):
         self._database = database # Ensures deallocation order.
         self._event = event
-        self._raw_connection = self._database.raw_connect()
+        self._raw_connection = self._database.get_raw_connection()
+        if self.statement_cache_size:
+            self._statement_cache = get_statement_cache(
+                self.compile, self.statement_cache_size)
+        else:
+            self._statement_cache = None
 
     def __del__(self):
         """Close the connection."""
@@ -208,13 +275,16 @@ class Connection(object):
         """Unblock access to the connection."""
         self._blocked = False
 
-    def execute(self, statement, params=None, noresult=False):
+    def execute(self, statement, params=None, noresult=False, stream=False):
         """Execute a statement with the given parameters.
 
         @type statement: L{Expr} or C{str}
         @param statement: The statement to execute. It will be
             compiled if necessary.
         @param noresult: If True, no result will be returned.
+        @param stream: If True, the statement is run with a cursor from
+            L{build_raw_stream_cursor}, so that rows are fetched from the
+            database as the result is consumed.
 
         @raise ConnectionBlockedError: Raised if access to the connection
             has been blocked with L{block_access}.
@@ -234,23 +304,50 @@ class Connection(object):
         if isinstance(statement, Expr):
             if params is not None:
                 raise ValueError("Can't pass parameters with expressions")
-            state = State()
-            statement = self.compile(statement, state)
-            params = state.parameters
+            if self._statement_cache is not None:
+                statement, params = self._statement_cache.compile(statement)
+            else:
+                state = State()
+                statement = self.compile(statement, state)
+                params = state.parameters
         statement = convert_param_marks(statement, "?", self.param_mark)
-        raw_cursor = self.raw_execute(statement, params)
+        if stream:
+            raw_cursor = self.raw_execute(statement, params, stream=True)
+        else:
+            raw_cursor = self.raw_execute(statement, params)
         if noresult:
             self._check_disconnect(raw_cursor.close)
             return None
         return self.result_factory(self, raw_cursor)
 
+    def execute_insert_many(self, insert, primary_variables):
+        """Execute a multi-row insert, filling in its primary variables.
+
+        @param insert: An L{Insert} expression with one tuple in its
+            C{values} for each row being inserted.
+        @param primary_variables: A sequence with one tuple of primary
+            key variables for each row, in the same order as the values.
+
+        @return: True if the rows were inserted, or False if the backend
+            can't retrieve the keys generated for several rows at once.
+            In the latter case nothing is executed, and each row must be
+            inserted individually.
+        """
+        for variables in primary_variables:
+            for variable in variables:
+                if not variable.is_defined():
+                    return False
+        self.execute(insert, noresult=True)
+        return True
+
     def close(self):
         """Close the connection if it is not already closed."""
         if not self._closed:
             self._closed = True
             if self._raw_connection is not None:
-                self._raw_connection.close()
+                raw_connection = self._raw_connection
                 self._raw_connection = None
+                self._database.release_raw_connection(raw_connection)
 
     def begin(self, xid):
         """Begin a two-phase transaction."""
@@ -320,7 +417,7 @@ class Connection(object):
                         self._raw_connection.rollback()
                 except Error, exc:
                     if self.is_disconnection_error(exc):
-                        self._raw_connection = None
+                        self._discard_raw_connection()
                         self._state = STATE_RECONNECT
                         self._two_phase_transaction = False
                     else:
@@ -357,7 +454,19 @@ class Connection(object):
         """
         return self._raw_connection.cursor()
 
-    def raw_execute(self, statement, params=None):
+    def build_raw_stream_cursor(self):
+        """Get a new dbapi cursor object which doesn't buffer results.
+
+        Backends supporting server-side cursors should override this
+        method to return one, so that rows are only transferred as
+        they're fetched.  By default a regular cursor is returned.
+
+        It is acceptable to override this method in subclasses, but it
+        is not intended to be called externally.
+        """
+        return self.build_raw_cursor()
+
+    def raw_execute(self, statement, params=None, stream=False):
         """Execute a raw statement with the given parameters.
 
         It's acceptable to override this method in subclasses, but it
@@ -366,15 +475,22 @@ class Connection(object):
         If the global C{DEBUG} is True, the statement will be printed
         to standard out.
 
-        @return: The dbapi cursor object, as fetched from L{build_raw_cursor}.
+        @param stream: If True, the statement is run with a cursor from
+            L{build_raw_stream_cursor}.
+
+        @return: The dbapi cursor object, as fetched from L{build_raw_cursor}
+            or L{build_raw_stream_cursor}.
         """
-        raw_cursor = self._check_disconnect(self.build_raw_cursor)
+        if stream:
+            raw_cursor = self._check_disconnect(self.build_raw_stream_cursor)
+        else:
+            raw_cursor = self._check_disconnect(self.build_raw_cursor)
         self._prepare_execution(raw_cursor, params, statement)
-        args = self._execution_args(params, statement)
+        args = self._execution_args(params, statement, stream)
         self._run_execution(raw_cursor, args, params, statement)
         return raw_cursor
 
-    def _execution_args(self, params, statement):
+    def _execution_args(self, params, statement, stream=False):
         """Get the appropriate statement execution arguments."""
         if params:
             args = (statement, tuple(self.to_database(params)))
@@ -422,7 +538,7 @@ class Connection(object):
             raise DisconnectionError("Already disconnected")
         elif self._state == STATE_RECONNECT:
             try:
-                self._raw_connection = self._database.raw_connect()
+                self._raw_connection = self._database.get_raw_connection()
             except DatabaseError, exc:
                 self._state = STATE_DISCONNECTED
                 self._raw_connection = None
@@ -455,11 +571,19 @@ class Connection(object):
         except Exception, exc:
             if self.is_disconnection_error(exc, extra_disconnection_errors):
                 self._state = STATE_DISCONNECTED
-                self._raw_connection = None
+                self._discard_raw_connection()
                 raise DisconnectionError(str(exc))
             else:
                 raise
 
+    def _discard_raw_connection(self):
+        """Forget about a raw connection which was found to be broken."""
+        raw_connection = self._raw_connection
+        self._raw_connection = None
+        if raw_connection is not None:
+            self._database.release_raw_connection(raw_connection,
+                                                  broken=True)
+
     def preset_primary_key(self, primary_columns, primary_variables):
         """Process primary variables before an insert happens.
 
@@ -475,9 +599,13 @@ class Database(object):
 
     @cvar connection_factory: A callable which will take this database
         and should return an instance of L{Connection}.
+    @cvar pool: A L{ConnectionPool} which connections get their raw
+        connections from, or C{None} to open a new raw connection for
+        each of them.  It may be set for a single database.
     """
 
     connection_factory = Connection
+    pool = None
 
     def connect(self, event=None):
         """Create a connection to the database.
@@ -503,6 +631,296 @@ class Database(object):
         """
         raise NotImplementedError
 
+    def reset_raw_connection(self, raw_connection):
+        """Clean up a raw connection before it's reused.
+
+        This is called by L{ConnectionPool} when a connection is given
+        back.  The connection is rolled back by default, and backends
+        may override this to also drop any other state of the session.
+        """
+        raw_connection.rollback()
+
+    def get_raw_connection(self):
+        """Return a raw connection for a L{Connection} to use.
+
+        The connection is taken from L{pool} if there is one, and opened
+        with L{raw_connect} otherwise.
+        """
+        if self.pool is None:
+            return self.raw_connect()
+        return self.pool.get()
+
+    def release_raw_connection(self, raw_connection, broken=False):
+        """Release a raw connection which a L{Connection} is done with.
+
+        @param raw_connection: A connection from L{get_raw_connection}.
+        @param broken: Whether the connection was found to be unusable,
+            in which case it's just dropped.
+        """
+        if self.pool is not None:
+            self.pool.put(raw_connection, broken)
+        elif not broken:
+            raw_connection.close()
+
+
+class ConnectionPool(object):
+    """A thread-safe pool of raw connections to a L{Database}.
+
+    Raw connections are opened with L{Database.raw_connect} when
+    needed, and reused by the connections of the database once they're
+    given back.  Connections are cleaned up with
+    L{Database.reset_raw_connection} when given back, and closed when
+    they've been idle or open for too long.
+
+    @ivar min_size: The number of idle connections which are kept open
+        even if they've been idle for longer than C{max_idle}.
+    @ivar max_size: The maximum number of connections open at once, or
+        C{None} for no limit.  Getting a connection blocks while that
+        many are in use.
+    @ivar max_idle: The number of seconds after which an idle
+        connection is closed, or C{None} to keep idle connections open.
+    @ivar max_lifetime: The number of seconds after which a connection
+        is closed instead of being reused, or C{None} for no limit.
+    @ivar check_query: A statement run on idle connections before
+        they're reused, which are discarded if it fails, or C{None} to
+        reuse them without checking.
+    @ivar timeout: The number of seconds to wait for a connection when
+        C{max_size} connections are in use, before giving up with
+        L{PoolTimeoutError}, or C{None} to wait forever.
+    """
+
+    _clock = time
+
+    def __init__(self, database, min_size=0, max_size=None, max_idle=None,
+                 max_lifetime=None, check_query=None, timeout=None):
+        if max_size is not None and max_size < 1:
+            raise ValueError("max_size must be positive, got %r" % max_size)
+        self._database = database
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_query = check_query
+        self.timeout = timeout
+        self._condition = threading.Condition()
+        # Idle connections, as (raw_connection, created, released) tuples,
+        # with the most recently released one last.
+        self._idle = []
+        # {id(raw_connection): created} for connections open and in use.
+        self._in_use = {}
+        self._size = 0
+        self._closed = False
+
+    @classmethod
+    def from_options(cls, database, options):
+        """Build a pool from the C{pool_*} options of a database URI.
+
+        @param database: The L{Database} to pool connections of.
+        @param options: The URI options, as a dict of strings.
+        @return: A L{ConnectionPool}, or C{None} if no pool option is
+            given.
+        """
+        converters = {"min_size": int, "max_size": int,
+                      "max_idle": float, "max_lifetime": float,
+                      "check_query": str, "timeout": float}
+        kwargs = {}
+        for key, value in options.iteritems():
+            if not key.startswith("pool_"):
+                continue
+            name = key[5:]
+            if name not in converters:
+                raise URIError("Unknown pool option: %s" % key)
+            try:
+                kwargs[name] = converters[name](value)
+            except ValueError:
+                raise URIError("Invalid value for %s: %r" % (key, value))
+        if not kwargs:
+            return None
+        return cls(database, **kwargs)
+
+    def get_stats(self):
+        """Return a dict with the number of connections C{"in_use"} and
+        C{"idle"}."""
+        self._condition.acquire()
+        try:
+            return {"in_use": len(self._in_use), "idle": len(self._idle)}
+        finally:
+            self._condition.release()
+
+    def get(self):
+        """Return a raw connection, opening one if none is idle.
+
+        @raise PoolTimeoutError: Raised if C{max_size} connections were
+            in use for longer than C{timeout}.
+        """
+        deadline = None
+        if self.timeout is not None:
+            deadline = self._clock() + self.timeout
+        while True:
+            self._condition.acquire()
+            try:
+                expired = self._pop_expired()
+                if self._idle:
+                    raw_connection, created, released = self._idle.pop()
+                    self._in_use[id(raw_connection)] = created
+                elif self.max_size is None or self._size < self.max_size:
+                    raw_connection = None
+                    self._size += 1
+                else:
+                    self._wait(deadline)
+                    continue
+            finally:
+                self._condition.release()
+            for expired_connection in expired:
+                self._close(expired_connection)
+            if raw_connection is None:
+                return self._open()
+            if self.check_query is None or self._check(raw_connection):
+                return raw_connection
+            self.put(raw_connection, broken=True)
+
+    def put(self, raw_connection, broken=False):
+        """Give back a raw connection obtained with L{get}.
+
+        The connection is reset with L{Database.reset_raw_connection} so
+        that it's clean when reused.  Connections which weren't obtained
+        from this pool are closed.
+
+        @param broken: Whether the connection was found to be unusable,
+            in which case it's dropped instead.
+        """
+        if not broken:
+            try:
+                self._database.reset_raw_connection(raw_connection)
+            except Exception:
+                broken = True
+        now = self._clock()
+        self._condition.acquire()
+        try:
+            created = self._in_use.pop(id(raw_connection), None)
+            if created is None:
+                for idle in self._idle:
+                    if idle[0] is raw_connection:
+                        # Already given back.
+                        return
+                # Not ours, so it's closed below, as nobody else would.
+            elif (broken or self._closed or
+                (self.max_lifetime is not None and
+                 now - created >= self.max_lifetime)):
+                self._size -= 1
+            else:
+                self._idle.append((raw_connection, created, now))
+                raw_connection = None
+            self._condition.notify()
+        finally:
+            self._condition.release()
+        if raw_connection is not None:
+            self._close(raw_connection)
+
+    def close(self):
+        """Close idle connections, and connections in use when given back.
+        """
+        self._condition.acquire()
+        try:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+            self._size -= len(idle)
+            self._condition.notifyAll()
+        finally:
+            self._condition.release()
+        for raw_connection, created, released in idle:
+            self._close(raw_connection)
+
+    def _open(self):
+        try:
+            raw_connection = self._database.raw_connect()
+        except:
+            self._condition.acquire()
+            try:
+                self._size -= 1
+                self._condition.notify()
+            finally:
+                self._condition.release()
+            raise
+        created = self._clock()
+        self._condition.acquire()
+        try:
+            self._in_use[id(raw_connection)] = created
+        finally:
+            self._condition.release()
+        return raw_connection
+
+    def _wait(self, deadline):
+        if deadline is None:
+            self._condition.wait()
+        else:
+            remaining = deadline - self._clock()
+            if remaining <= 0:
+                raise PoolTimeoutError("No connection available after "
+                                       "%s seconds" % self.timeout)
+            self._condition.wait(remaining)
+
+    def _pop_expired(self):
+        """Remove idle connections which shouldn't be reused any more.
+
+        This must be called with the lock held.
+
+        @return: The removed connections, which must be closed.
+        """
+        if self.max_idle is None and self.max_lifetime is None:
+            return []
+        now = self._clock()
+        kept = []
+        expired = []
+        # The oldest connections come first, so that the most recently
+        # used ones are kept when enforcing min_size.
+        for i, (raw_connection, created, released) in enumerate(self._idle):
+            if ((self.max_lifetime is not None and
+                 now - created >= self.max_lifetime) or
+                (self.max_idle is not None and
+                 now - released >= self.max_idle and
+                 len(self._idle) - i > self.min_size)):
+                expired.append(raw_connection)
+            else:
+                kept.append((raw_connection, created, released))
+        self._idle = kept
+        self._size -= len(expired)
+        return expired
+
+    def _check(self, raw_connection):
+        try:
+            cursor = raw_connection.cursor()
+            cursor.execute(self.check_query)
+            cursor.fetchall()
+            cursor.close()
+            raw_connection.rollback()
+        except Exception:
+            return False
+        return True
+
+    @staticmethod
+    def _close(raw_connection):
+        try:
+            raw_connection.close()
+        except Exception:
+            pass
+
+
+_statement_caches = WeakKeyDictionary()
+
+def get_statement_cache(compile, size=1000):
+    """Return the L{StatementCache} shared by users of the given compiler.
+
+    @param compile: A L{Compile} instance.
+    @param size: The size of the cache, if it's created by this call.
+    """
+    statement_cache = _statement_caches.get(compile)
+    if statement_cache is None:
+        statement_cache = _statement_caches[compile] = \
+            StatementCache(compile, size)
+    return statement_cache
+
 
 def convert_param_marks(statement, from_param_mark, to_param_mark):
     # TODO: Add support for $foo$bar$foo$ literals.
@@ -545,7 +963,11 @@ def create_database(uri):
         module = __import__("%s.databases.%s" % (storm.__name__, uri.scheme),
                             None, None, [""])
         factory = module.create_from_uri
-    return factory(uri)
+    database = factory(uri)
+    pool = ConnectionPool.from_options(database, uri.options)
+    if pool is not None:
+        database.pool = pool
+    return database
 
 # Deal with circular import.
 from storm.tracer import trace
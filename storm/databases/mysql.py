@@ -27,6 +27,7 @@ from storm.databases import dummy
 try:
     import MySQLdb
     import MySQLdb.converters
+    import MySQLdb.cursors
 except ImportError:
     MySQLdb = dummy
 
@@ -76,6 +77,23 @@ class MySQLResult(Result):
             else:
                 yield value
 
+    def rows_from_database(self, rows):
+        """
+        Like L{Result.rows_from_database}, but only rebuild the rows
+        containing C{array} instances.
+        """
+        if self.from_database is not MySQLResult.from_database:
+            return Result.rows_from_database(self, rows)
+        converted = []
+        for row in rows:
+            for value in row:
+                if isinstance(value, array):
+                    row = [value.tostring() if isinstance(value, array) else value
+                           for value in row]
+                    break
+            converted.append(tuple(row))
+        return converted
+
 
 class MySQLConnection(Connection):
 
@@ -83,7 +101,7 @@ class MySQLConnection(Connection):
     param_mark = "%s"
     compile = compile
 
-    def execute(self, statement, params=None, noresult=False):
+    def execute(self, statement, params=None, noresult=False, stream=False):
         if (isinstance(statement, Insert) and
             statement.primary_variables is not Undef):
 
@@ -105,7 +123,16 @@ class MySQLConnection(Connection):
             if noresult:
                 result = None
             return result
-        return Connection.execute(self, statement, params, noresult)
+        return Connection.execute(self, statement, params, noresult, stream)
+
+    def build_raw_stream_cursor(self):
+        """
+        Like L{Connection.build_raw_stream_cursor}, but return an
+        C{SSCursor}, which reads rows from the server as they're fetched.
+        No other statement may be run on the connection until all of its
+        rows are read or it's closed.
+        """
+        return self._raw_connection.cursor(MySQLdb.cursors.SSCursor)
 
     def to_database(self, params):
         for param in params:
@@ -142,11 +169,11 @@ class MySQLConnection(Connection):
                 'extra_disconnection_errors', ())
             if self.is_disconnection_error(exc, extra_disconnection_errors):
                 self._state = STATE_DISCONNECTED
-                self._raw_connection = None
+                self._discard_raw_connection()
                 raise DisconnectionError(str(exc))
             elif self.is_read_only_error(exc):
                 self._state = STATE_DISCONNECTED
-                self._raw_connection = None
+                self._discard_raw_connection()
                 raise ReadOnlyError(str(exc))
             raise
 
@@ -18,8 +18,13 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
+from collections import OrderedDict
 from datetime import datetime, date, time, timedelta
+from decimal import Decimal
 from distutils.version import LooseVersion
+from itertools import count
+import math
+import re
 
 from storm.databases import dummy
 
@@ -46,8 +51,8 @@ from storm.expr import (
 from storm.variables import Variable, ListVariable
 from storm.database import Database, Connection, Result
 from storm.exceptions import (
-    install_exceptions, DatabaseError, DatabaseModuleError, InterfaceError,
-    OperationalError, ProgrammingError, TimeoutError, Error)
+    install_exceptions, DatabaseError, DatabaseModuleError, DisconnectionError,
+    InterfaceError, OperationalError, ProgrammingError, TimeoutError, Error)
 from storm.tracer import TimeoutTracer
 
 
@@ -234,13 +239,177 @@ pg_connection_failure_codes = frozenset([
     ])
 
 
+# Statements which may be prepared, as long as they're a single statement.
+_preparable_commands = frozenset(["SELECT", "INSERT", "UPDATE", "DELETE",
+                                  "VALUES"])
+
+_param_mark = re.compile("%(.)")
+
+
+def convert_to_numbered_params(statement, params_count):
+    """Convert a statement with psycopg2 parameters to $N parameters.
+
+    @param statement: The statement, which will be interpolated by
+        psycopg2 if C{params_count} isn't 0.
+    @param params_count: The number of parameters of the statement.
+
+    @return: The statement suitable for a PREPARE command, or C{None}
+        if it can't be converted.
+    """
+    if not params_count:
+        return statement
+    counter = [0]
+    def replace(match):
+        mark = match.group(1)
+        if mark == "%":
+            return "%"
+        if mark != "s":
+            raise ValueError(mark)
+        counter[0] += 1
+        return "$%d" % counter[0]
+    try:
+        statement = _param_mark.sub(replace, statement)
+    except ValueError:
+        return None
+    if counter[0] != params_count:
+        return None
+    return statement
+
+
+def get_parameter_type(param):
+    """Return the type to prepare a statement parameter with.
+
+    The type is the one PostgreSQL gives to the literal psycopg2
+    interpolates for the parameter, so that a prepared statement
+    behaves like the statement it replaces even where nothing else
+    constrains the type of the parameter, like in C{SELECT $1}.
+
+    @param param: The parameter, as given to psycopg2.
+    @return: The name of the type, C{"unknown"} for quoted strings and
+        C{NULL} whose type depends on where they're used, or C{None}
+        if the type can't be told.
+    """
+    if param is None or isinstance(param, str):
+        return "unknown"
+    if isinstance(param, bool):
+        return "boolean"
+    if isinstance(param, (int, long)):
+        if -2**31 < param < 2**31:
+            return "integer"
+        if -2**63 < param < 2**63:
+            return "bigint"
+        return "numeric"
+    if isinstance(param, float):
+        if math.isnan(param) or math.isinf(param):
+            return "double precision"
+        return "numeric"
+    if isinstance(param, Decimal):
+        return "numeric"
+    if isinstance(param, psycopg2.extensions.Binary):
+        return "bytea"
+    return None
+
+
+# Statement names are unique in the whole process, so that they can't
+# clash with statements left in a session by a previous user of its raw
+# connection.
+_prepared_statement_ids = count(1)
+
+
+class PreparedStatements(object):
+    """Bookkeeping of the statements prepared in a PostgreSQL session.
+
+    Statement texts are counted as they're executed, along with the
+    types of their parameters, and should be prepared once executed
+    C{threshold} times.  At most C{size}
+    statements are kept prepared, and the least recently used one
+    should be deallocated to make room for a new one.
+
+    @ivar raw_connection: The raw connection of the session in which
+        the statements were prepared.
+    """
+
+    def __init__(self, size, threshold):
+        self.size = size
+        self.threshold = threshold
+        self.raw_connection = None
+        self._names = OrderedDict()
+        self._counts = {}
+        self._unpreparable = set()
+
+    def reset(self, raw_connection):
+        """Forget all statements, since a new session was started."""
+        self.raw_connection = raw_connection
+        self._names.clear()
+        self._counts.clear()
+
+    def get_name(self, statement, param_types=()):
+        """Return the name of the given statement if it was prepared.
+
+        The statement becomes the most recently used one.
+        """
+        key = (statement, param_types)
+        name = self._names.pop(key, None)
+        if name is not None:
+            self._names[key] = name
+        return name
+
+    def should_prepare(self, statement, param_types=()):
+        """Count an execution of the given statement, which isn't prepared.
+
+        @return: True if the statement should be prepared now.
+        """
+        key = (statement, param_types)
+        if key in self._unpreparable:
+            return False
+        count = self._counts.get(key, 0) + 1
+        if count < self.threshold:
+            # Don't let the statements executed only a few times pile up.
+            if len(self._counts) >= self.size * 10:
+                self._counts.clear()
+            self._counts[key] = count
+            return False
+        self._counts.pop(key, None)
+        return True
+
+    def add(self, statement, param_types=()):
+        """Register the given statement as prepared.
+
+        @return: A tuple with the name to prepare the statement with,
+            and the name of the statement to deallocate, or C{None}.
+        """
+        name = "storm_%d" % _prepared_statement_ids.next()
+        evicted_name = None
+        if len(self._names) >= self.size:
+            evicted_name = self._names.popitem(last=False)[1]
+        self._names[statement, param_types] = name
+        return name, evicted_name
+
+    def set_unpreparable(self, statement, param_types=()):
+        """Remember that the given statement can't be prepared."""
+        key = (statement, param_types)
+        self._names.pop(key, None)
+        if len(self._unpreparable) >= self.size * 10:
+            self._unpreparable.clear()
+        self._unpreparable.add(key)
+
+
 class PostgresConnection(Connection):
 
     result_factory = PostgresResult
     param_mark = "%s"
     compile = compile
 
-    def execute(self, statement, params=None, noresult=False):
+    def __init__(self, database, event=None):
+        Connection.__init__(self, database, event)
+        if database._prepared_statements:
+            self._prepared_statements = PreparedStatements(
+                database._prepared_statements, database._prepare_threshold)
+        else:
+            self._prepared_statements = None
+        self._stream_cursor_ids = count(1)
+
+    def execute(self, statement, params=None, noresult=False, stream=False):
         """Execute a statement with the given parameters.
 
         This extends the L{Connection.execute} method to add support
@@ -263,9 +432,53 @@ class PostgresConnection(Connection):
                 result.set_variable(variable, value)
             return result
 
-        return Connection.execute(self, statement, params, noresult)
+        return Connection.execute(self, statement, params, noresult, stream)
+
+    def execute_insert_many(self, insert, primary_variables):
+        """
+        Like L{Connection.execute_insert_many}, but use a RETURNING
+        clause to retrieve the primary keys generated for all rows.
+
+        Returned rows are matched with the inserted ones by position.
+        PostgreSQL doesn't document the order of the rows returned by
+        an C{INSERT ... VALUES}, but it inserts and returns them in the
+        order of the C{VALUES} list, which the test suite checks.  When
+        all the keys are known beforehand, RETURNING isn't used at all.
+        """
+        if self._database._version < 80200:
+            return Connection.execute_insert_many(self, insert,
+                                                  primary_variables)
+        for variables in primary_variables:
+            for variable in variables:
+                if not variable.is_defined():
+                    break
+            else:
+                continue
+            break
+        else:
+            return Connection.execute_insert_many(self, insert,
+                                                  primary_variables)
+        result = Connection.execute(
+            self, Returning(insert, insert.primary_columns))
+        for variables, values in zip(primary_variables, result.get_all()):
+            for variable, value in zip(variables, values):
+                result.set_variable(variable, value)
+        return True
+
+    def build_raw_stream_cursor(self):
+        """
+        Like L{Connection.build_raw_stream_cursor}, but return a named
+        cursor, which keeps the result on the server and fetches
+        C{arraysize} rows at a time.  Named cursors only live within a
+        transaction, so a regular cursor is used in autocommit mode.
+        """
+        if (self._database._isolation ==
+            psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT):
+            return self.build_raw_cursor()
+        return self._raw_connection.cursor(
+            "storm_stream_%d" % self._stream_cursor_ids.next())
 
-    def raw_execute(self, statement, params):
+    def raw_execute(self, statement, params, stream=False):
         """
         Like L{Connection.raw_execute}, but encode the statement to
         UTF-8 if it is unicode.
@@ -273,7 +486,105 @@ class PostgresConnection(Connection):
         if type(statement) is unicode:
             # psycopg breaks with unicode statements.
             statement = statement.encode("UTF-8")
-        return Connection.raw_execute(self, statement, params)
+        return Connection.raw_execute(self, statement, params, stream)
+
+    def _execution_args(self, params, statement, stream=False):
+        """
+        Like L{Connection._execution_args}, but execute the statement
+        through a server-side prepared statement if it's frequently used
+        and prepared statements are enabled.  Tracers still get the
+        original statement.
+        """
+        # Named cursors are declared for the statement itself, which
+        # can't be an EXECUTE.
+        if self._prepared_statements is None or stream:
+            return Connection._execution_args(self, params, statement, stream)
+        params = tuple(self.to_database(params or ()))
+        name = self._get_prepared_statement(statement, params)
+        if name is not None:
+            if params:
+                statement = "EXECUTE %s (%s)" % (
+                    name, ", ".join(["%s"] * len(params)))
+            else:
+                statement = "EXECUTE %s" % name
+        if params:
+            return (statement, params)
+        return (statement,)
+
+    def _get_prepared_statement(self, statement, params):
+        """Return the name of the statement prepared for C{statement}.
+
+        The statement is prepared if it was executed often enough with
+        parameters of the same types.
+
+        @param params: The parameters, as given to psycopg2.
+        @return: The name of the prepared statement, or C{None} if it's
+            not prepared.
+        """
+        prepared_statements = self._prepared_statements
+        if prepared_statements.raw_connection is not self._raw_connection:
+            # Prepared statements are lost along with the session, so
+            # they have to be prepared again after reconnecting.
+            prepared_statements.reset(self._raw_connection)
+        param_types = tuple(get_parameter_type(param) for param in params)
+        if None in param_types:
+            return None
+        name = prepared_statements.get_name(statement, param_types)
+        if name is not None:
+            return name
+        command = statement.split(None, 1)[:1]
+        if (not command or command[0].upper() not in _preparable_commands or
+            ";" in statement):
+            return None
+        if not prepared_statements.should_prepare(statement, param_types):
+            return None
+        numbered_statement = convert_to_numbered_params(
+            statement, len(params))
+        if numbered_statement is None:
+            prepared_statements.set_unpreparable(statement, param_types)
+            return None
+        if (self._raw_connection.get_transaction_status() ==
+            psycopg2.extensions.TRANSACTION_STATUS_INERROR):
+            # Nothing can be run before the transaction is rolled back.
+            return None
+
+        name, evicted_name = prepared_statements.add(statement, param_types)
+        if param_types:
+            name_and_types = "%s (%s)" % (name, ", ".join(param_types))
+        else:
+            name_and_types = name
+        # A failing PREPARE would abort the current transaction, so it's
+        # run within a savepoint unless there's no transaction at all.
+        use_savepoint = (self._database._isolation !=
+                         psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        raw_cursor = self._check_disconnect(self.build_raw_cursor)
+        try:
+            if evicted_name is not None:
+                self._check_disconnect(raw_cursor.execute,
+                                       "DEALLOCATE %s" % evicted_name)
+            if use_savepoint:
+                self._check_disconnect(raw_cursor.execute,
+                                       "SAVEPOINT storm_prepare")
+            try:
+                self._check_disconnect(
+                    raw_cursor.execute,
+                    "PREPARE %s AS %s" % (name_and_types,
+                                          numbered_statement))
+            except DisconnectionError:
+                raise
+            except Error:
+                if use_savepoint:
+                    self._check_disconnect(
+                        raw_cursor.execute,
+                        "ROLLBACK TO SAVEPOINT storm_prepare")
+                prepared_statements.set_unpreparable(statement, param_types)
+                name = None
+            if use_savepoint:
+                self._check_disconnect(raw_cursor.execute,
+                                       "RELEASE SAVEPOINT storm_prepare")
+        finally:
+            raw_cursor.close()
+        return name
 
     def to_database(self, params):
         """
@@ -332,15 +643,23 @@ class PostgresConnection(Connection):
 
 
 class Postgres(Database):
+    """A PostgreSQL database.
+
+    Besides C{isolation}, the C{timezone}, C{statement_timeout} and
+    C{application_name} URI options set the respective session
+    settings on every new connection.  These are sent along with the
+    statements given to L{add_setup_statement}, in a single round trip.
+    """
 
     connection_factory = PostgresConnection
 
-    # An integer representing the server version.  If the server does
-    # not support the server_version_num variable, this will be set to
-    # 0.  In practice, this means the variable will be 0 or greater
-    # than or equal to 80200.
+    # An integer representing the server version, found out on the first
+    # connection.  If neither psycopg2 nor the server_version_num variable
+    # tell the version, this will be set to 0.
     _version = None
 
+    _session_settings = ("timezone", "statement_timeout", "application_name")
+
     def __init__(self, uri):
         if psycopg2 is dummy:
             raise DatabaseModuleError(
@@ -364,25 +683,81 @@ class Postgres(Database):
                 "Unknown serialization level %r: expected one of "
                 "'autocommit', 'serializable', 'read-committed'" %
                 (isolation,))
+        # Server-side prepared statements are kept per connection, so
+        # they don't work through poolers in transaction mode.
+        self._prepared_statements = int(
+            uri.options.get("prepared_statements", 0))
+        self._prepare_threshold = int(uri.options.get("prepare_threshold", 5))
+        self._settings = [(name, uri.options[name])
+                          for name in self._session_settings
+                          if name in uri.options]
+        self._setup_statements = []
+
+    def add_setup_statement(self, statement):
+        """Run the given SQL statement on every new raw connection.
+
+        Statements run in order, after the session settings, and before
+        the first transaction of the connection starts.  Their effects
+        are permanent, as they run in autocommit mode.
+        """
+        self._setup_statements.append(statement)
+
+    def reset_raw_connection(self, raw_connection):
+        """See L{Database.reset_raw_connection}.
+
+        Prepared statements are deallocated as well, since the next
+        connection using the raw connection doesn't know about them.
+        """
+        Database.reset_raw_connection(self, raw_connection)
+        if self._prepared_statements:
+            cursor = raw_connection.cursor()
+            cursor.execute("DEALLOCATE ALL")
+            cursor.close()
+            # Unless in autocommit mode, that started a transaction.
+            raw_connection.rollback()
 
     def raw_connect(self):
         raw_connection = psycopg2.connect(self._dsn)
 
+        # Setting up the connection in autocommit mode avoids the round
+        # trips of opening and ending a transaction around it.
+        raw_connection.set_isolation_level(
+            psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+
         if self._version is None:
-            cursor = raw_connection.cursor()
+            self._version = self._get_server_version(raw_connection)
 
-            try:
-                cursor.execute("SHOW server_version_num")
-            except psycopg2.ProgrammingError:
-                self._version = 0
+        raw_connection.set_client_encoding("UTF8")
+
+        if self._settings or self._setup_statements:
+            statements = ["SET %s TO %%s" % name
+                          for name, value in self._settings]
+            params = [value for name, value in self._settings]
+            if params:
+                statements.extend(statement.replace("%", "%%")
+                                  for statement in self._setup_statements)
             else:
-                self._version = int(cursor.fetchone()[0])
-            raw_connection.rollback()
+                statements.extend(self._setup_statements)
+                params = None
+            cursor = raw_connection.cursor()
+            cursor.execute("; ".join(statements), params)
+            cursor.close()
 
-        raw_connection.set_client_encoding("UTF8")
         raw_connection.set_isolation_level(self._isolation)
         return raw_connection
 
+    def _get_server_version(self, raw_connection):
+        # psycopg2 gets the version when connecting.
+        version = getattr(raw_connection, "server_version", None)
+        if version is not None:
+            return version
+        cursor = raw_connection.cursor()
+        try:
+            cursor.execute("SHOW server_version_num")
+        except psycopg2.ProgrammingError:
+            return 0
+        return int(cursor.fetchone()[0])
+
 
 create_from_uri = Postgres
 
@@ -409,6 +784,10 @@ def make_dsn(uri):
 class PostgresTimeoutTracer(TimeoutTracer):
 
     def set_statement_timeout(self, raw_cursor, remaining_time):
+        if raw_cursor.name is not None:
+            # Named cursors can only run the statement they're declared
+            # for, so the timeout is set through a regular cursor.
+            raw_cursor = raw_cursor.connection.cursor()
         raw_cursor.execute("SET statement_timeout TO %d" %
                            (remaining_time * 1000))
 
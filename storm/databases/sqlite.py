@@ -100,11 +100,30 @@ class SQLiteResult(Result):
             else:
                 yield value
 
+    def rows_from_database(self, rows):
+        """
+        Like L{Result.rows_from_database}, but only rebuild the rows
+        containing C{buffer} instances.
+        """
+        if self.from_database is not SQLiteResult.from_database:
+            return Result.rows_from_database(self, rows)
+        converted = []
+        for row in rows:
+            for value in row:
+                if isinstance(value, buffer):
+                    row = [str(value) if isinstance(value, buffer) else value
+                           for value in row]
+                    break
+            converted.append(tuple(row))
+        return converted
+
 
 class SQLiteConnection(Connection):
 
     result_factory = SQLiteResult
     compile = compile
+    # SQLITE_MAX_VARIABLE_NUMBER defaults to 999 before SQLite 3.32.0.
+    max_parameters = 999
     _in_transaction = False
 
     @staticmethod
@@ -135,7 +154,7 @@ class SQLiteConnection(Connection):
         if self._in_transaction:
             self.raw_execute("ROLLBACK", _end=True)
 
-    def raw_execute(self, statement, params=None, _end=False):
+    def raw_execute(self, statement, params=None, stream=False, _end=False):
         """Execute a raw statement with the given parameters.
 
         This method will automatically retry on locked database errors.
@@ -156,7 +175,7 @@ class SQLiteConnection(Connection):
         started = now()
         while True:
             try:
-                return Connection.raw_execute(self, statement, params)
+                return Connection.raw_execute(self, statement, params, stream)
             except sqlite.OperationalError, e:
                 if str(e) != "database is locked":
                     raise
@@ -140,6 +140,10 @@ class ConnectionBlockedError(StormError):
     """Raised when an attempt is made to use a blocked connection."""
 
 
+class PoolTimeoutError(StormError):
+    """Raised when no pooled connection became available in time."""
+
+
 def install_exceptions(module):
     for exception in (Error, Warning, DatabaseError, InternalError,
                       OperationalError, ProgrammingError, IntegrityError,
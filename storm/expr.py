@@ -1359,6 +1359,39 @@ def compile_cast(compile, cast, state):
     return "CAST(%s AS %s)" % (column, cast.type)
 
 
+class Case(Expr):
+    """A representation of C{CASE} expressions.
+
+    @param cases: A sequence of C{(condition, result)} tuples or, if
+        C{expression} is given, of C{(value, result)} tuples.
+    @param expression: The expression compared to the values of each
+        case, when using the simple form of C{CASE}.
+    @param default: The result when no case matches.
+    """
+    __slots__ = ("cases", "expression", "default")
+
+    def __init__(self, cases, expression=Undef, default=Undef):
+        self.cases = cases
+        self.expression = expression
+        self.default = default
+
+@compile.when(Case)
+def compile_case(compile, case, state):
+    state.push("context", EXPR)
+    tokens = ["CASE "]
+    if case.expression is not Undef:
+        tokens.append(compile(case.expression, state))
+        tokens.append(" ")
+    for condition, result in case.cases:
+        tokens.append("WHEN %s THEN %s " % (compile(condition, state),
+                                            compile(result, state)))
+    if case.default is not Undef:
+        tokens.append("ELSE %s " % compile(case.default, state))
+    tokens.append("END")
+    state.pop()
+    return "".join(tokens)
+
+
 # --------------------------------------------------------------------
 # Prefix and suffix expressions
 
@@ -1533,6 +1566,228 @@ def compile_auto_tables(compile, expr, state):
     return statement
 
 
+# --------------------------------------------------------------------
+# Statement caching
+
+class _Uncacheable(Exception):
+    """Raised when the shape of an expression can't be fingerprinted."""
+
+
+# Types of values which are fingerprinted by value, since they may be
+# compiled inline (e.g. names and limits) rather than as parameters.
+_value_types = frozenset([str, unicode, int, long, float, bool, Decimal,
+                          datetime, date, time, timedelta, type(None),
+                          SQLRaw, SQLToken])
+
+# Attributes which don't affect how expressions are compiled.
+_ignored_attributes = frozenset(["compile_cache", "compile_id",
+                                 "primary", "variable_factory"])
+
+_reference = object()
+_unset = object()
+_parameter = object()
+_opaque = object()
+_uncacheable = object()
+
+
+class StatementCache(object):
+    """Cache of compiled statements, keyed on the shape of expressions.
+
+    Expressions built by the same code paths usually differ only in the
+    variables holding their parameters.  The cache fingerprints the
+    structure of an expression (the types of its nodes, the columns and
+    tables it refers to, and any values which may be compiled inline)
+    and reuses the statement compiled for an earlier expression with
+    the same fingerprint, only taking the parameters from the new one.
+
+    It works on top of any L{Compile} instance, including the one
+    implemented in the C extension.  Expressions holding variables which
+    aren't compiled as plain parameters are always compiled.
+
+    Once C{size} statements are cached, they're moved to an old
+    generation which is dropped when the new one fills up, so that
+    statements which aren't used anymore are eventually forgotten.
+
+    @note: Cached statements aren't invalidated when the compiler is
+        changed, so L{clear} must be called after registering handlers
+        or reserved words in a compiler which was already used.
+    """
+
+    def __init__(self, compile, size=1000):
+        """
+        @param compile: The L{Compile} instance used to compile
+            statements which aren't cached.
+        @param size: The number of statements in each generation.
+        """
+        self._compile = compile
+        self._size = size
+        self._new_cache = {}
+        self._old_cache = {}
+        self._attributes = {}
+        self._hits = 0
+        self._misses = 0
+
+    def clear(self):
+        """Forget all cached statements."""
+        self._new_cache.clear()
+        self._old_cache.clear()
+        self._attributes.clear()
+
+    def get_stats(self):
+        """Return a dict with the number of statements, hits and misses."""
+        return {"statements": len(self._new_cache) + len(self._old_cache),
+                "hits": self._hits,
+                "misses": self._misses}
+
+    def compile(self, expr):
+        """Compile the given expression, reusing a cached statement if any.
+
+        @return: A C{(statement, parameters)} tuple, as would be obtained
+            from the compiled statement and the parameters in its
+            L{State}.
+        """
+        key = []
+        variables = []
+        try:
+            self._build_key(expr, key, variables, {})
+        except _Uncacheable:
+            state = State()
+            statement = self._compile(expr, state)
+            return statement, state.parameters
+        key = tuple(key)
+
+        entry = self._new_cache.get(key)
+        if entry is None:
+            entry = self._old_cache.pop(key, None)
+            if entry is None:
+                self._misses += 1
+                state = State()
+                statement = self._compile(expr, state)
+                # Parameters are taken from the variables of later
+                # expressions by position.  Others were created while
+                # compiling values which are part of the key, and are
+                # the same for all expressions with this shape.
+                positions = dict((id(variable), i)
+                                 for i, variable in enumerate(variables))
+                parameters = []
+                for parameter in state.parameters:
+                    i = positions.get(id(parameter))
+                    if i is None:
+                        parameters.append((None, parameter))
+                    else:
+                        parameters.append((i, None))
+                self._add(key, (statement, parameters))
+                return statement, state.parameters
+            self._add(key, entry)
+
+        self._hits += 1
+        statement, parameters = entry
+        return statement, [variables[i] if i is not None else parameter
+                            for i, parameter in parameters]
+
+    def _add(self, key, entry):
+        if len(self._new_cache) >= self._size:
+            self._old_cache = self._new_cache
+            self._new_cache = {}
+        self._new_cache[key] = entry
+
+    def _build_key(self, expr, key, variables, seen):
+        expr_type = type(expr)
+        if expr_type in _value_types:
+            key.append(expr_type)
+            key.append(expr)
+            return
+
+        # Keep track of objects seen more than once, since the same
+        # object in several places may not compile like several objects.
+        expr_id = id(expr)
+        if expr_id in seen:
+            key.append(_reference)
+            key.append(seen[expr_id])
+            return
+        seen[expr_id] = len(seen)
+
+        key.append(expr_type)
+        if expr_type is tuple or expr_type is list:
+            key.append(len(expr))
+            for subexpr in expr:
+                self._build_key(subexpr, key, variables, seen)
+            return
+        if expr_type is dict:
+            key.append(len(expr))
+            for name, value in expr.iteritems():
+                self._build_key(name, key, variables, seen)
+                self._build_key(value, key, variables, seen)
+            return
+
+        attributes = self._attributes.get(expr_type)
+        if attributes is None:
+            attributes = self._get_attributes(expr_type)
+        if attributes is _parameter:
+            variables.append(expr)
+        elif attributes is _uncacheable:
+            raise _Uncacheable()
+        elif attributes is _opaque:
+            if expr_type is set or expr_type is frozenset:
+                key.append(len(expr))
+                for subexpr in expr:
+                    self._build_key(subexpr, key, variables, seen)
+            else:
+                try:
+                    hash(expr)
+                except TypeError:
+                    raise _Uncacheable()
+                key.append(expr)
+        else:
+            names, follow_dict = attributes
+            for name in names:
+                self._build_key(getattr(expr, name, _unset),
+                                key, variables, seen)
+            if follow_dict:
+                items = expr.__dict__
+                key.append(len(items))
+                for name, value in sorted(items.iteritems()):
+                    key.append(name)
+                    self._build_key(value, key, variables, seen)
+
+    def _get_attributes(self, cls):
+        """Return how instances of the given class are fingerprinted.
+
+        This is C{_parameter} for variables compiled as parameters,
+        C{_uncacheable} for variables compiled depending on their value,
+        C{_opaque} for objects fingerprinted by themselves, or for
+        expressions a tuple with the names of the attributes to follow
+        and whether to follow the instance dictionary as well.
+        """
+        if issubclass(cls, Variable):
+            dispatch_table = self._compile._dispatch_table
+            for mro_cls in cls.__mro__:
+                if mro_cls in dispatch_table:
+                    break
+            if dispatch_table.get(mro_cls) is compile_variable:
+                attributes = _parameter
+            else:
+                attributes = _uncacheable
+        elif issubclass(cls, Expr):
+            names = []
+            for mro_cls in reversed(cls.__mro__):
+                slots = mro_cls.__dict__.get("__slots__", ())
+                if isinstance(slots, basestring):
+                    slots = (slots,)
+                names.extend(name for name in slots
+                             if name not in _ignored_attributes)
+            # Columns only compile by their name and table, while other
+            # expressions may keep what they compile from in attributes
+            # of classes without __slots__.
+            follow_dict = (cls.__dictoffset__ != 0 and
+                           not issubclass(cls, Column))
+            attributes = (tuple(names), follow_dict)
+        else:
+            attributes = _opaque
+        self._attributes[cls] = attributes
+        return attributes
+
+
 # --------------------------------------------------------------------
 # Set operator precedences.
 
@@ -24,11 +24,14 @@ from storm.exceptions import ClassInfoError
 from storm.expr import Column, Desc, TABLE
 from storm.expr import compile, Table
 from storm.event import EventSystem
+from storm.variables import (
+    IntVariable, LazyValue, MutableValueVariable, RawStrVariable,
+    UnicodeVariable)
 from storm import Undef, has_cextensions
 
 
 __all__ = ["get_obj_info", "set_obj_info", "get_cls_info",
-           "ClassInfo", "ObjectInfo", "ClassAlias"]
+           "ClassInfo", "ObjectInfo", "CompactVariables", "ClassAlias"]
 
 
 def get_obj_info(obj):
@@ -64,6 +67,31 @@ class ClassInfo(dict):
     @ivar columns: Tuple of column properties found in the class.
     @ivar primary_key: Tuple of column properties used to form the primary key
     @ivar primary_key_pos: Position of primary_key items in the columns tuple.
+    @ivar eager_columns: Tuple of columns loaded along with objects, which
+        excludes the ones in lazy groups.
+    @ivar eager_primary_key_pos: Position of primary_key items in the
+        eager_columns tuple.
+    @ivar lazy_columns: Tuple of columns in lazy groups, which are only
+        loaded when first accessed.
+    @ivar primary_key_selects: Dict mapping compilers to the statement
+        selecting objects of the class by primary key, as compiled by
+        the store, or C{False} if it can't be reused.
+    @ivar row_class: The L{storm.store.ReadOnlyRow} subclass used for
+        rows of the class in read-only result sets, or C{None} if it
+        wasn't built yet.
+    @ivar compact: Whether objects of the class keep their variables in
+        L{CompactVariables}, as requested with a true C{__storm_compact__}
+        class attribute.
+    @ivar deferred_columns: Tuple of columns whose variables are only
+        built when first used, which is empty unless the class is compact.
+    @ivar deferred_idx: Dict mapping the ids of deferred columns to their
+        position in C{deferred_columns}.
+    @ivar immediate_columns: Tuple of columns whose variables are built
+        along with the L{ObjectInfo}.
+    @ivar primary_key_types: Tuple with, for each primary key column, the
+        tuple of types of raw values which are used unchanged as the
+        identity of objects, or C{None} if the values must always be
+        converted by variables.  See L{get_primary_values}.
     """
 
     def __init__(self, cls):
@@ -123,6 +151,49 @@ class ClassInfo(dict):
         self.primary_key_pos = tuple(id_positions[id(column)]
                                      for column in self.primary_key)
 
+        self.eager_columns = tuple(
+            column for column in self.columns
+            if getattr(column, "lazy_group", None) is None)
+        self.lazy_columns = tuple(
+            column for column in self.columns
+            if getattr(column, "lazy_group", None) is not None)
+        if not self.lazy_columns:
+            self.eager_columns = self.columns
+            self.eager_primary_key_pos = self.primary_key_pos
+        else:
+            id_positions = dict((id(column), i)
+                                for i, column in enumerate(self.eager_columns))
+            for column in self.primary_key:
+                if id(column) not in id_positions:
+                    raise ClassInfoError("%s has a lazy primary key column"
+                                         % repr(cls))
+            self.eager_primary_key_pos = tuple(id_positions[id(column)]
+                                               for column in self.primary_key)
+
+        self.primary_key_selects = {}
+        self.row_class = None
+
+        self.compact = bool(getattr(cls, "__storm_compact__", False))
+        if self.compact:
+            # Primary key variables are always needed, the variables of
+            # lazy columns and of mutable values hook into the events of
+            # the object as soon as they're built, and the ones of columns
+            # with a default hold it for new objects.
+            self.deferred_columns = tuple(
+                column for column in self.eager_columns
+                if id(column) not in self.primary_key_idx and
+                _is_deferrable(column))
+        else:
+            self.deferred_columns = ()
+        self.deferred_idx = dict((id(column), i)
+                                 for i, column in
+                                 enumerate(self.deferred_columns))
+        self.immediate_columns = tuple(
+            column for column in self.columns
+            if id(column) not in self.deferred_idx)
+
+        self.primary_key_types = _get_identity_types(self.primary_key)
+
         __order__ = getattr(cls, "__storm_order__", None)
         if __order__ is None:
             self.default_order = Undef
@@ -146,6 +217,215 @@ class ClassInfo(dict):
     def __ne__(self, other):
         return self is not other
 
+    def get_primary_values(self, values):
+        """Return the identity of an object from raw primary key values.
+
+        This avoids building variables just to convert the values, when
+        the variables of the primary key columns would return them
+        unchanged.
+
+        @param values: A sequence with a value for each primary key
+            column, either loaded from the database or given by the user.
+        @return: A tuple with the values, as the store uses them to
+            identify objects, or C{None} if the values must be converted
+            by variables first.
+        """
+        types = self.primary_key_types
+        if types is None:
+            return None
+        for value, value_types in zip(values, types):
+            if type(value) not in value_types:
+                return None
+        return tuple(values)
+
+
+# Variable classes which return values of the given types unchanged,
+# both when set from Python or the database and when read for it.
+_identity_types = {
+    IntVariable: (int, long),
+    UnicodeVariable: (unicode,),
+    RawStrVariable: (str,),
+}
+
+
+def _get_identity_types(columns):
+    types = []
+    for column in columns:
+        factory = column.variable_factory
+        value_types = _identity_types.get(getattr(factory, "func", None))
+        # Validators may change values set from Python.
+        if (value_types is None or
+            (factory.keywords or {}).get("validator") is not None):
+            return None
+        types.append(value_types)
+    return tuple(types)
+
+
+def _is_deferrable(column):
+    variable_class = getattr(column.variable_factory, "func", None)
+    if not (isinstance(variable_class, type) and
+            not issubclass(variable_class, MutableValueVariable)):
+        return False
+    # Defaults are set when the variable is built, so new objects must
+    # have them from the start to get them inserted.
+    kwargs = column.variable_factory.keywords or {}
+    return (kwargs.get("value", Undef) is Undef and
+            kwargs.get("value_factory", Undef) is Undef)
+
+
+class CompactVariables(dict):
+    """The variables of an object of a compact class, keyed by column.
+
+    This behaves like the C{dict} usually found in C{obj_info.variables},
+    but variables of deferred columns are only built when they're first
+    looked up.  Until then, the values loaded from the database for them
+    are kept in a list, so objects which are loaded but only partially
+    used take much less memory.  Only the variables which were built are
+    actually stored in the dictionary.
+    """
+
+    __slots__ = ("_obj_info", "_values", "_set_variable")
+
+    def __init__(self, obj_info):
+        dict.__init__(self)
+        self._obj_info = obj_info
+        self._values = [Undef] * len(obj_info.cls_info.deferred_columns)
+        self._set_variable = None
+
+    def __missing__(self, column):
+        obj_info = self._obj_info
+        idx = obj_info.cls_info.deferred_idx.get(id(column))
+        if idx is None:
+            raise KeyError(column)
+        # The event system is only attached once the value is set, so
+        # that building the variable isn't reported as a change.
+        variable = column.variable_factory(
+            column=column, validator_object_factory=obj_info.get_obj)
+        value = self._values[idx]
+        if isinstance(value, LazyValue):
+            variable.set(value)
+        elif value is not Undef:
+            if value is None:
+                variable.set(None, from_db=True)
+            else:
+                self._set_variable(variable, value)
+            variable.checkpoint()
+        self._values[idx] = Undef
+        variable.event = obj_info.event
+        dict.__setitem__(self, column, variable)
+        return variable
+
+    def __contains__(self, column):
+        return (dict.__contains__(self, column) or
+                id(column) in self._obj_info.cls_info.deferred_idx)
+
+    def __len__(self):
+        return len(self._obj_info.cls_info.columns)
+
+    def __iter__(self):
+        return iter(self._obj_info.cls_info.columns)
+
+    iterkeys = __iter__
+
+    def keys(self):
+        return list(self._obj_info.cls_info.columns)
+
+    def get(self, column, default=None):
+        try:
+            return self[column]
+        except KeyError:
+            return default
+
+    def itervalues(self):
+        for column in self._obj_info.cls_info.columns:
+            yield self[column]
+
+    def values(self):
+        return list(self.itervalues())
+
+    def iteritems(self):
+        for column in self._obj_info.cls_info.columns:
+            yield column, self[column]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def copy(self):
+        return dict(self.iteritems())
+
+    def is_built(self, column):
+        """Return whether the variable of C{column} was built."""
+        return dict.__contains__(self, column)
+
+    def is_defined(self, column):
+        """Like C{is_defined()} on the variable of C{column}.
+
+        The variable isn't built if it wasn't yet.
+        """
+        variable = dict.get(self, column)
+        if variable is not None:
+            return variable.is_defined()
+        value = self._values[self._obj_info.cls_info.deferred_idx[id(column)]]
+        return not (value is Undef or isinstance(value, LazyValue))
+
+    def get_lazy(self, column, default=None):
+        """Like C{get_lazy()} on the variable of C{column}.
+
+        The variable isn't built if it wasn't yet.
+        """
+        variable = dict.get(self, column)
+        if variable is not None:
+            return variable.get_lazy(default)
+        value = self._values[self._obj_info.cls_info.deferred_idx[id(column)]]
+        if isinstance(value, LazyValue):
+            return value
+        return default
+
+    def set_lazy(self, column, lazy_value):
+        """Set a L{LazyValue} in the variable of C{column}.
+
+        The variable isn't built if it wasn't yet, in which case no
+        event is emitted.
+        """
+        variable = dict.get(self, column)
+        if variable is not None:
+            variable.set(lazy_value)
+        else:
+            idx = self._obj_info.cls_info.deferred_idx[id(column)]
+            self._values[idx] = lazy_value
+
+    def set_values(self, columns, values, set_variable, keep_defined=False):
+        """Keep values loaded from the database for unbuilt variables.
+
+        @param columns: The columns which were loaded.
+        @param values: The values loaded for C{columns}.
+        @param set_variable: The function used to set a variable to a
+            value from the database, when it gets built.
+        @param keep_defined: If True, values of variables which are
+            already defined are kept.
+        @return: A C{(columns, values)} tuple with the columns whose
+            variables were already built, and their values, which
+            must be set as usual.
+        """
+        deferred_idx = self._obj_info.cls_info.deferred_idx
+        stored_values = self._values
+        built_columns = []
+        built_values = []
+        for column, value in zip(columns, values):
+            idx = deferred_idx.get(id(column))
+            if idx is None or dict.__contains__(self, column):
+                built_columns.append(column)
+                built_values.append(value)
+            elif not keep_defined or not self.is_defined(column):
+                stored_values[idx] = value
+        self._set_variable = set_variable
+        return built_columns, built_values
+
+    def get_unbuilt_values(self):
+        """Return the values kept for variables which weren't built."""
+        return [value for value in self._values
+                if not (value is Undef or isinstance(value, LazyValue))]
+
 
 class ObjectInfo(dict):
 
@@ -165,9 +445,12 @@ class ObjectInfo(dict):
         self.set_obj(obj)
 
         self.event = event = EventSystem(self)
-        self.variables = variables = {}
+        if self.cls_info.compact:
+            self.variables = variables = CompactVariables(self)
+        else:
+            self.variables = variables = {}
 
-        for column in self.cls_info.columns:
+        for column in self.cls_info.immediate_columns:
             variables[column] = \
                 column.variable_factory(column=column,
                                         event=event,
@@ -192,7 +475,8 @@ class ObjectInfo(dict):
         self.event.emit("object-deleted")
 
     def checkpoint(self):
-        for variable in self.variables.itervalues():
+        # Only the variables which were built may have changed.
+        for variable in dict.itervalues(self.variables):
             variable.checkpoint()
 
 
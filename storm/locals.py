@@ -20,7 +20,7 @@
 #
 from storm.properties import Bool, Int, Float, RawStr, Chars, Unicode
 from storm.properties import List, Decimal, DateTime, Date, Time, Enum, UUID
-from storm.properties import TimeDelta, Pickle, JSON
+from storm.properties import TimeDelta, Pickle, JSON, LazyGroup
 from storm.references import Reference, ReferenceSet, Proxy
 from storm.database import create_database
 from storm.exceptions import StormError
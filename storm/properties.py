@@ -32,19 +32,48 @@ from storm.variables import (
     PickleVariable, JSONVariable, ListVariable, EnumVariable)
 
 
-__all__ = ["Property", "SimpleProperty",
+__all__ = ["Property", "SimpleProperty", "LazyGroup",
            "Bool", "Int", "Float", "Decimal", "RawStr", "Unicode",
            "DateTime", "Date", "Time", "TimeDelta", "UUID", "Enum",
            "Pickle", "JSON", "List", "PropertyRegistry"]
 
 
+class LazyGroup(object):
+    """Group of lazy properties which are loaded together.
+
+    Properties sharing a lazy group are left out of the queries
+    loading their objects, and are all retrieved at once when one
+    of them is first accessed::
+
+        class Document(object):
+            ...
+            contents_group = LazyGroup()
+            body = Unicode(lazy_group=contents_group)
+            attachment = RawStr(lazy_group=contents_group)
+
+    Any other hashable value, such as an integer, may be used as a
+    lazy group as well.
+    """
+
+
 class Property(object):
     creation_counter = 0
 
     def __init__(self, name=None, primary=False,
-                 variable_class=Variable, variable_kwargs={}):
+                 variable_class=Variable, variable_kwargs={},
+                 lazy=False, lazy_group=None):
+        """
+        @param lazy: If true, the property is not loaded with its object,
+            but only when first accessed.
+        @param lazy_group: A L{LazyGroup}, or any other hashable value,
+            shared by lazy properties which should be loaded together.
+            Defining it implies C{lazy=True}.
+        """
+        if lazy and lazy_group is None:
+            lazy_group = self
         self._name = name
         self._primary = primary
+        self._lazy_group = lazy_group
         self._variable_class = variable_class
         self._variable_kwargs = variable_kwargs
         self._creation_order = Property.creation_counter
@@ -125,6 +154,7 @@ class PropertyColumn(Column):
                                         **variable_kwargs))
 
         self.cls = cls  # Used by references
+        self.lazy_group = prop._lazy_group
 
         # Copy attributes from the property to avoid one additional
         # function call on each access.
@@ -139,7 +169,10 @@ class SimpleProperty(Property):
     def __init__(self, name=None, primary=False, **kwargs):
         kwargs["value"] = kwargs.pop("default", Undef)
         kwargs["value_factory"] = kwargs.pop("default_factory", Undef)
-        Property.__init__(self, name, primary, self.variable_class, kwargs)
+        lazy = kwargs.pop("lazy", False)
+        lazy_group = kwargs.pop("lazy_group", None)
+        Property.__init__(self, name, primary, self.variable_class, kwargs,
+                          lazy, lazy_group)
 
 
 class Bool(SimpleProperty):
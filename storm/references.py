@@ -25,9 +25,10 @@ from storm.exceptions import (
 from storm.store import Store, get_where_for_args, LostObjectError
 from storm.variables import LazyValue
 from storm.expr import (
-    Select, Column, Exists, ComparableExpr, SuffixExpr, LeftJoin, Not, SQLRaw,
-    compare_columns, compile)
+    Select, Column, Exists, ComparableExpr, SuffixExpr, LeftJoin, Not, Or,
+    SQLRaw, compare_columns, compile)
 from storm.info import get_cls_info, get_obj_info
+from storm import Undef
 
 
 __all__ = ["Reference", "ReferenceSet", "Proxy"]
@@ -193,6 +194,44 @@ class Reference(object):
                 pass # It might fail when remote is a tuple or a raw value.
             self._relation.link(local, remote, True)
 
+    def _prefetch(self, store, locals):
+        """Load and link the remote objects of all C{locals} at once.
+
+        This is used by L{ResultSet.prefetch}.
+        """
+        if self._cls is None:
+            self._cls = _find_descriptor_class(locals[0].__class__, self)
+
+        relation = self._relation
+        pending = []
+        keys = []
+        for local in locals:
+            if relation.get_remote(local) is not None:
+                continue
+            local_variables = relation.get_local_variables(local)
+            if (_are_defined(local_variables) and
+                not relation.local_variables_are_none(local)):
+                pending.append(local)
+                keys.append(local_variables)
+        if not keys:
+            return
+
+        if relation.remote_key_is_primary:
+            remotes = store.get_many(relation.remote_cls, keys)
+        else:
+            groups = _find_grouped(store, (relation.remote_cls,),
+                                   relation.remote_key, keys)
+            remotes = []
+            for local_variables in keys:
+                group = groups.get(_get_values(local_variables), ())
+                # References matching several objects are left alone,
+                # so that accessing them fails as usual.
+                remotes.append(len(group) == 1 and group[0] or None)
+
+        for local, remote in zip(pending, remotes):
+            if remote is not None:
+                relation.link(local, remote)
+
     def _build_relation(self):
         resolver = PropertyResolver(self, self._cls)
         self._local_key = resolver.resolve(self._local_key)
@@ -250,6 +289,56 @@ class ReferenceSet(object):
     def __set__(self, local, value):
         raise FeatureError("Assigning to ResultSets not supported")
 
+    def _prefetch(self, store, locals):
+        """Load the contents of this reference set for all C{locals} at once.
+
+        The contents are kept in each local object, and used when the
+        bound reference set is iterated, as long as the database isn't
+        changed through the store in the meantime.  This is used by
+        L{ResultSet.prefetch}.
+        """
+        if self._cls is None:
+            self._cls = _find_descriptor_class(locals[0].__class__, self)
+
+        relation1 = self._relation1
+        keys = {}
+        local_keys = []
+        for local in locals:
+            local_variables = relation1.get_local_variables(local)
+            if _are_defined(local_variables):
+                key = _get_values(local_variables)
+                keys.setdefault(key, local_variables)
+                local_keys.append((local, key))
+        if not keys:
+            return
+
+        if self._relation2 is None:
+            target_cls = relation1.remote_cls
+        else:
+            target_cls = self._relation2.local_cls
+        order_by = self._order_by
+        if order_by is None:
+            # Finds of several columns don't use the default order of
+            # the class, which a plain find of the set would.
+            order_by = get_cls_info(target_cls).default_order
+            if order_by is Undef:
+                order_by = None
+
+        if self._relation2 is None:
+            groups = _find_grouped(store, (target_cls,),
+                                   relation1.remote_key, keys.values(),
+                                   order_by=order_by)
+        else:
+            groups = _find_grouped(store, (target_cls,),
+                                   relation1.remote_key, keys.values(),
+                                   self._relation2.get_where_for_join(),
+                                   order_by)
+
+        serial = store._serial
+        for local, key in local_keys:
+            prefetched = get_obj_info(local).setdefault("prefetched", {})
+            prefetched[relation1] = (serial, groups.get(key, []))
+
     def _build_relations(self):
         resolver = PropertyResolver(self, self._cls)
 
@@ -285,8 +374,34 @@ class BoundReferenceSetBase(object):
         return result
 
     def __iter__(self):
+        prefetched = self._get_prefetched()
+        if prefetched is not None:
+            return iter(prefetched)
         return self.find().__iter__()
 
+    def _get_prefetched(self):
+        """Return the prefetched contents of this set, if they're current.
+
+        @return: A list of objects, or C{None} if the contents weren't
+            prefetched or the database may have changed since then.
+        """
+        prefetched = get_obj_info(self._local).get("prefetched")
+        if prefetched is None:
+            return None
+        entry = prefetched.get(self._prefetch_relation)
+        if entry is None:
+            return None
+        store = Store.of(self._local)
+        if store is None:
+            return None
+        if store._implicit_flush_block_count == 0:
+            store.flush()
+        serial, objects = entry
+        if serial != store._serial:
+            del prefetched[self._prefetch_relation]
+            return None
+        return objects
+
     def __contains__(self, item):
         return item in self.find()
 
@@ -319,6 +434,7 @@ class BoundReferenceSet(BoundReferenceSetBase):
         self._local = local
         self._target_cls = self._relation.remote_cls
         self._order_by = order_by
+        self._prefetch_relation = relation
 
     def _get_where_clause(self):
         return self._relation.get_where_for_remote(self._local)
@@ -351,6 +467,7 @@ class BoundIndirectReferenceSet(BoundReferenceSetBase):
 
         self._target_cls = relation2.local_cls
         self._link_cls = relation1.remote_cls
+        self._prefetch_relation = relation1
 
     def _get_where_clause(self):
         return (self._relation1.get_where_for_remote(self._local) &
@@ -936,6 +1053,50 @@ class PropertyResolver(object):
         return self._registry.get(property_path, self._namespace)
 
 
+def _are_defined(variables):
+    """Return true if all C{variables} have a value which may be queried."""
+    for variable in variables:
+        if not variable.is_defined() or variable.get_lazy() is not None:
+            return False
+    return True
+
+def _get_values(variables):
+    return tuple(variable.get() for variable in variables)
+
+def _find_grouped(store, cls_spec, key_columns, keys, where=Undef,
+                  order_by=None):
+    """Find the objects matching any of the given keys, grouped by key.
+
+    @param cls_spec: A tuple with the class of the objects to find.
+    @param key_columns: The columns matched against the keys.
+    @param keys: A sequence of tuples of variables, one for each key.
+    @param where: An additional condition for the objects to find.
+    @param order_by: The ordering of the objects in each group.
+    @return: A dict mapping tuples with the values of the keys to lists
+        with the matching objects.
+    """
+    max_parameters = store._connection.max_parameters
+    if max_parameters is None:
+        chunk_size = len(keys)
+    else:
+        chunk_size = max(1, max_parameters // len(key_columns))
+    groups = {}
+    for i in xrange(0, len(keys), chunk_size):
+        chunk = keys[i:i+chunk_size]
+        if len(key_columns) == 1:
+            condition = key_columns[0].is_in([key[0] for key in chunk])
+        else:
+            condition = Or(*[compare_columns(key_columns, key)
+                             for key in chunk])
+        if where is not Undef:
+            condition = condition & where
+        result = store.find(cls_spec + key_columns, condition)
+        if order_by is not None:
+            result.order_by(*order_by)
+        for row in result:
+            groups.setdefault(row[1:], []).append(row[0])
+    return groups
+
 def _find_descriptor_class(used_cls, descr):
     for cls in used_cls.__mro__:
         for attr, _descr in cls.__dict__.iteritems():
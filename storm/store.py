@@ -24,16 +24,23 @@
 This module contains the highest-level ORM interface in Storm.
 """
 
+from array import array
+from collections import deque
 from copy import copy
-from weakref import WeakValueDictionary
 from operator import itemgetter
+from weakref import WeakValueDictionary
+from heapq import heappush, heappop
+import sys
+import threading
 
 from storm.info import get_cls_info, get_obj_info, set_obj_info
-from storm.variables import Variable, LazyValue
+from storm.variables import (
+    Variable, LazyValue, BoolVariable, IntVariable, FloatVariable,
+    RawStrVariable, UnicodeVariable)
 from storm.expr import (
     Expr, Select, Insert, Update, Delete, Column, Count, Max, Min,
-    Avg, Sum, Eq, And, Asc, Desc, compile_python, compare_columns, SQLRaw,
-    Union, Except, Intersect, Alias, SetExpr)
+    Avg, Sum, Eq, And, Or, Asc, Desc, Case, compile_python, compare_columns,
+    SQLRaw, Union, Except, Intersect, Alias, SetExpr, State)
 from storm.exceptions import (
     WrongStoreError, NotFlushedError, OrderLoopError, UnorderedError,
     NotOneError, FeatureError, CompileError, LostObjectError, ClassInfoError)
@@ -42,12 +49,33 @@ from storm.cache import Cache
 from storm.event import EventSystem
 
 
-__all__ = ["Store", "AutoReload", "EmptyResultSet"]
+__all__ = ["Store", "AutoReload", "EmptyResultSet", "ReadOnlyRow",
+           "fetch_concurrently"]
 
 
 PENDING_ADD = 1
 PENDING_REMOVE = 2
 
+# Number of objects loaded at once by result sets with prefetched references.
+PREFETCH_BATCH_SIZE = 1000
+
+# Default number of threads running queries in fetch_concurrently().
+FETCH_CONCURRENTLY_MAX_WORKERS = 8
+
+# Default number of rows fetched at once by ResultSet.stream().
+STREAM_BATCH_SIZE = 1000
+
+# Types of the database values which variables of the given classes
+# store unchanged, so values_columnar() can skip the variable for them.
+_native_types = {BoolVariable: bool, IntVariable: int, FloatVariable: float,
+                 RawStrVariable: str, UnicodeVariable: unicode}
+
+# Typecodes of the arrays returned by values_columnar(arrays=True).
+_array_typecodes = {BoolVariable: "b", IntVariable: "l", FloatVariable: "d"}
+
+CACHE_STATS = ("get_hits", "get_misses", "alive_hits", "invalidations",
+               "negative_hits")
+
 
 class Store(object):
     """The Storm Store.
@@ -63,10 +91,16 @@ class Store(object):
 
     _result_set_factory = None
 
-    def __init__(self, database, cache=None):
+    def __init__(self, database, cache=None, negative_cache=None):
         """
         @param database: The L{storm.database.Database} instance to use.
         @param cache: The cache to use.  Defaults to a L{Cache} instance.
+        @param negative_cache: A L{NegativeCache} remembering the primary
+            keys for which L{get} found no object, so that looking them up
+            again doesn't touch the database.  It's forgotten whenever the
+            store is invalidated, such as on transaction boundaries, and
+            whenever a statement is run with L{execute}.
+            Defaults to no negative cache.
         """
         self._database = database
         self._event = EventSystem(self)
@@ -78,8 +112,13 @@ class Store(object):
             self._cache = Cache()
         else:
             self._cache = cache
+        self._negative_cache = negative_cache
         self._implicit_flush_block_count = 0
         self._sequence = 0 # Advisory ordering.
+        self._newly_dirty = None # Objects made dirty while flushing.
+        self._cache_stats = dict.fromkeys(CACHE_STATS, 0)
+        self._serial = 0 # Bumped whenever the database may have changed.
+        self._committed_serial = 0 # The serial as of the last commit.
 
     def get_database(self):
         """Return this Store's Database object."""
@@ -101,10 +140,14 @@ class Store(object):
         """Execute a basic query.
 
         This is just like L{storm.database.Database.execute}, except
-        that a flush is performed first.
+        that a flush is performed first.  Since the statement may insert
+        any rows, the negative cache of the store, if any, is cleared.
         """
         if self._implicit_flush_block_count == 0:
             self.flush()
+        self._serial += 1
+        if self._negative_cache is not None:
+            self._negative_cache.clear()
         return self._connection.execute(statement, params, noresult)
 
     def close(self):
@@ -136,6 +179,7 @@ class Store(object):
         self.flush()
         self.invalidate()
         self._connection.commit()
+        self._committed_serial = self._serial
 
     def rollback(self):
         """Roll back all outstanding changes, reverting to database state."""
@@ -152,6 +196,7 @@ class Store(object):
         self._dirty.clear()
         self.invalidate()
         self._connection.rollback()
+        self._committed_serial = self._serial
 
     def get(self, cls, key):
         """Get object of type cls with the given primary key from the database.
@@ -175,28 +220,183 @@ class Store(object):
 
         assert len(key) == len(cls_info.primary_key)
 
-        primary_vars = []
-        for column, variable in zip(cls_info.primary_key, key):
-            if not isinstance(variable, Variable):
-                variable = column.variable_factory(value=variable)
-            primary_vars.append(variable)
+        # Variables are only built when the values need converting, or
+        # when the object must be loaded from the database.
+        primary_vars = None
+        given_variables = False
+        primary_values = cls_info.get_primary_values(key)
+        if primary_values is None:
+            primary_vars, given_variables = self._get_primary_vars(cls_info,
+                                                                   key)
+            primary_values = tuple(var.get(to_db=True)
+                                   for var in primary_vars)
 
-        primary_values = tuple(var.get(to_db=True) for var in primary_vars)
         obj_info = self._alive.get((cls_info.cls, primary_values))
         if obj_info is not None and not obj_info.get("invalidated"):
+            self._cache_stats["get_hits"] += 1
             return self._get_object(obj_info)
 
-        where = compare_columns(cls_info.primary_key, primary_vars)
+        negative_cache = self._negative_cache
+        if negative_cache is not None and obj_info is None:
+            if negative_cache.has((cls_info.cls, primary_values)):
+                self._cache_stats["negative_hits"] += 1
+                return None
 
-        select = Select(cls_info.columns, where,
-                        default_tables=cls_info.table, limit=1)
+        self._cache_stats["get_misses"] += 1
 
-        result = self._connection.execute(select)
+        if primary_vars is None:
+            primary_vars = self._get_primary_vars(cls_info, key)[0]
+
+        # Variables given by the caller may not compile like the ones
+        # the statement of the class was compiled with.
+        if given_variables:
+            statement = None
+        else:
+            statement = self._get_primary_key_select(cls_info, primary_vars)
+        if statement is not None:
+            result = self._connection.execute(statement, primary_vars)
+        else:
+            where = compare_columns(cls_info.primary_key, primary_vars)
+            select = Select(cls_info.eager_columns, where,
+                            default_tables=cls_info.table, limit=1)
+            result = self._connection.execute(select)
         values = result.get_one()
         if values is None:
+            if negative_cache is not None:
+                negative_cache.add((cls_info.cls, primary_values))
             return None
         return self._load_object(cls_info, result, values)
 
+    def _get_primary_vars(self, cls_info, key):
+        """Return variables for the given primary key values.
+
+        @return: A C{(primary_vars, given_variables)} tuple, where
+            C{given_variables} tells if some of the values in C{key}
+            were already variables.
+        """
+        primary_vars = []
+        given_variables = False
+        for column, variable in zip(cls_info.primary_key, key):
+            if isinstance(variable, Variable):
+                given_variables = True
+            else:
+                variable = column.variable_factory(value=variable)
+            primary_vars.append(variable)
+        return primary_vars, given_variables
+
+    def _get_primary_key_select(self, cls_info, primary_vars):
+        """Return the SQL selecting an object of the given class by key.
+
+        The statement is compiled once for each class and compiler, and
+        takes the primary key variables as its parameters.
+
+        @return: The statement, or C{None} if the compiler doesn't
+            compile the given variables as plain parameters.
+        """
+        compile = self._connection.compile
+        statements = cls_info.primary_key_selects
+        statement = statements.get(compile)
+        if statement is None:
+            where = compare_columns(cls_info.primary_key, primary_vars)
+            select = Select(cls_info.eager_columns, where,
+                            default_tables=cls_info.table, limit=1)
+            state = State()
+            statement = compile(select, state)
+            if map(id, state.parameters) != map(id, primary_vars):
+                statement = False
+            statements[compile] = statement
+        return statement or None
+
+    def get_many(self, cls, keys):
+        """Get objects of type cls with the given primary keys.
+
+        Objects which are alive are returned without touching the
+        database, and the remaining ones are retrieved with as few
+        queries as the database parameter limits allow.
+
+        @param cls: Class of the objects to be retrieved.
+        @param keys: A sequence of primary keys, as accepted by L{get}.
+
+        @return: A list with the object found for each of the given
+            keys, in the same order, with None for the keys for which
+            no object is found.
+        """
+
+        if self._implicit_flush_block_count == 0:
+            self.flush()
+
+        cls_info = get_cls_info(cls)
+        primary_key = cls_info.primary_key
+        negative_cache = self._negative_cache
+
+        objects = []
+        missing = {} # {primary_values: [position, ...], ...}
+        missing_vars = []
+        for key in keys:
+            if type(key) != tuple:
+                key = (key,)
+
+            assert len(key) == len(primary_key)
+
+            primary_vars = None
+            primary_values = cls_info.get_primary_values(key)
+            if primary_values is None:
+                primary_vars = self._get_primary_vars(cls_info, key)[0]
+                primary_values = tuple(var.get(to_db=True)
+                                       for var in primary_vars)
+            obj_info = self._alive.get((cls_info.cls, primary_values))
+            if obj_info is not None and not obj_info.get("invalidated"):
+                self._cache_stats["get_hits"] += 1
+                objects.append(self._get_object(obj_info))
+                continue
+
+            if (negative_cache is not None and obj_info is None and
+                negative_cache.has((cls_info.cls, primary_values))):
+                self._cache_stats["negative_hits"] += 1
+                objects.append(None)
+                continue
+
+            self._cache_stats["get_misses"] += 1
+            positions = missing.get(primary_values)
+            if positions is None:
+                missing[primary_values] = [len(objects)]
+                if primary_vars is None:
+                    primary_vars = self._get_primary_vars(cls_info, key)[0]
+                missing_vars.append(primary_vars)
+            else:
+                positions.append(len(objects))
+            objects.append(None)
+
+        if missing_vars:
+            max_parameters = self._connection.max_parameters
+            if max_parameters is None:
+                chunk_size = len(missing_vars)
+            else:
+                chunk_size = max(1, max_parameters // len(primary_key))
+            # Loaded objects must be held until they're looked up below,
+            # since the alive map only keeps weak references to them.
+            loaded = []
+            for i in xrange(0, len(missing_vars), chunk_size):
+                where = self._get_where_for_primary_keys(
+                    primary_key, missing_vars[i:i+chunk_size])
+                select = Select(cls_info.eager_columns, where,
+                                default_tables=cls_info.table)
+                result = self._connection.execute(select)
+                for values in result:
+                    loaded.append(self._load_object(cls_info, result, values))
+
+            for primary_values, positions in missing.iteritems():
+                obj_info = self._alive.get((cls_info.cls, primary_values))
+                # Objects which are still invalidated weren't found.
+                if obj_info is not None and not obj_info.get("invalidated"):
+                    obj = self._get_object(obj_info)
+                    for position in positions:
+                        objects[position] = obj
+                elif negative_cache is not None:
+                    negative_cache.add((cls_info.cls, primary_values))
+
+        return objects
+
     def find(self, cls_spec, *args, **kwargs):
         """Perform a query.
 
@@ -321,13 +521,16 @@ class Store(object):
             raise NotFlushedError("Can't reload an object if it was "
                                   "never flushed")
         where = compare_columns(cls_info.primary_key, obj_info["primary_vars"])
-        select = Select(cls_info.columns, where,
+        select = Select(cls_info.eager_columns, where,
                         default_tables=cls_info.table, limit=1)
         result = self._connection.execute(select)
         values = result.get_one()
-        self._set_values(obj_info, cls_info.columns, result, values,
+        self._set_values(obj_info, cls_info.eager_columns, result, values,
                          replace_unknown_lazy=True)
+        self._set_lazy_columns(obj_info)
         self._set_clean(obj_info)
+        obj_info.pop("changed_columns", None)
+        self._renew_cached_size(obj_info)
 
     def autoreload(self, obj=None):
         """Set an object or all objects to be reloaded automatically on access.
@@ -356,12 +559,65 @@ class Store(object):
         automatically invalidates all cached objects on transaction
         boundaries.
         """
+        self._serial += 1
         if obj is None:
             self._cache.clear()
+            if self._negative_cache is not None:
+                self._negative_cache.clear()
         else:
-            self._cache.remove(get_obj_info(obj))
+            obj_info = get_obj_info(obj)
+            self._cache.remove(obj_info)
+            self._forget_missing(obj_info.cls_info.cls)
         self._mark_autoreload(obj, True)
 
+    def get_changed_columns(self, obj):
+        """Return the columns of an object with changes not yet flushed.
+
+        This may be used, for instance, by a C{__storm_pre_flush__} hook
+        which only needs to act when some of the columns change.
+
+        @param obj: An object in this store.
+        @return: A set with the changed columns.  For an object which
+            is pending addition, all the columns which will be inserted
+            are returned.
+        """
+        obj_info = get_obj_info(obj)
+        if obj_info.get("store") is not self:
+            raise WrongStoreError("%s is not in this store" % repr(obj))
+        adding = obj_info.get("pending") is PENDING_ADD
+        return set(column for column, variable
+                   in self._iter_changed_variables(obj_info, adding))
+
+    def get_cache_stats(self):
+        """Return statistics about the objects cached by this store.
+
+        The statistics are counted from the creation of the store, or
+        from the last call to L{reset_cache_stats}, which may be called
+        on transaction boundaries to get per-transaction figures.
+
+        @return: A dict with the number of L{get} calls served from
+            memory (C{"get_hits"}) or from the database
+            (C{"get_misses"}), the number of rows loaded from the
+            database which matched an object already in memory
+            (C{"alive_hits"}), and the number of objects invalidated
+            (C{"invalidations"}).  The statistics of the cache, such as
+            the number of C{"evictions"}, are included as well if it
+            provides a C{get_stats} method.
+        """
+        stats = {}
+        get_stats = getattr(self._cache, "get_stats", None)
+        if get_stats is not None:
+            stats.update(get_stats())
+        stats.update(self._cache_stats)
+        return stats
+
+    def reset_cache_stats(self):
+        """Reset the counters reported by L{get_cache_stats}."""
+        self._cache_stats = dict.fromkeys(CACHE_STATS, 0)
+        reset_stats = getattr(self._cache, "reset_stats", None)
+        if reset_stats is not None:
+            reset_stats()
+
     def reset(self):
         """Reset this store, causing all future queries to return new objects.
 
@@ -376,9 +632,13 @@ class Store(object):
         for obj_info in self._iter_alive():
             if "store" in obj_info:
                 del obj_info["store"]
+            obj_info.pop("prefetched", None)
+        self._serial += 1
         self._alive.clear()
         self._dirty.clear()
         self._cache.clear()
+        if self._negative_cache is not None:
+            self._negative_cache.clear()
         # The following line is untested, but then, I can't really find a way
         # to test it without whitebox.
         self._order.clear()
@@ -391,9 +651,12 @@ class Store(object):
             obj_infos = (get_obj_info(obj),)
         for obj_info in obj_infos:
             cls_info = obj_info.cls_info
+            variables = obj_info.variables
             for column in cls_info.columns:
-                if id(column) not in cls_info.primary_key_idx:
-                    obj_info.variables[column].set(AutoReload)
+                if id(column) in cls_info.deferred_idx:
+                    variables.set_lazy(column, AutoReload)
+                elif id(column) not in cls_info.primary_key_idx:
+                    variables[column].set(AutoReload)
             if invalidate:
                 # Marking an object with 'invalidated' means that we're
                 # not sure if the object is actually in the database
@@ -401,6 +664,10 @@ class Store(object):
                 # (e.g. by a get()), the database should be queried to see
                 # if the object's still there.
                 obj_info["invalidated"] = True
+                # Prefetched reference sets are stale now, and would
+                # otherwise keep their objects alive until accessed.
+                obj_info.pop("prefetched", None)
+                self._cache_stats["invalidations"] += 1
         # We want to make sure we've marked all objects as invalidated and set
         # up their autoreloads before calling the invalidated hook on *any* of
         # them, because an invalidated hook might use other objects and we want
@@ -456,6 +723,9 @@ class Store(object):
         """
         self._event.emit("flush")
 
+        if self._dirty:
+            self._serial += 1
+
         # The _dirty list may change under us while we're running
         # the flush hooks, so we cannot just simply loop over it
         # once.  To prevent infinite looping we keep track of which
@@ -469,6 +739,7 @@ class Store(object):
         self._dirty = flushing
 
         predecessors = {}
+        successors = {}
         for (before_info, after_info), n in self._order.iteritems():
             if n > 0:
                 before_set = predecessors.get(after_info)
@@ -476,35 +747,371 @@ class Store(object):
                     predecessors[after_info] = set((before_info,))
                 else:
                     before_set.add(before_info)
-
-        key_func = itemgetter("sequence")
-
-        # The external loop is important because items can get into the dirty
-        # state while we're flushing objects, ...
-        while self._dirty:
-            # ... but we don't have to resort everytime an object is flushed,
-            # so we have an internal loop too.  If no objects become dirty
-            # during flush, this will clean self._dirty and the external loop
-            # will exit too.
-            sorted_dirty = sorted(self._dirty, key=key_func)
-            while sorted_dirty:
-                for i, obj_info in enumerate(sorted_dirty):
-                    for before_info in predecessors.get(obj_info, ()):
-                        if before_info in self._dirty:
-                            break # A predecessor is still dirty.
-                    else:
-                        break # Found an item without dirty predecessors.
+                after_set = successors.get(before_info)
+                if after_set is None:
+                    successors[before_info] = set((after_info,))
                 else:
+                    after_set.add(after_info)
+
+        # Objects are scheduled with Kahn's algorithm: each of them knows
+        # how many of its predecessors are still dirty, and is pushed into
+        # the ready heap, ordered by sequence, once that number drops
+        # to zero.
+        blockers = {}
+        ready = []
+        self._schedule_flush(list(self._dirty), predecessors, successors,
+                             blockers, ready)
+
+        outer_newly_dirty = self._newly_dirty
+        self._newly_dirty = newly_dirty = []
+        try:
+            while blockers:
+                batch = self._get_flush_batch(blockers, ready)
+                if not batch:
                     raise OrderLoopError("Can't flush due to ordering loop")
-                del sorted_dirty[i]
-                self._dirty.pop(obj_info, None)
-                self._flush_one(obj_info)
+                flush_batch = []
+                for obj_info in batch:
+                    del blockers[obj_info]
+                    # Objects which were made clean in the meantime, by
+                    # being flushed in a nested flush for instance, have
+                    # nothing to be flushed.
+                    if self._dirty.pop(obj_info, None) is not None:
+                        flush_batch.append(obj_info)
+                if len(flush_batch) == 1:
+                    self._flush_one(flush_batch[0])
+                elif flush_batch:
+                    self._flush_many(flush_batch)
+
+                for obj_info in batch:
+                    for after_info in successors.get(obj_info, ()):
+                        if after_info in blockers:
+                            blockers[after_info] -= 1
+                            if blockers[after_info] == 0:
+                                self._push_ready(after_info, ready)
+
+                # Objects may get dirty while being flushed, by the
+                # __storm_flushed__ hook for instance, and must be flushed
+                # again before their successors.
+                rescheduled = []
+                while newly_dirty:
+                    obj_info = newly_dirty.pop()
+                    if obj_info not in self._dirty:
+                        continue
+                    if obj_info in blockers:
+                        if blockers[obj_info] == 0:
+                            self._push_ready(obj_info, ready)
+                        continue
+                    rescheduled.append(obj_info)
+                if rescheduled:
+                    self._schedule_flush(rescheduled, predecessors,
+                                         successors, blockers, ready)
+        finally:
+            self._newly_dirty = outer_newly_dirty
 
         self._order.clear()
 
         # That's not stricly necessary, but prevents getting into bigints.
         self._sequence = 0
 
+    def _schedule_flush(self, obj_infos, predecessors, successors,
+                        blockers, ready):
+        """Schedule dirty objects to be flushed after their predecessors.
+
+        All the given objects are registered before any count is taken,
+        and the count of already scheduled successors of these objects is
+        taken again from scratch, so that each predecessor still waiting
+        to be flushed is counted exactly once.
+        """
+        affected = set(obj_infos)
+        for obj_info in obj_infos:
+            blockers[obj_info] = None
+        for obj_info in obj_infos:
+            for after_info in successors.get(obj_info, ()):
+                if after_info in blockers:
+                    affected.add(after_info)
+        for obj_info in affected:
+            count = 0
+            for before_info in predecessors.get(obj_info, ()):
+                if before_info in blockers:
+                    count += 1
+            blockers[obj_info] = count
+            if count == 0:
+                self._push_ready(obj_info, ready)
+
+    def _push_ready(self, obj_info, ready):
+        """Push an object without dirty predecessors into the ready heap."""
+        heappush(ready, (obj_info["sequence"], id(obj_info), obj_info))
+
+    def _pop_ready(self, blockers, ready, peek=False):
+        """Return the ready object with the lowest sequence.
+
+        Stale heap entries, left by objects which got blocked again or
+        were given a new sequence after being pushed, are discarded.
+
+        @param peek: If true, the object is kept in the heap.
+        @return: The object, or C{None} if there are no ready objects.
+        """
+        while ready:
+            sequence, dummy, obj_info = ready[0]
+            if (blockers.get(obj_info) == 0 and
+                obj_info["sequence"] == sequence):
+                if not peek:
+                    heappop(ready)
+                return obj_info
+            heappop(ready)
+        return None
+
+    def _get_flush_batch(self, blockers, ready):
+        """Return the objects to be flushed together.
+
+        The batch starts with the ready object with the lowest sequence,
+        and is extended with the following ready objects which belong to
+        the same class and are in the same pending state (added, removed,
+        or just changed), so that they may be flushed with a single
+        statement.
+
+        @return: A list of objects, which is empty if no objects are
+            ready to be flushed.
+        """
+        obj_info = self._pop_ready(blockers, ready)
+        if obj_info is None:
+            return []
+        batch = [obj_info]
+        cls_info = obj_info.cls_info
+        pending = obj_info.get("pending")
+        while True:
+            obj_info = self._pop_ready(blockers, ready, peek=True)
+            if (obj_info is None or obj_info.cls_info is not cls_info or
+                obj_info.get("pending") is not pending):
+                return batch
+            heappop(ready)
+            batch.append(obj_info)
+
+    def _flush_many(self, obj_infos):
+        """Flush several objects of the same class in the same pending state.
+
+        This has the same effect as calling L{_flush_one} on each of
+        them, but rows are inserted, updated and deleted with as few
+        statements as possible.
+        """
+        pending = obj_infos[0].get("pending")
+        if pending is PENDING_REMOVE:
+            self._flush_removes(obj_infos)
+        elif pending is PENDING_ADD:
+            self._flush_inserts(obj_infos)
+        else:
+            self._flush_updates(obj_infos)
+
+        for obj_info in obj_infos:
+            self._run_hook(obj_info, "__storm_flushed__")
+            obj_info.event.emit("flushed")
+
+    def _split_rows(self, rows, parameters_per_row):
+        """Split C{(obj_info, columns, changes)} rows into groups.
+
+        Consecutive rows changing the same columns end up in the same
+        group, as long as the number of parameters needed to flush the
+        group doesn't exceed the limit of the connection.
+
+        @param parameters_per_row: Callable taking the tuple of columns
+            of a row and returning the number of parameters it needs.
+        """
+        max_parameters = self._connection.max_parameters
+        groups = []
+        for row in rows:
+            if groups:
+                group = groups[-1]
+                columns = group[0][1]
+                if row[1] == columns and (
+                    max_parameters is None or
+                    (len(group) + 1) * parameters_per_row(columns) <=
+                    max_parameters):
+                    group.append(row)
+                    continue
+            groups.append([row])
+        return groups
+
+    def _get_where_for_primary_keys(self, primary_key, primary_vars_list):
+        """Return an expression matching the rows with any of the given keys.
+
+        @param primary_key: The primary key columns.
+        @param primary_vars_list: A sequence of primary key variables, one
+            for each row.
+        """
+        if len(primary_key) == 1:
+            return primary_key[0].is_in([primary_vars[0]
+                                         for primary_vars in primary_vars_list])
+        return Or(*[compare_columns(primary_key, primary_vars)
+                    for primary_vars in primary_vars_list])
+
+    def _flush_removes(self, obj_infos):
+        """Delete the rows of several objects of the same class at once."""
+        cls_info = obj_infos[0].cls_info
+        for obj_info in obj_infos:
+            del obj_info["pending"]
+        rows = [(obj_info, (), None) for obj_info in obj_infos]
+        size = len(cls_info.primary_key)
+        for group in self._split_rows(rows, lambda columns: size):
+            group = [obj_info for obj_info, columns, changes in group]
+            where = self._get_where_for_primary_keys(
+                cls_info.primary_key,
+                [obj_info["primary_vars"] for obj_info in group])
+            expr = Delete(where, cls_info.table)
+            self._connection.execute(expr, noresult=True)
+            for obj_info in group:
+                self._flush_removed(obj_info)
+
+    def _flush_inserts(self, obj_infos):
+        """Insert several objects of the same class pending to be added.
+
+        Consecutive objects defining the same set of columns are inserted
+        with a single multi-row statement whenever the backend is able
+        to retrieve the primary keys generated for them.  Otherwise they
+        are inserted one at a time, exactly as L{_flush_one} would do.
+
+        Objects stay pending until their row is inserted, so if a
+        statement fails, the ones which weren't inserted are put back
+        in the dirty list, and are forgotten by a rollback.
+        """
+        try:
+            self._insert_rows(obj_infos)
+        except:
+            for obj_info in obj_infos:
+                if obj_info.get("pending") is PENDING_ADD:
+                    self._dirty[obj_info] = obj_info.get_obj()
+            raise
+
+    def _insert_rows(self, obj_infos):
+        """Do the actual work of L{_flush_inserts}."""
+        cls_info = obj_infos[0].cls_info
+        primary_key = cls_info.primary_key
+
+        rows = []
+        for obj_info in obj_infos:
+            # Give a chance to the backend to process primary variables.
+            self._connection.preset_primary_key(primary_key,
+                                                obj_info.primary_vars)
+            changes = self._get_changes_map(obj_info, True)
+            columns = tuple(column for column in cls_info.columns
+                            if column in changes)
+            rows.append((obj_info, columns, changes))
+
+        for group in self._split_rows(rows, len):
+            columns = group[0][1]
+            if len(group) > 1 and columns:
+                values = []
+                primary_vars = []
+                for obj_info, columns, changes in group:
+                    values.append(tuple(changes[column] for column in columns))
+                    primary_vars.append(obj_info.primary_vars)
+                expr = Insert(columns, cls_info.table,
+                              primary_columns=primary_key, values=values)
+                if self._connection.execute_insert_many(expr, primary_vars):
+                    for obj_info, columns, changes in group:
+                        del obj_info["pending"]
+                        self._flush_inserted(obj_info)
+                    continue
+
+            for obj_info, columns, changes in group:
+                expr = Insert(changes, cls_info.table,
+                              primary_columns=primary_key,
+                              primary_variables=obj_info.primary_vars)
+                result = self._connection.execute(expr)
+                del obj_info["pending"]
+                self._flush_inserted(obj_info, result)
+
+    def _flush_updates(self, obj_infos):
+        """Update the rows of several objects of the same class at once.
+
+        Consecutive objects with changes in the same set of columns are
+        updated with a single statement, which picks the new value for
+        each row with a C{CASE} expression on the primary key.  Objects
+        with changes in the primary key itself are updated one at a
+        time, exactly as L{_flush_one} would do.
+        """
+        cls_info = obj_infos[0].cls_info
+        primary_key = cls_info.primary_key
+        primary_key_idx = cls_info.primary_key_idx
+
+        rows = []
+        for obj_info in obj_infos:
+            obj_info.pop("pending", None)
+            changes = self._get_changes_map(obj_info)
+            if changes:
+                columns = tuple(column for column in cls_info.columns
+                                if column in changes)
+                for column in columns:
+                    if id(column) in primary_key_idx:
+                        columns = None
+                        break
+                rows.append((obj_info, columns, changes))
+
+        size = len(primary_key)
+        def parameters_per_row(columns):
+            return (columns and len(columns) * (size + 1) or 0) + size
+
+        for group in self._split_rows(rows, parameters_per_row):
+            columns = group[0][1]
+            if len(group) > 1 and columns:
+                group_infos = [obj_info for obj_info, dummy, changes in group]
+                if size == 1:
+                    conditions = [obj_info["primary_vars"][0]
+                                  for obj_info in group_infos]
+                    expression = primary_key[0]
+                else:
+                    conditions = [compare_columns(primary_key,
+                                                  obj_info["primary_vars"])
+                                  for obj_info in group_infos]
+                    expression = Undef
+                sets = {}
+                for column in columns:
+                    cases = [(condition, changes[column])
+                             for condition, (obj_info, dummy, changes)
+                             in zip(conditions, group)]
+                    sets[column] = Case(cases, expression, default=column)
+                where = self._get_where_for_primary_keys(
+                    primary_key,
+                    [obj_info["primary_vars"] for obj_info in group_infos])
+                expr = Update(sets, where, cls_info.table)
+                self._connection.execute(expr, noresult=True)
+                for obj_info in group_infos:
+                    self._flush_updated(obj_info)
+                continue
+
+            for obj_info, columns, changes in group:
+                expr = Update(changes,
+                              compare_columns(primary_key,
+                                              obj_info["primary_vars"]),
+                              cls_info.table)
+                self._connection.execute(expr, noresult=True)
+                self._flush_updated(obj_info)
+
+    def _flush_removed(self, obj_info):
+        """Forget about an object whose row was just deleted."""
+        # We're sure the cache is valid at this point.
+        obj_info.pop("invalidated", None)
+
+        self._disable_change_notification(obj_info)
+        self._remove_from_alive(obj_info)
+        del obj_info["store"]
+
+    def _flush_inserted(self, obj_info, result=None):
+        """Register an object which was just inserted in the database."""
+        # We're sure the cache is valid at this point. We just added
+        # the object.
+        obj_info.pop("invalidated", None)
+
+        self._fill_missing_values(obj_info, obj_info.primary_vars, result)
+
+        self._enable_change_notification(obj_info)
+        self._add_to_alive(obj_info)
+
+    def _flush_updated(self, obj_info):
+        """Refresh the state of an object whose row was just updated."""
+        self._fill_missing_values(obj_info, obj_info.primary_vars)
+
+        self._add_to_alive(obj_info)
+
     def _flush_one(self, obj_info):
         cls_info = obj_info.cls_info
 
@@ -516,12 +1123,7 @@ class Store(object):
                           cls_info.table)
             self._connection.execute(expr, noresult=True)
 
-            # We're sure the cache is valid at this point.
-            obj_info.pop("invalidated", None)
-
-            self._disable_change_notification(obj_info)
-            self._remove_from_alive(obj_info)
-            del obj_info["store"]
+            self._flush_removed(obj_info)
 
         elif pending is PENDING_ADD:
 
@@ -537,14 +1139,7 @@ class Store(object):
 
             result = self._connection.execute(expr)
 
-            # We're sure the cache is valid at this point. We just added
-            # the object.
-            obj_info.pop("invalidated", None)
-
-            self._fill_missing_values(obj_info, obj_info.primary_vars, result)
-
-            self._enable_change_notification(obj_info)
-            self._add_to_alive(obj_info)
+            self._flush_inserted(obj_info, result)
         else:
             cached_primary_vars = obj_info["primary_vars"]
 
@@ -557,9 +1152,7 @@ class Store(object):
                               cls_info.table)
                 self._connection.execute(expr, noresult=True)
 
-                self._fill_missing_values(obj_info, obj_info.primary_vars)
-
-                self._add_to_alive(obj_info)
+                self._flush_updated(obj_info)
 
         self._run_hook(obj_info, "__storm_flushed__")
 
@@ -589,22 +1182,18 @@ class Store(object):
         @param adding: If true, any defined variables will be considered
                        a change and included in the returned map.
         """
-        cls_info = obj_info.cls_info
+        primary_key_idx = obj_info.cls_info.primary_key_idx
         changes = {}
         select_variables = []
-        for column in cls_info.columns:
-            variable = obj_info.variables[column]
-            if adding or variable.has_changed():
-                if variable.is_defined():
-                    changes[column] = variable
-                else:
-                    lazy_value = variable.get_lazy()
-                    if isinstance(lazy_value, Expr):
-                        if id(column) in cls_info.primary_key_idx:
-                            select_variables.append(variable) # See below.
-                            changes[column] = variable
-                        else:
-                            changes[column] = lazy_value
+        for column, variable in self._iter_changed_variables(obj_info,
+                                                             adding):
+            if variable.is_defined():
+                changes[column] = variable
+            elif id(column) in primary_key_idx:
+                select_variables.append(variable) # See below.
+                changes[column] = variable
+            else:
+                changes[column] = variable.get_lazy()
 
         # If we have any expressions in the primary variables, we
         # have to resolve them now so that we have the identity of
@@ -618,6 +1207,35 @@ class Store(object):
 
         return changes
 
+    def _iter_changed_variables(self, obj_info, adding=False):
+        """Yield C{(column, variable)} pairs for changes to be flushed.
+
+        Unless C{adding} is true, only the columns reported as changed
+        to L{_variable_changed} since the object was last flushed are
+        checked, rather than every variable of the object.
+
+        @param obj_info: ObjectInfo to inspect for changes.
+        @param adding: If true, any defined variables will be considered
+                       a change.
+        """
+        cls_info = obj_info.cls_info
+        variables = obj_info.variables
+        if adding:
+            columns = cls_info.columns
+        else:
+            columns = obj_info.get("changed_columns", ())
+        for column in columns:
+            if (id(column) in cls_info.deferred_idx and
+                not variables.is_built(column) and
+                not (adding and variables.is_defined(column))):
+                # Variables which weren't built can't have changed.
+                continue
+            variable = variables[column]
+            if adding or variable.has_changed():
+                if (variable.is_defined() or
+                    isinstance(variable.get_lazy(), Expr)):
+                    yield column, variable
+
     def _fill_missing_values(self, obj_info, primary_vars, result=None):
         """Fill missing values in variables of the given obj_info.
 
@@ -636,11 +1254,21 @@ class Store(object):
         """
         cls_info = obj_info.cls_info
 
+        # Variables are checkpointed below, so changes made up to now
+        # were flushed.
+        obj_info.pop("changed_columns", None)
+
         cached_primary_vars = obj_info.get("primary_vars")
         primary_key_idx = cls_info.primary_key_idx
+        variables = obj_info.variables
         missing_columns = []
         for column in cls_info.columns:
-            variable = obj_info.variables[column]
+            if (id(column) in cls_info.deferred_idx and
+                not variables.is_built(column)):
+                if not variables.is_defined(column):
+                    variables.set_lazy(column, AutoReload)
+                continue
+            variable = variables[column]
             if not variable.is_defined():
                 idx = primary_key_idx.get(id(column))
                 if idx is not None:
@@ -682,8 +1310,7 @@ class Store(object):
         cls_info = get_cls_info(cls)
 
         # Prepare cache key.
-        primary_vars = []
-        columns = cls_info.columns
+        columns = cls_info.eager_columns
 
         for value in values:
             if value is not None:
@@ -694,24 +1321,34 @@ class Store(object):
             # rows are represented like that.
             return None
 
-        for i in cls_info.primary_key_pos:
-            value = values[i]
-            variable = columns[i].variable_factory(value=value, from_db=True)
-            primary_vars.append(variable)
+        primary_values = cls_info.get_primary_values(
+            [values[i] for i in cls_info.eager_primary_key_pos])
+        if primary_values is None:
+            primary_vars = []
+            for i in cls_info.eager_primary_key_pos:
+                value = values[i]
+                variable = columns[i].variable_factory(value=value,
+                                                       from_db=True)
+                primary_vars.append(variable)
+            primary_values = tuple(var.get(to_db=True)
+                                   for var in primary_vars)
 
         # Lookup cache.
-        primary_values = tuple(var.get(to_db=True) for var in primary_vars)
         obj_info = self._alive.get((cls, primary_values))
 
         if obj_info is not None:
+            self._cache_stats["alive_hits"] += 1
+
             # Found object in cache, and it must be valid since the
             # primary key was extracted from result values.
             obj_info.pop("invalidated", None)
 
             # Take that chance and fill up any undefined variables
             # with fresh data, since we got it anyway.
-            self._set_values(obj_info, cls_info.columns, result,
-                             values, keep_defined=True)
+            if self._set_values(obj_info, columns, result,
+                                values, keep_defined=True):
+                # The cache is renewed just below.
+                self._cache_changed(obj_info)
 
             # We're not sure if the obj is still in memory at this
             # point.  This will rebuild it if needed.
@@ -723,8 +1360,9 @@ class Store(object):
             obj_info = get_obj_info(obj)
             obj_info["store"] = self
 
-            self._set_values(obj_info, cls_info.columns, result, values,
+            self._set_values(obj_info, columns, result, values,
                              replace_unknown_lazy=True)
+            self._set_lazy_columns(obj_info)
 
             self._add_to_alive(obj_info)
             self._enable_change_notification(obj_info)
@@ -758,10 +1396,32 @@ class Store(object):
 
     def _set_values(self, obj_info, columns, result, values,
                     keep_defined=False, replace_unknown_lazy=False):
+        """Set the variables of C{columns} to values from the database.
+
+        @return: True if any value was set.
+        """
         if values is None:
             raise LostObjectError("Can't obtain values from the database "
                                   "(object got removed?)")
         obj_info.pop("invalidated", None)
+        loaded = False
+        if obj_info.cls_info.deferred_columns:
+            # Values of variables which weren't built are only kept
+            # around until they're used.
+            variables = obj_info.variables
+            if keep_defined:
+                deferred_idx = obj_info.cls_info.deferred_idx
+                for column in columns:
+                    if (id(column) in deferred_idx and
+                        not variables.is_built(column) and
+                        not variables.is_defined(column)):
+                        loaded = True
+                        break
+            count = len(columns)
+            columns, values = variables.set_values(
+                columns, values, result.set_variable, keep_defined)
+            if not keep_defined and len(columns) < count:
+                loaded = True
         for column, value in zip(columns, values):
             variable = obj_info.variables[column]
             lazy_value = variable.get_lazy()
@@ -785,7 +1445,28 @@ class Store(object):
                 result.set_variable(variable, value)
 
             variable.checkpoint()
+            loaded = True
+        return loaded
+
+    def _cache_changed(self, obj_info):
+        """Tell the cache that values of C{obj_info} changed, if it cares."""
+        changed = getattr(self._cache, "changed", None)
+        if changed is not None:
+            changed(obj_info)
+
+    def _renew_cached_size(self, obj_info):
+        """Renew C{obj_info} in the cache after values were loaded into it.
+
+        This lets caches bounded by memory account for the new values.
+        """
+        if "primary_values" in obj_info:
+            self._cache_changed(obj_info)
+            self._cache.add(obj_info)
 
+    def _set_lazy_columns(self, obj_info):
+        """Set the variables of lazy columns to be loaded when touched."""
+        for column in obj_info.cls_info.lazy_columns:
+            obj_info.variables[column].set(AutoReload)
 
     def _is_dirty(self, obj_info):
         return obj_info in self._dirty
@@ -794,6 +1475,9 @@ class Store(object):
         if obj_info not in self._dirty:
             self._dirty[obj_info] = obj_info.get_obj()
             obj_info["sequence"] = self._sequence = self._sequence + 1
+            self._cache_changed(obj_info)
+            if self._newly_dirty is not None:
+                self._newly_dirty.append(obj_info)
 
     def _set_clean(self, obj_info):
         self._dirty.pop(obj_info, None)
@@ -820,10 +1504,8 @@ class Store(object):
         objects.
         """
         cls_info = obj_info.cls_info
-        old_primary_vars = obj_info.get("primary_vars")
-        if old_primary_vars is not None:
-            old_primary_values = tuple(
-                var.get(to_db=True) for var in old_primary_vars)
+        old_primary_values = obj_info.get("primary_values")
+        if old_primary_values is not None:
             self._alive.pop((cls_info.cls, old_primary_values), None)
         new_primary_vars = tuple(variable.copy()
                                  for variable in obj_info.primary_vars)
@@ -831,7 +1513,20 @@ class Store(object):
             var.get(to_db=True) for var in new_primary_vars)
         self._alive[cls_info.cls, new_primary_values] = obj_info
         obj_info["primary_vars"] = new_primary_vars
+        # The key is kept so that it's not computed again when the
+        # object leaves the alive map.
+        obj_info["primary_values"] = new_primary_values
         self._cache.add(obj_info)
+        if self._negative_cache is not None:
+            self._negative_cache.remove((cls_info.cls, new_primary_values))
+
+    def _forget_missing(self, cls):
+        """Forget about objects of C{cls} known not to be in the database.
+
+        This is called when rows of C{cls} are changed in bulk.
+        """
+        if self._negative_cache is not None:
+            self._negative_cache.remove_class(cls)
 
     def _remove_from_alive(self, obj_info):
         """Remove an object from the cache.
@@ -840,12 +1535,12 @@ class Store(object):
         deleted and flushed.  Objects that are unused will get removed
         from the cache dictionary automatically by their weakref callbacks.
         """
-        primary_vars = obj_info.get("primary_vars")
-        if primary_vars is not None:
+        primary_values = obj_info.get("primary_values")
+        if primary_values is not None:
             self._cache.remove(obj_info)
-            primary_values = tuple(var.get(to_db=True) for var in primary_vars)
             del self._alive[obj_info.cls_info.cls, primary_values]
             del obj_info["primary_vars"]
+            del obj_info["primary_values"]
 
     def _iter_alive(self):
         return self._alive.values()
@@ -871,6 +1566,12 @@ class Store(object):
                     # This will raise LostObjectError if the object is gone.
                     self._validate_alive(obj_info)
                 self._set_dirty(obj_info)
+                # Remember the column, so that flushing the object
+                # doesn't have to check every variable for changes.
+                changed_columns = obj_info.get("changed_columns")
+                if changed_columns is None:
+                    changed_columns = obj_info["changed_columns"] = set()
+                changed_columns.add(variable.column)
 
 
     def _enable_lazy_resolving(self, obj_info):
@@ -885,7 +1586,9 @@ class Store(object):
         This method is hooked into the obj_info to resolve variables
         set to lazy values when they're accessed.  It will first flush
         the store, and then set all variables set to AutoReload to
-        their database values.
+        their database values.  Variables of lazy columns are only
+        loaded along with the touched variable if they're in its
+        lazy group.
         """
         if lazy_value is not AutoReload and not isinstance(lazy_value, Expr):
             # It's not something we handle.
@@ -898,18 +1601,29 @@ class Store(object):
         if self._implicit_flush_block_count == 0:
             self.flush()
 
+        cls_info = obj_info.cls_info
+        variables = obj_info.variables
+        lazy_group = getattr(variable.column, "lazy_group", None)
         autoreload_columns = []
-        for column in obj_info.cls_info.columns:
-            if obj_info.variables[column].get_lazy() is AutoReload:
-                autoreload_columns.append(column)
+        for column in cls_info.columns:
+            if id(column) in cls_info.deferred_idx:
+                column_lazy_value = variables.get_lazy(column)
+            else:
+                column_lazy_value = variables[column].get_lazy()
+            if column_lazy_value is AutoReload:
+                column_lazy_group = getattr(column, "lazy_group", None)
+                if (column_lazy_group is None or
+                    column_lazy_group == lazy_group):
+                    autoreload_columns.append(column)
 
         if autoreload_columns:
-            where = compare_columns(obj_info.cls_info.primary_key,
+            where = compare_columns(cls_info.primary_key,
                                     obj_info["primary_vars"])
             result = self._connection.execute(
                 Select(autoreload_columns, where))
             self._set_values(obj_info, autoreload_columns,
                              result, result.get_one())
+            self._renew_cached_size(obj_info)
 
 
 class ResultSet(object):
@@ -936,6 +1650,9 @@ class ResultSet(object):
         self._distinct = False
         self._group_by = Undef
         self._having = Undef
+        self._prefetch = ()
+        self._fetch_size = Undef
+        self._readonly = False
 
     def copy(self):
         """Return a copy of this ResultSet object, with the same configuration.
@@ -948,7 +1665,8 @@ class ResultSet(object):
             result_set._select = copy(self._select)
         return result_set
 
-    def config(self, distinct=None, offset=None, limit=None):
+    def config(self, distinct=None, offset=None, limit=None,
+               fetch_size=None):
         """Configure this result object in-place. All parameters are optional.
 
         @param distinct: If True, enables usage of the DISTINCT keyword in
@@ -958,6 +1676,9 @@ class ResultSet(object):
             from the result set.
         @param limit: Limit the number of objects retrieved from the
             result set.
+        @param fetch_size: The number of rows fetched from the database
+            at a time when the result set is iterated, overriding the
+            connection's C{fetch_size}.
 
         @return: self (not a copy).
         """
@@ -968,6 +1689,8 @@ class ResultSet(object):
             self._offset = offset
         if limit is not None:
             self._limit = limit
+        if fetch_size is not None:
+            self._fetch_size = fetch_size
         return self
 
     def _get_select(self):
@@ -986,15 +1709,127 @@ class ResultSet(object):
                       having=self._having)
 
     def _load_objects(self, result, values):
+        if self._readonly:
+            return self._find_spec.load_rows(result, values)
         return self._find_spec.load_objects(self._store, result, values)
 
+    def _execute(self, select):
+        result = self._store._connection.execute(select)
+        if self._fetch_size is not Undef:
+            result.set_arraysize(self._fetch_size)
+        return result
+
     def __iter__(self):
         """Iterate the results of the query.
         """
-        result = self._store._connection.execute(self._get_select())
+        result = self._execute(self._get_select())
+        for obj in self._iter_result(result):
+            yield obj
+
+    def _iter_result(self, result):
+        if self._prefetch:
+            for objects in self._iter_prefetched(result):
+                for obj in objects:
+                    yield obj
+            return
         for values in result:
             yield self._load_objects(result, values)
 
+    def stream(self, batch_size=STREAM_BATCH_SIZE):
+        """Iterate the results of the query, fetching rows in batches.
+
+        Plain iteration may transfer the whole result from the database
+        before the first object is yielded.  This uses a server-side
+        cursor instead, where the backend supports one, so only
+        C{batch_size} rows are held in memory at a time.
+
+        On PostgreSQL the cursor only lives until the end of the
+        transaction.  On MySQL no other statement may be run through
+        the store until the iteration is over.
+
+        @param batch_size: The number of rows fetched from the database
+            at once.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be positive, got %r"
+                             % (batch_size,))
+        return self._stream(batch_size)
+
+    def _stream(self, batch_size):
+        result = self._store._connection.execute(self._get_select(),
+                                                 stream=True)
+        result.set_arraysize(batch_size)
+        try:
+            for obj in self._iter_result(result):
+                yield obj
+        finally:
+            result.close()
+
+    def _iter_prefetched(self, result):
+        """Yield batches of loaded objects, with their references prefetched.
+        """
+        objects = []
+        for values in result:
+            objects.append(self._load_objects(result, values))
+            if len(objects) == PREFETCH_BATCH_SIZE:
+                self._prefetch_references(objects)
+                yield objects
+                objects = []
+        if objects:
+            self._prefetch_references(objects)
+            yield objects
+
+    def _prefetch_references(self, objects):
+        for reference in self._prefetch:
+            reference._prefetch(self._store, objects)
+
+    def prefetch(self, *references):
+        """Load the objects related to the objects in this result set.
+
+        When the result set is iterated, the remote objects of each
+        given L{Reference}, and the contents of each given
+        L{ReferenceSet}, are loaded for a whole batch of objects at
+        once, with one query per reference, rather than one query per
+        object when they're first accessed.
+
+        Prefetched reference sets are used when they're iterated, as
+        long as the database isn't changed through the store in the
+        meantime.
+
+        @param references: The L{Reference} and L{ReferenceSet}
+            properties to prefetch, such as C{Class.reference}.
+        @return: This result set, for convenience.
+        """
+        if self._find_spec.default_cls_info is None:
+            raise FeatureError("Prefetching isn't supported for tuple or "
+                               "expression finds")
+        if self._readonly:
+            raise FeatureError("Prefetching isn't supported for read-only "
+                               "result sets")
+        for reference in references:
+            if getattr(reference, "_prefetch", None) is None:
+                raise FeatureError("Can't prefetch %r" % (reference,))
+        self._prefetch += references
+        return self
+
+    def readonly(self):
+        """Load read-only rows rather than objects.
+
+        Objects in the result are replaced by immutable L{ReadOnlyRow}s,
+        holding the values of the columns loaded along with objects of
+        the class, which may be accessed by property name or position.
+        Rows aren't tracked by the store, so they're cheap to build but
+        don't reflect later changes, and they can't be used in place of
+        objects.
+
+        @return: This result set, for convenience.
+        """
+        if self._prefetch:
+            raise FeatureError("Prefetching isn't supported for read-only "
+                               "result sets")
+        self._readonly = True
+        return self
+
     def __getitem__(self, index):
         """Get an individual item by offset, or a range of items by slice.
 
@@ -1195,8 +2030,10 @@ class ResultSet(object):
         if self._select is not Undef:
             raise FeatureError("Removing isn't supported with "
                                "set expressions (unions, etc)")
+        self._store._serial += 1
         result = self._store._connection.execute(
             Delete(self._where, self._find_spec.default_cls_info.table))
+        self._store._forget_missing(self._find_spec.default_cls_info.cls)
         return result.rowcount
 
     def group_by(self, *expr):
@@ -1322,7 +2159,7 @@ class ResultSet(object):
             raise FeatureError("values() can't be used with set expressions")
         select = self._get_select()
         select.columns = columns
-        result = self._store._connection.execute(select)
+        result = self._execute(select)
         if len(columns) == 1:
             variable = columns[0].variable_factory()
             for values in result:
@@ -1335,6 +2172,72 @@ class ResultSet(object):
                     result.set_variable(variable, value)
                 yield tuple(variable.get() for variable in variables)
 
+    def values_columnar(self, *columns, **kwargs):
+        """Retrieve only the specified columns, as one sequence per column.
+
+        Like L{values}, this does not load full objects.  Fetched rows
+        are transposed a batch at a time rather than turned into a tuple
+        each, and values which the column's variable would store
+        unchanged aren't converted.
+
+        @param columns: One or more L{storm.expr.Column} objects whose
+            values will be fetched.
+        @param arrays: If True, the values of L{Int}, L{Float} and L{Bool}
+            columns are returned in C{array.array}s, with typecodes C{"l"},
+            C{"d"} and C{"b"}, which take much less memory than lists and
+            may be wrapped by C{numpy.frombuffer()} without copying.
+            Columns with NULLs or integers which don't fit are still
+            returned as lists.
+        @raises FeatureError: Raised if no columns are specified or if this
+            result is a set expression such as a union.
+        @return: A list with a sequence of values for each column.
+        """
+        arrays = kwargs.pop("arrays", False)
+        if kwargs:
+            raise TypeError("values_columnar() got unexpected keyword "
+                            "arguments: %s" % ", ".join(sorted(kwargs)))
+        if not columns:
+            raise FeatureError("values_columnar() takes at least one column "
+                               "as argument")
+        if self._select is not Undef:
+            raise FeatureError("values_columnar() can't be used with set "
+                               "expressions")
+        select = self._get_select()
+        select.columns = columns
+        result = self._execute(select)
+        variables = [column.variable_factory() for column in columns]
+        native_types = [_native_types.get(type(variable))
+                        for variable in variables]
+        sequences = []
+        for variable in variables:
+            typecode = arrays and _array_typecodes.get(type(variable))
+            if typecode:
+                sequences.append(array(typecode))
+            else:
+                sequences.append([])
+        while True:
+            rows = result.get_many()
+            if not rows:
+                break
+            for i, values in enumerate(zip(*rows)):
+                variable = variables[i]
+                native_type = native_types[i]
+                converted = []
+                for value in values:
+                    if type(value) is not native_type:
+                        result.set_variable(variable, value)
+                        value = variable.get()
+                    converted.append(value)
+                sequence = sequences[i]
+                if type(sequence) is list:
+                    sequence.extend(converted)
+                    continue
+                try:
+                    sequence.extend(array(sequence.typecode, converted))
+                except (TypeError, OverflowError):
+                    sequences[i] = sequence.tolist() + converted
+        return sequences
+
     def set(self, *args, **kwargs):
         """Update objects in the result set with the given arguments.
 
@@ -1388,6 +2291,7 @@ class ResultSet(object):
         expr = Update(changes, self._where,
                       self._find_spec.default_cls_info.table)
         self._store.execute(expr, noresult=True)
+        self._store._forget_missing(cls)
 
         try:
             cached = self.cached()
@@ -1536,13 +2440,17 @@ class EmptyResultSet(object):
         result = EmptyResultSet(self._order_by)
         return result
 
-    def config(self, distinct=None, offset=None, limit=None):
+    def config(self, distinct=None, offset=None, limit=None,
+               fetch_size=None):
         pass
 
     def __iter__(self):
         return
         yield None
 
+    def stream(self, batch_size=STREAM_BATCH_SIZE):
+        return iter(())
+
     def __getitem__(self, index):
         return self.copy()
 
@@ -1572,6 +2480,12 @@ class EmptyResultSet(object):
         self._order_by = True
         return self
 
+    def prefetch(self, *references):
+        return self
+
+    def readonly(self):
+        return self
+
     def group_by(self, *expr):
         return self
 
@@ -1615,6 +2529,12 @@ class EmptyResultSet(object):
         return
         yield None
 
+    def values_columnar(self, *columns, **kwargs):
+        if not columns:
+            raise FeatureError("values_columnar() takes at least one column "
+                               "as argument")
+        return [[] for column in columns]
+
     def set(self, *args, **kwargs):
         pass
 
@@ -1636,6 +2556,112 @@ class EmptyResultSet(object):
         return self
 
 
+def fetch_concurrently(*result_sets, **kwargs):
+    """Run the queries of several result sets at once.
+
+    Queries are run by up to C{max_workers} threads, each on a new
+    connection to the database of its store, which is taken from the
+    pool of the database if it has one.  Rows are then loaded into the
+    stores of the result sets from the calling thread, so the stores
+    themselves are never used concurrently.
+
+    New connections only see changes which were committed.  So that
+    results match the state of their store, the queries of stores which
+    may have changes not yet committed, because objects are dirty or
+    statements were executed since the last commit or rollback, run on
+    the connection of the store instead, in the calling thread, while
+    the other queries run.
+
+    @param result_sets: L{ResultSet}s, possibly from different stores
+        and databases.
+    @param max_workers: The maximum number of threads running queries,
+        L{FETCH_CONCURRENTLY_MAX_WORKERS} by default.
+    @return: A list with, for each result set, the list of its results.
+    """
+    max_workers = kwargs.pop("max_workers", FETCH_CONCURRENTLY_MAX_WORKERS)
+    if kwargs:
+        raise TypeError("Unexpected keyword arguments: %s"
+                        % ", ".join(sorted(kwargs)))
+    if max_workers < 1:
+        raise ValueError("max_workers must be positive, got %r"
+                         % max_workers)
+    jobs = []
+    local_jobs = []
+    pending_jobs = deque()
+    for result_set in result_sets:
+        if isinstance(result_set, EmptyResultSet):
+            jobs.append(None)
+            continue
+        job = _ConcurrentFetch(result_set)
+        jobs.append(job)
+        store = result_set._store
+        if store._dirty or store._serial != store._committed_serial:
+            local_jobs.append(job)
+        else:
+            pending_jobs.append(job)
+    def work():
+        while True:
+            try:
+                job = pending_jobs.popleft()
+            except IndexError:
+                return
+            job.run()
+    threads = []
+    for i in xrange(min(max_workers, len(pending_jobs))):
+        thread = threading.Thread(target=work)
+        thread.start()
+        threads.append(thread)
+    for job in local_jobs:
+        job.run_in_store()
+    for thread in threads:
+        thread.join()
+    for job in jobs:
+        if job is not None and job.error is not None:
+            raise job.error[0], job.error[1], job.error[2]
+    return [job is not None and job.load() or [] for job in jobs]
+
+
+class _ConcurrentFetch(object):
+    """Fetch the rows of a L{ResultSet} for L{fetch_concurrently}."""
+
+    def __init__(self, result_set):
+        self.result_set = result_set
+        self.select = result_set._get_select()
+        self.result = None
+        self.rows = None
+        self.error = None
+
+    def run(self):
+        try:
+            database = self.result_set._store.get_database()
+            connection = database.connect()
+            try:
+                self.result = connection.execute(self.select)
+                self.rows = self.result.get_all()
+            finally:
+                connection.close()
+        except:
+            self.error = sys.exc_info()
+
+    def run_in_store(self):
+        """Like L{run}, but use the connection of the store."""
+        try:
+            self.result = self.result_set._execute(self.select)
+            self.rows = self.result.get_all()
+        except:
+            self.error = sys.exc_info()
+
+    def load(self):
+        result_set = self.result_set
+        objects = [result_set._load_objects(self.result, values)
+                   for values in self.rows]
+        if result_set._prefetch:
+            for i in xrange(0, len(objects), PREFETCH_BATCH_SIZE):
+                result_set._prefetch_references(
+                    objects[i:i+PREFETCH_BATCH_SIZE])
+        return objects
+
+
 class TableSet(object):
     """The representation of a set of tables which can be queried at once.
 
@@ -1666,6 +2692,53 @@ Store._result_set_factory = ResultSet
 Store._table_set = TableSet
 
 
+class ReadOnlyRow(tuple):
+    """An immutable row loaded by a read-only L{ResultSet}.
+
+    A subclass is built for each class, exposing the value of each of
+    its columns as an attribute named like the column's property.  The
+    class and the attribute names are available as C{_cls} and
+    C{_fields}.  Classes with properties named like these or like
+    attributes of tuples, such as C{count}, can't have read-only rows.
+    """
+
+    __slots__ = ()
+
+    _cls = None
+    _fields = ()
+
+    def __repr__(self):
+        return "<%s row %s>" % (
+            self._cls.__name__,
+            ", ".join("%s=%r" % item for item in zip(self._fields, self)))
+
+
+def get_row_class(cls_info):
+    """Get the L{ReadOnlyRow} subclass for rows of the given class.
+
+    @raise FeatureError: If a property of the class would hide an
+        attribute of the row.
+    """
+    row_class = cls_info.row_class
+    if row_class is None:
+        names = dict((id(column), attr)
+                     for attr, column in cls_info.attributes.iteritems())
+        fields = tuple(names[id(column)]
+                       for column in cls_info.eager_columns)
+        reserved = [attr for attr in fields if hasattr(ReadOnlyRow, attr)]
+        if reserved:
+            raise FeatureError("Read-only rows of %s can't have attributes "
+                               "named %s" % (cls_info.cls.__name__,
+                                             ", ".join(reserved)))
+        namespace = {"__slots__": (), "_cls": cls_info.cls, "_fields": fields}
+        for i, attr in enumerate(fields):
+            namespace[attr] = property(itemgetter(i))
+        row_class = type("%sRow" % cls_info.cls.__name__, (ReadOnlyRow,),
+                         namespace)
+        cls_info.row_class = row_class
+    return row_class
+
+
 class FindSpec(object):
     """The set of tables or expressions in the result of L{Store.find}."""
 
@@ -1692,6 +2765,8 @@ class FindSpec(object):
             self.default_cls_info = None
             self.default_order = Undef
 
+        self._row_layout = None
+
     def get_columns_and_tables(self):
         columns = []
         default_tables = []
@@ -1701,7 +2776,7 @@ class FindSpec(object):
                 if isinstance(info, Column):
                     default_tables.append(info.table)
             else:
-                columns.extend(info.columns)
+                columns.extend(info.eager_columns)
                 default_tables.append(info.table)
         return columns, default_tables
 
@@ -1729,7 +2804,7 @@ class FindSpec(object):
                     value=values[values_start], from_db=True)
                 objects.append(variable.get())
             else:
-                values_end += len(info.columns)
+                values_end += len(info.eager_columns)
                 obj = store._load_object(info, result,
                                          values[values_start:values_end])
                 objects.append(obj)
@@ -1739,6 +2814,64 @@ class FindSpec(object):
         else:
             return objects[0]
 
+    def _get_row_layout(self):
+        row_classes = []
+        variables = []
+        for is_expr, info in self._cls_spec_info:
+            if is_expr:
+                row_classes.append((None, 1))
+                variables.append(getattr(info, "variable_factory", Variable)())
+            else:
+                row_classes.append((get_row_class(info),
+                                    len(info.eager_columns)))
+                variables.extend(column.variable_factory()
+                                 for column in info.eager_columns)
+        native_types = [_native_types.get(type(variable))
+                        for variable in variables]
+        return row_classes, zip(variables, native_types)
+
+    def load_rows(self, result, values):
+        """Like L{load_objects}, but load L{ReadOnlyRow}s for classes.
+
+        Values are converted with one variable per column, which is
+        reused for every row, and values which the variable would store
+        unchanged aren't converted at all.
+        """
+        if self._row_layout is None:
+            self._row_layout = self._get_row_layout()
+        row_classes, converters = self._row_layout
+        objects = []
+        start = 0
+        for row_class, size in row_classes:
+            end = start + size
+            row_values = values[start:end]
+            if row_class is not None:
+                for value in row_values:
+                    if value is not None:
+                        break
+                else:
+                    # A row full of NULLs means that the object wasn't
+                    # found, as in _load_object().
+                    objects.append(None)
+                    start = end
+                    continue
+            converted = []
+            for value, (variable, native_type) in zip(row_values,
+                                                      converters[start:end]):
+                if type(value) is not native_type:
+                    result.set_variable(variable, value)
+                    value = variable.get()
+                converted.append(value)
+            if row_class is None:
+                objects.append(converted[0])
+            else:
+                objects.append(row_class(converted))
+            start = end
+        if self.is_tuple:
+            return tuple(objects)
+        else:
+            return objects[0]
+
     def get_columns_and_values_for_item(self, item):
         """Generate a comparison expression with the given item."""
         if isinstance(item, tuple):
@@ -2,6 +2,7 @@ from datetime import datetime
 import re
 import sys
 import threading
+from time import time
 
 # Circular import: imported at the end of the module.
 # from storm.database import convert_param_marks
@@ -238,6 +239,300 @@ class TimelineTracer(BaseStatementTracer):
             connection, raw_cursor, statement, params)
 
 
+class LatencyHistogram(object):
+    """A histogram of latencies with a bounded relative error.
+
+    Like HDR histograms, values are counted in buckets whose width grows
+    with the magnitude of the values they hold, so that any recorded
+    value is reported with a relative error below C{2 ** -(precision - 1)}
+    while the number of buckets stays logarithmic in the range of values.
+
+    Values are recorded in seconds and kept with microsecond resolution.
+
+    @ivar count: The number of recorded values.
+    """
+
+    def __init__(self, precision=7):
+        """
+        @param precision: The number of significant bits kept for each
+            value.  The default of 7 gives a relative error below 1.6%.
+        """
+        self.precision = precision
+        self.count = 0
+        self._buckets = {}
+
+    def _get_bucket(self, value):
+        """Return the lowest value of the bucket holding C{value}."""
+        shift = value.bit_length() - self.precision
+        if shift <= 0:
+            return value
+        return value >> shift << shift
+
+    def _get_bucket_high(self, bucket):
+        """Return the highest value of the bucket starting at C{bucket}."""
+        shift = bucket.bit_length() - self.precision
+        if shift <= 0:
+            return bucket
+        return bucket + (1 << shift) - 1
+
+    def record(self, value, count=1):
+        """Record C{count} occurrences of the given latency, in seconds."""
+        bucket = self._get_bucket(max(int(value * 1000000), 0))
+        buckets = self._buckets
+        buckets[bucket] = buckets.get(bucket, 0) + count
+        self.count += count
+
+    def merge(self, histogram):
+        """Add the values recorded in another histogram to this one."""
+        buckets = self._buckets
+        for bucket, count in histogram._buckets.items():
+            bucket = self._get_bucket(bucket)
+            buckets[bucket] = buckets.get(bucket, 0) + count
+        self.count += histogram.count
+
+    def copy(self):
+        """Return a new histogram with the same values as this one."""
+        histogram = self.__class__(self.precision)
+        histogram._buckets = self._buckets.copy()
+        histogram.count = self.count
+        return histogram
+
+    def get_buckets(self):
+        """Return a sorted list of C{(highest_value, count)} tuples.
+
+        The highest value of each bucket is given in seconds.
+        """
+        return [(self._get_bucket_high(bucket) / 1000000.0, count)
+                for bucket, count in sorted(self._buckets.items())]
+
+    def get_percentile(self, percentile):
+        """Return the latency at the given percentile, in seconds.
+
+        @param percentile: A number between 0 and 100.
+        @return: The highest value of the bucket holding the requested
+            percentile, or C{None} if nothing was recorded.
+        """
+        if not self.count:
+            return None
+        target = max(self.count * percentile / 100.0, 1)
+        seen = 0
+        for high, count in self.get_buckets():
+            seen += count
+            if seen >= target:
+                return high
+        return high
+
+
+class StatementStats(object):
+    """Aggregated statistics about the executions of a statement shape.
+
+    @ivar shape: The normalized statement.
+    @ivar count: The number of executions.
+    @ivar errors: How many of those executions failed.
+    @ivar total_time: The time spent executing the statement, in seconds.
+    @ivar min_time: The fastest execution time.
+    @ivar max_time: The slowest execution time.
+    @ivar rows: The number of rows reported by the cursors' C{rowcount},
+        for the executions where the backend made it available.
+    @ivar histogram: A L{LatencyHistogram} of the execution times.
+    """
+
+    def __init__(self, shape, precision=7):
+        self.shape = shape
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.min_time = None
+        self.max_time = None
+        self.rows = 0
+        self.histogram = LatencyHistogram(precision)
+
+    def __repr__(self):
+        return "<%s %r count=%d total_time=%f>" % (
+            self.__class__.__name__, self.shape, self.count, self.total_time)
+
+    @property
+    def mean_time(self):
+        """The mean execution time, or C{None} if there were none."""
+        if not self.count:
+            return None
+        return self.total_time / self.count
+
+    def get_percentile(self, percentile):
+        """Return the execution time at the given percentile."""
+        return self.histogram.get_percentile(percentile)
+
+    def record(self, duration, rows=-1, error=False):
+        """Record an execution taking C{duration} seconds."""
+        self.count += 1
+        if error:
+            self.errors += 1
+        self.total_time += duration
+        if self.min_time is None or duration < self.min_time:
+            self.min_time = duration
+        if self.max_time is None or duration > self.max_time:
+            self.max_time = duration
+        if rows > 0:
+            self.rows += rows
+        self.histogram.record(duration)
+
+    def merge(self, stats):
+        """Add the executions recorded in another L{StatementStats}."""
+        self.count += stats.count
+        self.errors += stats.errors
+        self.total_time += stats.total_time
+        if stats.min_time is not None and (self.min_time is None or
+                                           stats.min_time < self.min_time):
+            self.min_time = stats.min_time
+        if stats.max_time is not None and (self.max_time is None or
+                                           stats.max_time > self.max_time):
+            self.max_time = stats.max_time
+        self.rows += stats.rows
+        self.histogram.merge(stats.histogram)
+
+
+_shape_substitutions = [
+    # String literals, with doubled quotes inside them.
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    # Parameter marks of the supported backends.
+    (re.compile(r"%\(\w+\)s|%s|\$\d+"), "?"),
+    # Numbers which aren't part of identifiers.
+    (re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b"), "?"),
+    # Lists of values, as in IN (...), whatever their length.
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)"), "(?, ...)"),
+    (re.compile(r"\s+"), " "),
+    ]
+
+
+def normalize_statement(statement):
+    """Return the shape of a statement, with its parameters stripped.
+
+    Literals and parameter marks are replaced by C{?}, lists of them are
+    collapsed into a single C{(?, ...)}, and whitespace is collapsed, so
+    that executions of the same query with different parameters share
+    the same shape.
+    """
+    for regexp, replacement in _shape_substitutions:
+        statement = regexp.sub(replacement, statement)
+    return statement.strip()
+
+
+class StatsTracer(object):
+    """Aggregate the execution times of statements, by statement shape.
+
+    Statements are normalized by L{normalize_statement}, and a
+    L{StatementStats} is kept for each resulting shape, so that the
+    queries taking most of the database time can be found:
+
+        tracer = StatsTracer()
+        install_tracer(tracer)
+        # Run queries
+        for stats in sorted(tracer.snapshot().values(),
+                            key=lambda stats: stats.total_time):
+            print stats.shape, stats.count, stats.get_percentile(99)
+
+    Each thread accumulates statistics of its own without any locking,
+    and they're merged when L{snapshot} is called.  Figures taken while
+    other threads are executing statements may thus miss their most
+    recent executions.
+    """
+
+    _clock = time
+    _max_cached_shapes = 1000
+
+    def __init__(self, precision=7):
+        """
+        @param precision: The precision of the latency histograms, as
+            given to L{LatencyHistogram}.
+        """
+        self.precision = precision
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._thread_stats = []
+        self._shapes = {}
+
+    def _get_local_stats(self):
+        """Return the statistics of the current thread for this tracer."""
+        local = self._local
+        if getattr(local, "generation", None) != self._generation:
+            local.stats = {}
+            with self._lock:
+                local.generation = self._generation
+                self._thread_stats.append(local.stats)
+        return local.stats
+
+    def _get_shape(self, statement):
+        shape = self._shapes.get(statement)
+        if shape is None:
+            shape = normalize_statement(statement)
+            if len(self._shapes) >= self._max_cached_shapes:
+                self._shapes = {}
+            self._shapes[statement] = shape
+        return shape
+
+    def _record(self, raw_cursor, statement, error):
+        start = getattr(self._local, "start", None)
+        if start is None:
+            # The tracer was installed while the statement was executing,
+            # or another tracer failed before we've seen it.
+            return
+        duration = self._clock() - start
+        self._local.start = None
+        shape = self._get_shape(statement)
+        stats = self._get_local_stats()
+        shape_stats = stats.get(shape)
+        if shape_stats is None:
+            shape_stats = stats[shape] = StatementStats(shape, self.precision)
+        if error:
+            rows = -1
+        else:
+            rows = getattr(raw_cursor, "rowcount", -1)
+        shape_stats.record(duration, rows, error)
+
+    def connection_raw_execute(self, connection, raw_cursor, statement,
+                               params):
+        self._local.start = self._clock()
+
+    def connection_raw_execute_success(self, connection, raw_cursor,
+                                       statement, params):
+        self._record(raw_cursor, statement, False)
+
+    def connection_raw_execute_error(self, connection, raw_cursor,
+                                     statement, params, error):
+        self._record(raw_cursor, statement, True)
+
+    def snapshot(self, reset=False):
+        """Return the statistics aggregated so far.
+
+        @param reset: If true, statistics are reset as well, so that the
+            next snapshot only covers the statements executed after this
+            one.
+        @return: A C{dict} mapping statement shapes to L{StatementStats}
+            instances, which aren't modified by further executions.
+        """
+        with self._lock:
+            thread_stats = self._thread_stats
+            if reset:
+                self._generation += 1
+                self._thread_stats = []
+        result = {}
+        for stats in thread_stats:
+            for shape, shape_stats in stats.items():
+                merged = result.get(shape)
+                if merged is None:
+                    merged = result[shape] = StatementStats(
+                        shape, self.precision)
+                merged.merge(shape_stats)
+        return result
+
+    def reset(self):
+        """Forget the statistics aggregated so far."""
+        with self._lock:
+            self._generation += 1
+            self._thread_stats = []
+
+
 _tracers = []
 
 
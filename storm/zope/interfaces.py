@@ -68,13 +68,15 @@ class IResultSet(Interface):
         Return a copy of this result set object, with the same configuration.
         """
 
-    def config(distinct=None, offset=None, limit=None):
+    def config(distinct=None, offset=None, limit=None, fetch_size=None):
         """Configure the result set.
 
         @param distinct: Optionally, when true, only return distinct rows.
         @param offset: Optionally, the offset to start retrieving
             records from.
         @param limit: Optionally, the maximum number of rows to return.
+        @param fetch_size: Optionally, the number of rows to fetch from
+            the database at a time.
         """
 
     def __iter__():
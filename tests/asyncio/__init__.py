@@ -0,0 +1,14 @@
+__all__ = [
+    'has_asyncio',
+    ]
+
+try:
+    try:
+        import asyncio
+    except ImportError:
+        import trollius as asyncio
+    import concurrent.futures
+except ImportError:
+    has_asyncio = False
+else:
+    has_asyncio = True
@@ -0,0 +1,159 @@
+from storm.database import create_database
+from storm.exceptions import ClosedError, ConnectionBlockedError
+from storm.expr import Count
+from storm.properties import Int, Unicode
+
+from tests.asyncio import has_asyncio
+from tests.helper import TestHelper, MakePath
+
+if has_asyncio:
+    try:
+        import asyncio
+    except ImportError:
+        import trollius as asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    from storm.asyncio.store import AsyncStore
+
+
+class Foo(object):
+    __storm_table__ = "foo"
+    id = Int(primary=True)
+    title = Unicode()
+
+
+class AsyncStoreTest(TestHelper):
+
+    helpers = [MakePath]
+
+    def is_supported(self):
+        return has_asyncio
+
+    def setUp(self):
+        super(AsyncStoreTest, self).setUp()
+        self.database = create_database("sqlite:" + self.make_path())
+        connection = self.database.connect()
+        connection.execute("CREATE TABLE foo "
+                           "(id INTEGER PRIMARY KEY, title VARCHAR)")
+        connection.execute("INSERT INTO foo VALUES (10, 'Title 30')")
+        connection.execute("INSERT INTO foo VALUES (20, 'Title 20')")
+        connection.execute("INSERT INTO foo VALUES (30, 'Title 10')")
+        connection.commit()
+        connection.close()
+        self.loop = asyncio.new_event_loop()
+        # SQLite connections can only be used by the thread which
+        # created them.
+        self.executor = ThreadPoolExecutor(1)
+        self.stores = []
+        self.addCleanup(self.close_all)
+        self.store = self.create_store()
+
+    def close_all(self):
+        # Cleanups run in the order they were added, so stores must be
+        # closed here, before the executor and the loop go away.
+        for store in self.stores:
+            self.wait(store.close())
+        self.executor.shutdown()
+        self.loop.close()
+
+    def create_store(self):
+        store = AsyncStore(self.database, self.executor, self.loop)
+        self.stores.append(store)
+        return store
+
+    def wait(self, future):
+        return self.loop.run_until_complete(future)
+
+    def test_get(self):
+        foo = self.wait(self.store.get(Foo, 10))
+        self.assertEquals((foo.id, foo.title), (10, "Title 30"))
+        self.assertTrue(self.wait(self.store.get(Foo, 10)) is foo)
+
+    def test_get_many(self):
+        foos = self.wait(self.store.get_many(Foo, [20, 40]))
+        self.assertEquals(foos[0].id, 20)
+        self.assertEquals(foos[1], None)
+
+    def test_find_all(self):
+        result = self.store.find(Foo, Foo.id > 10).order_by(Foo.title)
+        foos = self.wait(result.all())
+        self.assertEquals([foo.id for foo in foos], [30, 20])
+
+    def test_find_reruns_query(self):
+        result = self.store.find(Foo)
+        self.assertEquals(self.wait(result.count()), 3)
+        self.wait(self.store.execute("DELETE FROM foo WHERE id=10",
+                                     noresult=True))
+        self.assertEquals(self.wait(result.count()), 2)
+
+    def test_find_slice(self):
+        result = self.store.find(Foo).order_by(Foo.id)[1:]
+        self.assertEquals([foo.id for foo in self.wait(result.all())],
+                          [20, 30])
+        self.assertRaises(TypeError, result.__getitem__, 0)
+
+    def test_find_single_results(self):
+        result = self.store.find(Foo).order_by(Foo.id)
+        self.assertEquals(self.wait(result.first()).id, 10)
+        self.assertEquals(self.wait(result.last()).id, 30)
+        self.assertEquals(self.wait(result.max(Foo.id)), 30)
+        self.assertEquals(self.wait(self.store.find(Foo, id=20).one()).id,
+                          20)
+        self.assertEquals(self.wait(result.values(Foo.id)), [10, 20, 30])
+
+    def test_find_group_by_having(self):
+        self.wait(self.store.execute("INSERT INTO foo VALUES (40, 'Title 10')",
+                                     noresult=True))
+        result = self.store.find((Foo.title, Count()))
+        result = result.group_by(Foo.title).having(Count() > 1)
+        self.assertEquals(self.wait(result.all()), [("Title 10", 2)])
+
+    def test_execute(self):
+        rows = self.wait(self.store.execute("SELECT id FROM foo ORDER BY id"))
+        self.assertEquals(rows, [(10,), (20,), (30,)])
+
+    def test_add_and_commit(self):
+        foo = Foo()
+        foo.id = 40
+        foo.title = u"Title 40"
+        self.wait(self.store.add(foo))
+        self.wait(self.store.commit())
+        other_store = self.create_store()
+        self.assertEquals(self.wait(other_store.get(Foo, 40)).title,
+                          "Title 40")
+
+    def test_rollback(self):
+        foo = self.wait(self.store.get(Foo, 10))
+        foo.title = u"Title 40"
+        self.wait(self.store.flush())
+        self.wait(self.store.rollback())
+        self.wait(self.store.reload(foo))
+        self.assertEquals(foo.title, "Title 30")
+
+    def test_access_blocked_between_calls(self):
+        foo = self.wait(self.store.get(Foo, 10))
+        self.wait(self.store.commit())
+        self.assertRaises(ConnectionBlockedError, getattr, foo, "title")
+        self.wait(self.store.reload(foo))
+        self.assertEquals(foo.title, "Title 30")
+
+    def test_run(self):
+        self.assertEquals(
+            self.wait(self.store.run(lambda store, cls: store.find(cls).count(),
+                                     Foo)),
+            3)
+
+    def test_concurrent_calls(self):
+        futures = [self.store.get(Foo, id) for id in (10, 20, 30)]
+        results = self.wait(asyncio.gather(*futures))
+        self.assertEquals([foo.id for foo in results], [10, 20, 30])
+
+    def test_close(self):
+        self.wait(self.store.get(Foo, 10))
+        self.wait(self.store.close())
+        self.assertRaises(ClosedError, self.wait, self.store.get(Foo, 20))
+
+    def test_close_unused(self):
+        store = AsyncStore(self.database, self.executor, self.loop)
+        self.wait(store.close())
+        self.assertRaises(ClosedError, self.wait, store.get(Foo, 20))
@@ -1,8 +1,12 @@
 from unittest import defaultTestLoader
 
-from storm.properties import Int
+from storm.properties import Int, Pickle
 from storm.info import get_obj_info
-from storm.cache import Cache, GenerationalCache
+from storm.variables import IntVariable, PickleVariable
+from storm.cache import (
+    Cache, GenerationalCache, MemoryBoundCache, NegativeCache,
+    estimate_value_size,
+    estimate_variable_size, register_size_estimator, _size_estimators)
 
 from tests.helper import TestHelper
 
@@ -128,6 +132,20 @@ class BaseCacheTest(TestHelper):
         cache.set_size(0)
         self.assertEquals(cache.get_cached(), [])
 
+    def test_get_stats(self):
+        cache = self.Cache(5)
+        cache.add(self.obj1)
+        stats = cache.get_stats()
+        self.assertEquals(stats["objects"], 1)
+        self.assertEquals(stats["evictions"], 0)
+
+    def test_reset_stats(self):
+        cache = self.Cache(1)
+        for obj_info in self.obj_infos:
+            cache.add(obj_info)
+        cache.reset_stats()
+        self.assertEquals(cache.get_stats()["evictions"], 0)
+
     def test_fit_size(self):
         """
         A cache of size n can hold at least n objects.
@@ -148,6 +166,14 @@ class CacheTest(BaseCacheTest):
         self.assertEquals([obj_info.id for obj_info in cache.get_cached()],
                           [9, 8, 7, 6, 5])
 
+    def test_get_stats_evictions(self):
+        cache = Cache(5)
+        for obj_info in self.obj_infos:
+            cache.add(obj_info)
+        self.assertEquals(cache.get_stats()["evictions"], 5)
+        cache.set_size(3)
+        self.assertEquals(cache.get_stats()["evictions"], 7)
+
     def test_reduce_max_size_to_zero(self):
         """When setting the size to zero, there's an optimization."""
         cache = Cache(5)
@@ -190,6 +216,33 @@ class CacheTest(BaseCacheTest):
                           [5, 4, 3, 2, 1, 0, 9, 8, 7, 6])
 
 
+    def test_add_existing_bumps_entry(self):
+        cache = Cache(5)
+        for obj_info in self.obj_infos[:5]:
+            cache.add(obj_info)
+        cache.add(self.obj_infos[2])
+        cache.add(self.obj_infos[0])
+        self.assertEquals([obj_info.id for obj_info in cache.get_cached()],
+                          [0, 2, 4, 3, 1])
+
+        # The least recently added entry is the one dropped.
+        cache.add(self.obj_infos[5])
+        self.assertEquals([obj_info.id for obj_info in cache.get_cached()],
+                          [5, 0, 2, 4, 3])
+
+    def test_remove_keeps_order(self):
+        cache = Cache(5)
+        for obj_info in self.obj_infos[:5]:
+            cache.add(obj_info)
+        self.assertEquals(cache.remove(self.obj_infos[4]), True)
+        self.assertEquals(cache.remove(self.obj_infos[0]), True)
+        self.assertEquals(cache.remove(self.obj_infos[2]), True)
+        self.assertEquals([obj_info.id for obj_info in cache.get_cached()],
+                          [3, 1])
+        cache.add(self.obj_infos[0])
+        self.assertEquals([obj_info.id for obj_info in cache.get_cached()],
+                          [0, 3, 1])
+
 class TestGenerationalCache(BaseCacheTest):
 
     Cache = GenerationalCache
@@ -363,6 +416,27 @@ class TestGenerationalCache(BaseCacheTest):
 
         self.assertEqual(sorted(cache.get_cached()), [self.obj2, self.obj3])
 
+    def test_get_stats_evictions(self):
+        cache = GenerationalCache(2)
+        for obj_info in self.obj_infos:
+            cache.add(obj_info)
+        stats = cache.get_stats()
+        self.assertEquals(stats["generation_bumps"], 4)
+        self.assertEquals(stats["evictions"], 6)
+        self.assertEquals(stats["objects"], 4)
+
+    def test_get_stats_evictions_with_overlap(self):
+        cache = GenerationalCache(2)
+        cache.add(self.obj1)
+        cache.add(self.obj2)
+        cache.add(self.obj3)
+        cache.add(self.obj1)
+        cache.add(self.obj4)
+        # The second bump evicts obj2 only, since obj1 was used again.
+        stats = cache.get_stats()
+        self.assertEquals(stats["generation_bumps"], 2)
+        self.assertEquals(stats["evictions"], 1)
+
     def test_evict_LRU(self):
         """
         Actually, it's not the oldest but the LRU object that is first
@@ -381,5 +455,185 @@ class TestGenerationalCache(BaseCacheTest):
         self.assertEqual(sorted(cache.get_cached()), [self.obj1, self.obj3])
 
 
+class PickleClass(object):
+
+    __storm_table__ = "pickle_class"
+
+    id = Int(primary=True)
+    data = Pickle()
+
+
+class MemoryBoundCacheTest(TestHelper):
+
+    def setUp(self):
+        super(MemoryBoundCacheTest, self).setUp()
+        self.objs = []
+
+    def make_obj_info(self, data):
+        obj = PickleClass()
+        obj.data = data
+        self.objs.append(obj)
+        return get_obj_info(obj)
+
+    def test_estimate_value_size(self):
+        value = ["x" * 1000, {"a": "y" * 1000}]
+        self.assertTrue(estimate_value_size(value) > 2000)
+
+    def test_estimate_variable_size(self):
+        variable = PickleVariable()
+        self.assertEquals(estimate_variable_size(variable), 0)
+        variable.set(["x" * 1000])
+        self.assertTrue(estimate_variable_size(variable) > 1000)
+
+    def test_register_size_estimator(self):
+        self.addCleanup(_size_estimators.pop, IntVariable)
+        register_size_estimator(IntVariable, lambda variable: 42)
+        self.assertEquals(estimate_variable_size(IntVariable(1)), 42)
+
+    def test_add(self):
+        cache = MemoryBoundCache(100000)
+        obj_info = self.make_obj_info("x" * 1000)
+        cache.add(obj_info)
+        self.assertEquals(cache.get_cached(), [obj_info])
+        stats = cache.get_stats()
+        self.assertTrue(stats["size"] > 1000)
+        self.assertEquals(stats["objects"], 1)
+
+    def test_evicts_by_size(self):
+        cache = MemoryBoundCache(25000)
+        obj_infos = [self.make_obj_info("x" * 10000) for i in range(3)]
+        for obj_info in obj_infos:
+            cache.add(obj_info)
+        self.assertEquals(cache.get_cached(), [obj_infos[2], obj_infos[1]])
+        stats = cache.get_stats()
+        self.assertEquals(stats["evictions"], 1)
+        self.assertTrue(stats["evicted_size"] > 10000)
+        self.assertTrue(stats["size"] <= 25000)
+
+    def test_many_small_objects_fit(self):
+        cache = MemoryBoundCache(25000)
+        obj_infos = [self.make_obj_info(i) for i in range(20)]
+        for obj_info in obj_infos:
+            cache.add(obj_info)
+        self.assertEquals(len(cache.get_cached()), 20)
+
+    def test_object_bigger_than_cache_is_not_kept(self):
+        cache = MemoryBoundCache(5000)
+        cache.add(self.make_obj_info("x" * 10000))
+        self.assertEquals(cache.get_cached(), [])
+        self.assertEquals(cache.get_stats()["size"], 0)
+
+    def test_object_bigger_than_cache_keeps_others(self):
+        cache = MemoryBoundCache(5000)
+        obj_info = self.make_obj_info("x")
+        cache.add(obj_info)
+        cache.add(self.make_obj_info("x" * 10000))
+        self.assertEquals(cache.get_cached(), [obj_info])
+        self.assertEquals(cache.get_stats()["evictions"], 0)
+
+    def test_changed_object_bigger_than_cache_is_removed(self):
+        cache = MemoryBoundCache(5000)
+        obj_info = self.make_obj_info("x")
+        cache.add(obj_info)
+        obj_info.get_obj().data = "x" * 10000
+        cache.changed(obj_info)
+        cache.add(obj_info)
+        self.assertEquals(cache.get_cached(), [])
+        self.assertEquals(cache.get_stats()["size"], 0)
+
+    def test_add_existing_keeps_size(self):
+        cache = MemoryBoundCache(100000)
+        obj_info = self.make_obj_info("x")
+        cache.add(obj_info)
+        size = cache.get_stats()["size"]
+        obj_info.get_obj().data = "x" * 10000
+        cache.add(obj_info)
+        self.assertEquals(cache.get_stats()["size"], size)
+
+    def test_add_changed_estimates_size_again(self):
+        cache = MemoryBoundCache(100000)
+        obj_info = self.make_obj_info("x")
+        cache.add(obj_info)
+        size = cache.get_stats()["size"]
+        obj_info.get_obj().data = "x" * 10000
+        cache.changed(obj_info)
+        cache.add(obj_info)
+        self.assertTrue(cache.get_stats()["size"] > size + 9000)
+        self.assertEquals(cache.get_stats()["objects"], 1)
+
+    def test_remove(self):
+        cache = MemoryBoundCache(100000)
+        obj_info = self.make_obj_info("x" * 1000)
+        cache.add(obj_info)
+        self.assertEquals(cache.remove(obj_info), True)
+        self.assertEquals(cache.remove(obj_info), False)
+        stats = cache.get_stats()
+        self.assertEquals(stats["size"], 0)
+        self.assertEquals(stats["evictions"], 0)
+
+    def test_reduce_size(self):
+        cache = MemoryBoundCache(100000)
+        obj_infos = [self.make_obj_info("x" * 10000) for i in range(3)]
+        for obj_info in obj_infos:
+            cache.add(obj_info)
+        cache.set_size(15000)
+        self.assertEquals(cache.get_cached(), [obj_infos[2]])
+        self.assertEquals(cache.get_stats()["evictions"], 2)
+
+    def test_set_zero_size(self):
+        cache = MemoryBoundCache(100000)
+        cache.add(self.make_obj_info("x"))
+        cache.set_size(0)
+        self.assertEquals(cache.get_cached(), [])
+        self.assertEquals(cache.get_stats()["size"], 0)
+        cache.add(self.make_obj_info("x"))
+        self.assertEquals(cache.get_cached(), [])
+
+
+class NegativeCacheTest(TestHelper):
+
+    def test_add(self):
+        cache = NegativeCache(5)
+        cache.add((StubClass, (1,)))
+        self.assertTrue(cache.has((StubClass, (1,))))
+        self.assertFalse(cache.has((StubClass, (2,))))
+
+    def test_size_limit(self):
+        cache = NegativeCache(2)
+        for i in range(3):
+            cache.add((StubClass, (i,)))
+        self.assertEquals(cache.get_cached(),
+                          [(StubClass, (2,)), (StubClass, (1,))])
+        self.assertEquals(cache.get_stats()["evictions"], 1)
+
+    def test_remove(self):
+        cache = NegativeCache(5)
+        cache.add((StubClass, (1,)))
+        self.assertEquals(cache.remove((StubClass, (1,))), True)
+        self.assertEquals(cache.remove((StubClass, (1,))), False)
+        self.assertFalse(cache.has((StubClass, (1,))))
+
+    def test_remove_class(self):
+        cache = NegativeCache(5)
+        cache.add((StubClass, (1,)))
+        cache.add((StubClass, (2,)))
+        cache.add((PickleClass, (1,)))
+        cache.remove_class(StubClass)
+        self.assertEquals(cache.get_cached(), [(PickleClass, (1,))])
+        cache.remove_class(StubClass)
+
+    def test_clear(self):
+        cache = NegativeCache(5)
+        cache.add((StubClass, (1,)))
+        cache.clear()
+        self.assertEquals(cache.get_cached(), [])
+        cache.remove_class(StubClass)
+
+    def test_size_zero(self):
+        cache = NegativeCache(0)
+        cache.add((StubClass, (1,)))
+        self.assertFalse(cache.has((StubClass, (1,))))
+
+
 def test_suite():
     return defaultTestLoader.loadTestsFromName(__name__)
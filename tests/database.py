@@ -21,8 +21,11 @@
 import sys
 import new
 import gc
+import threading
 
-from storm.exceptions import ClosedError, DatabaseError, DisconnectionError
+from storm.exceptions import (
+    ClosedError, DatabaseError, DisconnectionError, PoolTimeoutError,
+    URIError)
 from storm.variables import Variable
 import storm.database
 from storm.database import *
@@ -94,6 +97,8 @@ class RawCursor(object):
 
 class FakeConnection(object):
 
+    fetch_size = None
+
     def _check_disconnect(self, _function, *args, **kwargs):
         return _function(*args, **kwargs)
 
@@ -191,6 +196,60 @@ class ConnectionTest(TestHelper):
         self.assertRaises(ValueError, self.connection.execute,
                           select, ("something",))
 
+    def test_execute_with_statement_cache(self):
+        statement_cache = get_statement_cache(compile)
+        self.assertTrue(self.connection._statement_cache is statement_cache)
+        hits = statement_cache.get_stats()["hits"]
+        results = []
+        for i in range(2):
+            select = Select(SQLToken("column1"),
+                            Eq(SQLToken("column2"), Variable(i)),
+                            tables=SQLToken("table1"))
+            results.append(self.connection.execute(select))
+        self.assertEquals(self.executed,
+                          [("SELECT column1 FROM table1 WHERE column2 = ?",
+                            (0,)),
+                           ("SELECT column1 FROM table1 WHERE column2 = ?",
+                            (1,))])
+        self.assertEquals(statement_cache.get_stats()["hits"], hits + 1)
+
+    def test_execute_without_statement_cache(self):
+        class MyConnection(Connection):
+            statement_cache_size = 0
+        connection = MyConnection(self.database)
+        self.assertEquals(connection._statement_cache, None)
+        result = connection.execute(Select(SQLToken("column1"),
+                                           tables=SQLToken("table1")))
+        self.assertEquals(self.executed,
+                          [("SELECT column1 FROM table1", marker)])
+
+    def test_execute_insert_many(self):
+        insert = Insert((Column("id"),), SQLToken("test"),
+                        values=[(Variable(1),), (Variable(2),)])
+        self.assertTrue(self.connection.execute_insert_many(
+            insert, [(Variable(1),), (Variable(2),)]))
+        self.assertEquals(self.executed,
+                          [("INSERT INTO test (id) VALUES (?), (?)", (1, 2)),
+                           "RCLOSE"])
+
+    def test_execute_insert_many_with_undefined_primary_variables(self):
+        insert = Insert((Column("id"),), SQLToken("test"),
+                        values=[(Variable(1),), (Variable(2),)])
+        self.assertFalse(self.connection.execute_insert_many(
+            insert, [(Variable(1),), (Variable(),)]))
+        self.assertEquals(self.executed, [])
+
+    def test_execute_stream(self):
+        stream_cursor = RawCursor(executed=self.executed)
+        self.connection.build_raw_stream_cursor = lambda: stream_cursor
+        result = self.connection.execute("something", stream=True)
+        self.assertTrue(result._raw_cursor is stream_cursor)
+        self.assertEquals(self.executed, [("something", marker)])
+
+    def test_build_raw_stream_cursor_defaults_to_regular_cursor(self):
+        raw_cursor = self.connection.build_raw_stream_cursor()
+        self.assertTrue(isinstance(raw_cursor, RawCursor))
+
     def test_execute_closed(self):
         self.connection.close()
         self.assertRaises(ClosedError, self.connection.execute, "SELECT 1")
@@ -463,6 +522,15 @@ class ResultTest(TestHelper):
                           [("fetchall0",), ("fetchall1",)])
         self.assertEquals(self.result.get_all(), [])
 
+    def test_get_many(self):
+        result = Result(FakeConnection(), RawCursor(2))
+        self.assertEquals(result.get_many(),
+                          [("fetchmany0",), ("fetchmany1",)])
+        self.assertEquals(result.get_many(),
+                          [("fetchmany2",), ("fetchmany3",)])
+        self.assertEquals(result.get_many(), [("fetchmany4",)])
+        self.assertEquals(result.get_many(), [])
+
     def test_iter(self):
         result = Result(FakeConnection(), RawCursor(2))
         self.assertEquals([item for item in result],
@@ -512,6 +580,263 @@ class ResultTest(TestHelper):
         result = Result(FakeConnection(), raw_cursor)
         self.assertEquals(raw_cursor.arraysize, 123)
 
+    def test_connection_fetch_size(self):
+        connection = FakeConnection()
+        connection.fetch_size = 1
+        raw_cursor = RawCursor(arraysize=123)
+        Result(connection, raw_cursor)
+        self.assertEquals(raw_cursor.arraysize, 1)
+
+    def test_rows_from_database(self):
+        self.assertEquals(self.result.rows_from_database([[1, 2], (3, 4)]),
+                          [(1, 2), (3, 4)])
+
+    def test_rows_from_database_uses_from_database(self):
+        class MyResult(Result):
+            @staticmethod
+            def from_database(row):
+                return [value * 2 for value in row]
+        result = MyResult(FakeConnection(), RawCursor())
+        self.assertEquals(result.rows_from_database([(1, 2), (3, 4)]),
+                          [(2, 4), (6, 8)])
+        self.assertEquals(result.get_all(),
+                          [("fetchall0fetchall0",), ("fetchall1fetchall1",)])
+
+    def test_set_arraysize_for_iteration(self):
+        result = Result(FakeConnection(), RawCursor())
+        result.set_arraysize(3)
+        self.assertEquals(result._raw_cursor.arraysize, 3)
+        self.assertEquals(list(result),
+                          [("fetchmany0",), ("fetchmany1",), ("fetchmany2",),
+                           ("fetchmany3",), ("fetchmany4",)])
+
+
+class ConnectionPoolTest(TestHelper):
+
+    def setUp(self):
+        TestHelper.setUp(self)
+        self.executed = []
+        self.raw_connections = []
+        self.database = Database()
+        self.database.raw_connect = self.raw_connect
+        self.now = 1000.0
+
+    def raw_connect(self):
+        raw_connection = RawConnection(self.executed)
+        self.raw_connections.append(raw_connection)
+        return raw_connection
+
+    def create_pool(self, **kwargs):
+        pool = ConnectionPool(self.database, **kwargs)
+        pool._clock = lambda: self.now
+        self.database.pool = pool
+        return pool
+
+    def test_get_opens_connection(self):
+        pool = self.create_pool()
+        raw_connection = pool.get()
+        self.assertEquals(self.raw_connections, [raw_connection])
+        self.assertEquals(pool.get_stats(), {"in_use": 1, "idle": 0})
+
+    def test_put_rolls_back_and_keeps_connection(self):
+        pool = self.create_pool()
+        raw_connection = pool.get()
+        pool.put(raw_connection)
+        self.assertEquals(self.executed, ["ROLLBACK"])
+        self.assertEquals(pool.get_stats(), {"in_use": 0, "idle": 1})
+        self.assertTrue(pool.get() is raw_connection)
+        self.assertEquals(len(self.raw_connections), 1)
+
+    def test_put_broken_connection(self):
+        pool = self.create_pool(max_size=1)
+        raw_connection = pool.get()
+        pool.put(raw_connection, broken=True)
+        self.assertEquals(self.executed, ["CCLOSE"])
+        self.assertEquals(pool.get_stats(), {"in_use": 0, "idle": 0})
+        self.assertFalse(pool.get() is raw_connection)
+
+    def test_put_failing_rollback(self):
+        pool = self.create_pool()
+        raw_connection = pool.get()
+        def rollback():
+            raise DatabaseError("connection lost")
+        raw_connection.rollback = rollback
+        pool.put(raw_connection)
+        self.assertEquals(self.executed, ["CCLOSE"])
+        self.assertEquals(pool.get_stats(), {"in_use": 0, "idle": 0})
+
+    def test_put_twice(self):
+        pool = self.create_pool()
+        raw_connection = pool.get()
+        pool.put(raw_connection)
+        pool.put(raw_connection)
+        self.assertEquals(pool.get_stats(), {"in_use": 0, "idle": 1})
+
+    def test_put_resets_with_database(self):
+        pool = self.create_pool()
+        raw_connection = pool.get()
+        self.database.reset_raw_connection = self.executed.append
+        pool.put(raw_connection)
+        self.assertEquals(self.executed, [raw_connection])
+        self.assertEquals(pool.get_stats(), {"in_use": 0, "idle": 1})
+
+    def test_put_foreign_connection(self):
+        pool = self.create_pool()
+        raw_connection = RawConnection(self.executed)
+        pool.put(raw_connection)
+        self.assertEquals(self.executed, ["ROLLBACK", "CCLOSE"])
+        self.assertEquals(pool.get_stats(), {"in_use": 0, "idle": 0})
+
+    def test_max_size_timeout(self):
+        pool = self.create_pool(max_size=1, timeout=0)
+        pool.get()
+        self.assertRaises(PoolTimeoutError, pool.get)
+
+    def test_max_size_waits_for_connection(self):
+        pool = ConnectionPool(self.database, max_size=1)
+        raw_connection = pool.get()
+        got = []
+        thread = threading.Thread(target=lambda: got.append(pool.get()))
+        thread.start()
+        pool.put(raw_connection)
+        thread.join(5)
+        self.assertEquals(got, [raw_connection])
+
+    def test_max_idle(self):
+        pool = self.create_pool(max_idle=10)
+        raw_connection1 = pool.get()
+        raw_connection2 = pool.get()
+        pool.put(raw_connection1)
+        self.now += 5
+        pool.put(raw_connection2)
+        self.now += 6
+        self.assertTrue(pool.get() is raw_connection2)
+        self.assertEquals(self.executed, ["ROLLBACK", "ROLLBACK", "CCLOSE"])
+        self.assertEquals(pool.get_stats(), {"in_use": 1, "idle": 0})
+
+    def test_max_idle_keeps_min_size(self):
+        pool = self.create_pool(max_idle=10, min_size=1)
+        raw_connection1 = pool.get()
+        raw_connection2 = pool.get()
+        pool.put(raw_connection1)
+        pool.put(raw_connection2)
+        self.now += 20
+        pool.put(pool.get())
+        self.assertEquals(pool.get_stats(), {"in_use": 0, "idle": 1})
+        self.assertEquals(self.executed.count("CCLOSE"), 1)
+
+    def test_max_lifetime(self):
+        pool = self.create_pool(max_lifetime=60)
+        raw_connection = pool.get()
+        self.now += 60
+        pool.put(raw_connection)
+        self.assertEquals(self.executed, ["ROLLBACK", "CCLOSE"])
+        self.assertFalse(pool.get() is raw_connection)
+
+    def test_max_lifetime_of_idle_connection(self):
+        pool = self.create_pool(max_lifetime=60)
+        raw_connection = pool.get()
+        self.now += 30
+        pool.put(raw_connection)
+        self.now += 30
+        self.assertFalse(pool.get() is raw_connection)
+        self.assertEquals(self.executed, ["ROLLBACK", "CCLOSE"])
+
+    def test_check_query(self):
+        pool = self.create_pool(check_query="SELECT 1")
+        raw_connection = pool.get()
+        pool.put(raw_connection)
+        del self.executed[:]
+        self.assertTrue(pool.get() is raw_connection)
+        self.assertEquals(self.executed,
+                          [("SELECT 1", marker), "RCLOSE", "ROLLBACK"])
+
+    def test_check_query_failure(self):
+        pool = self.create_pool(check_query="SELECT 1")
+        raw_connection = pool.get()
+        pool.put(raw_connection)
+        def cursor():
+            raise DatabaseError("connection lost")
+        raw_connection.cursor = cursor
+        self.assertFalse(pool.get() is raw_connection)
+        self.assertEquals(len(self.raw_connections), 2)
+        self.assertEquals(pool.get_stats(), {"in_use": 1, "idle": 0})
+
+    def test_open_failure(self):
+        pool = self.create_pool(max_size=1)
+        def raw_connect():
+            raise DatabaseError("could not connect")
+        self.database.raw_connect = raw_connect
+        self.assertRaises(DatabaseError, pool.get)
+        self.database.raw_connect = self.raw_connect
+        pool.get()
+
+    def test_close(self):
+        pool = self.create_pool()
+        raw_connection1 = pool.get()
+        raw_connection2 = pool.get()
+        pool.put(raw_connection1)
+        pool.close()
+        self.assertEquals(self.executed, ["ROLLBACK", "CCLOSE"])
+        pool.put(raw_connection2)
+        self.assertEquals(self.executed,
+                          ["ROLLBACK", "CCLOSE", "ROLLBACK", "CCLOSE"])
+        self.assertEquals(pool.get_stats(), {"in_use": 0, "idle": 0})
+
+    def test_invalid_max_size(self):
+        self.assertRaises(ValueError, ConnectionPool, self.database,
+                          max_size=0)
+
+    def test_connection_uses_pool(self):
+        pool = self.create_pool()
+        connection = Connection(self.database)
+        raw_connection = connection._raw_connection
+        connection.close()
+        self.assertEquals(self.executed, ["ROLLBACK"])
+        connection = Connection(self.database)
+        self.assertTrue(connection._raw_connection is raw_connection)
+
+    def test_connection_reconnects_from_pool(self):
+        pool = self.create_pool(max_size=1)
+        connection = Connection(self.database)
+        raw_connection = connection._raw_connection
+        connection.is_disconnection_error = (
+            lambda exc, extra_disconnection_errors=(): True)
+        def raise_exception():
+            raise DatabaseError("connection lost")
+        self.assertRaises(DisconnectionError,
+                          connection._check_disconnect, raise_exception)
+        self.assertEquals(pool.get_stats(), {"in_use": 0, "idle": 0})
+        connection.rollback()
+        self.assertEqual(connection._state, storm.database.STATE_RECONNECT)
+        connection._ensure_connected()
+        self.assertFalse(connection._raw_connection is raw_connection)
+        self.assertEquals(pool.get_stats(), {"in_use": 1, "idle": 0})
+
+    def test_from_options(self):
+        pool = ConnectionPool.from_options(
+            self.database, {"pool_min_size": "1", "pool_max_size": "5",
+                            "pool_max_idle": "30", "pool_max_lifetime": "3600",
+                            "pool_check_query": "SELECT 1",
+                            "pool_timeout": "2.5", "isolation": "serializable"})
+        self.assertEquals(pool.min_size, 1)
+        self.assertEquals(pool.max_size, 5)
+        self.assertEquals(pool.max_idle, 30.0)
+        self.assertEquals(pool.max_lifetime, 3600.0)
+        self.assertEquals(pool.check_query, "SELECT 1")
+        self.assertEquals(pool.timeout, 2.5)
+
+    def test_from_options_without_pool_options(self):
+        self.assertEquals(
+            ConnectionPool.from_options(self.database, {"timeout": "5"}),
+            None)
+
+    def test_from_options_invalid(self):
+        self.assertRaises(URIError, ConnectionPool.from_options,
+                          self.database, {"pool_size": "5"})
+        self.assertRaises(URIError, ConnectionPool.from_options,
+                          self.database, {"pool_max_size": "many"})
+
 
 class CreateDatabaseTest(TestHelper):
 
@@ -546,6 +871,17 @@ class CreateDatabaseTest(TestHelper):
         create_database(uri)
         self.assertTrue(self.uri is uri)
 
+    def test_create_database_with_pool_options(self):
+        self.db_module.create_from_uri = lambda uri: Database()
+        database = create_database("db_module:db?pool_max_size=3")
+        self.assertTrue(isinstance(database.pool, ConnectionPool))
+        self.assertEquals(database.pool.max_size, 3)
+
+    def test_create_database_without_pool_options(self):
+        self.db_module.create_from_uri = lambda uri: Database()
+        database = create_database("db_module:db")
+        self.assertEquals(database.pool, None)
+
 
 class RegisterSchemeTest(TestHelper):
 
@@ -19,14 +19,19 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 from datetime import date, time, timedelta
+from decimal import Decimal
 import os
 
 from storm.databases.postgres import (
-    Postgres, compile, currval, Returning, PostgresTimeoutTracer, make_dsn)
+    Postgres, compile, currval, Returning, PostgresTimeoutTracer, make_dsn,
+    PreparedStatements, convert_to_numbered_params, get_parameter_type,
+    psycopg2)
 from storm.database import create_database
+from storm.databases import dummy
 from storm.exceptions import InterfaceError, ProgrammingError
 from storm.variables import DateTimeVariable, RawStrVariable
-from storm.variables import ListVariable, IntVariable, Variable
+from storm.variables import (
+    ListVariable, IntVariable, UnicodeVariable, Variable)
 from storm.properties import Int
 from storm.exceptions import DisconnectionError, OperationalError
 from storm.expr import (Union, Select, Insert, Update, Alias, SQLRaw, State,
@@ -129,6 +134,61 @@ class PostgresTest(DatabaseTest, TestHelper):
             server_version = int(result.get_one()[0])
             self.assertEquals(version, server_version)
 
+    def test_session_settings(self):
+        database = create_database(
+            os.environ["STORM_POSTGRES_URI"] +
+            "?timezone=UTC&statement_timeout=12345&application_name=storm")
+        connection = database.connect()
+        self.addCleanup(connection.close)
+        self.assertEquals(connection.execute("SHOW timezone").get_one(),
+                          ("UTC",))
+        self.assertEquals(
+            connection.execute("SHOW statement_timeout").get_one(),
+            ("12345ms",))
+        self.assertEquals(
+            connection.execute("SHOW application_name").get_one(),
+            ("storm",))
+
+    def test_session_settings_survive_rollback(self):
+        database = create_database(
+            os.environ["STORM_POSTGRES_URI"] + "?timezone=UTC")
+        connection = database.connect()
+        self.addCleanup(connection.close)
+        connection.rollback()
+        self.assertEquals(connection.execute("SHOW timezone").get_one(),
+                          ("UTC",))
+
+    def test_add_setup_statement(self):
+        database = create_database(os.environ["STORM_POSTGRES_URI"])
+        database.add_setup_statement("SET search_path TO public")
+        database.add_setup_statement("SET extra_float_digits TO 2")
+        connection = database.connect()
+        self.addCleanup(connection.close)
+        self.assertEquals(connection.execute("SHOW search_path").get_one(),
+                          ("public",))
+        self.assertEquals(
+            connection.execute("SHOW extra_float_digits").get_one(),
+            ("2",))
+
+    def test_add_setup_statement_with_settings(self):
+        database = create_database(
+            os.environ["STORM_POSTGRES_URI"] + "?application_name=storm")
+        database.add_setup_statement(
+            "CREATE TEMP TABLE setup_test AS SELECT '100%' AS value")
+        connection = database.connect()
+        self.addCleanup(connection.close)
+        self.assertEquals(
+            connection.execute("SELECT value FROM setup_test").get_one(),
+            ("100%",))
+
+    def test_wb_version_found_once(self):
+        version = self.database._version
+        self.database._version = 123
+        connection = self.database.connect()
+        self.addCleanup(connection.close)
+        self.assertEquals(self.database._version, 123)
+        self.database._version = version
+
     def test_utf8_client_encoding(self):
         connection = self.database.connect()
         result = connection.execute("SHOW client_encoding")
@@ -471,6 +531,36 @@ class PostgresTest(DatabaseTest, TestHelper):
 
         self.assertEquals(result.get_one(), (123, 456))
 
+    def test_execute_insert_many_returns_rows_in_order(self):
+        if self.database._version < 80200:
+            return # Can't run this test with old PostgreSQL versions.
+
+        id = Column("id", "test")
+        title = Column("title", "test")
+        titles = [u"Title %d" % i for i in range(100)]
+        insert = Insert((title,), "test", primary_columns=(id,),
+                        values=[(UnicodeVariable(value),) for value in titles])
+        primary_variables = [(IntVariable(),) for value in titles]
+        self.assertTrue(
+            self.connection.execute_insert_many(insert, primary_variables))
+        result = self.connection.execute("SELECT id, title FROM test")
+        inserted = dict(result.get_all())
+        self.assertEquals([inserted[variables[0].get()]
+                           for variables in primary_variables], titles)
+
+    def test_execute_insert_many_with_known_keys(self):
+        id = Column("id", "test")
+        title = Column("title", "test")
+        insert = Insert((id, title), "test", primary_columns=(id,),
+                        values=[(IntVariable(1), UnicodeVariable(u"Title 1")),
+                                (IntVariable(2), UnicodeVariable(u"Title 2"))])
+        self.assertTrue(self.connection.execute_insert_many(
+            insert, [(IntVariable(1),), (IntVariable(2),)]))
+        result = self.connection.execute("SELECT id, title FROM test "
+                                         "ORDER BY id")
+        self.assertEquals(result.get_all(), [(1, u"Title 1"),
+                                             (2, u"Title 2")])
+
     def test_execute_update_returning(self):
         if self.database._version < 80200:
             return # Can't run this test with old PostgreSQL versions.
@@ -570,6 +660,166 @@ class PostgresTest(DatabaseTest, TestHelper):
         self.assertRaises(ValueError, create_database,
             os.environ["STORM_POSTGRES_URI"] + "?isolation=stuff")
 
+    def create_prepared_statements_connection(self, options):
+        database = create_database(
+            os.environ["STORM_POSTGRES_URI"] + "?" + options)
+        connection = database.connect()
+        self.addCleanup(connection.close)
+        return connection
+
+    def get_prepared_statements(self, connection):
+        # The semicolon prevents this statement from being prepared.
+        result = connection.execute("SELECT name, statement "
+                                    "FROM pg_prepared_statements "
+                                    "ORDER BY name;")
+        return result.get_all()
+
+    def test_prepared_statements_disabled_by_default(self):
+        self.assertEquals(self.connection._prepared_statements, None)
+
+    def test_prepared_statements(self):
+        connection = self.create_prepared_statements_connection(
+            "prepared_statements=10&prepare_threshold=2")
+        statement = "SELECT one, two FROM number WHERE one = ?"
+        connection.execute("INSERT INTO number VALUES (1, 2, 3)")
+        self.assertEquals(
+            connection.execute(statement, (1,)).get_all(), [(1, 2)])
+        self.assertEquals(self.get_prepared_statements(connection), [])
+        self.assertEquals(
+            connection.execute(statement, (1,)).get_all(), [(1, 2)])
+        self.assertEquals(
+            connection.execute(statement, (2,)).get_all(), [])
+        name = connection._prepared_statements.get_name(
+            statement, ("integer",))
+        self.assertEquals(
+            self.get_prepared_statements(connection),
+            [(name, "PREPARE %s (integer) AS "
+                    "SELECT one, two FROM number WHERE one = $1" % name)])
+
+    def test_prepared_statements_with_unconstrained_parameters(self):
+        """
+        Parameters whose type isn't given by the statement behave like
+        the literals of unprepared statements.
+        """
+        connection = self.create_prepared_statements_connection(
+            "prepared_statements=10&prepare_threshold=2")
+        statement = "SELECT ?, ? IS NULL"
+        for params in [(1, None), (2, None), (3, None), (2**40, 1),
+                       (2**40, None), (1.5, u"text"), (u"text", 1.5)]:
+            expected = connection.execute(statement, params).get_one()
+            for i in range(2):
+                self.assertEquals(
+                    connection.execute(statement, params).get_one(),
+                    expected)
+        self.assertEquals(
+            connection.execute(statement, (1, None)).get_one(), (1, True))
+        self.assertEquals(
+            connection.execute(statement, (2**40, 1)).get_one(),
+            (2**40, False))
+        self.assertNotEquals(
+            connection._prepared_statements.get_name(
+                statement, ("bigint", "integer")), None)
+
+    def test_prepared_statements_deallocated(self):
+        connection = self.create_prepared_statements_connection(
+            "prepared_statements=1&prepare_threshold=1")
+        connection.execute("SELECT 1")
+        connection.execute("SELECT 2")
+        name = connection._prepared_statements.get_name("SELECT 2")
+        self.assertEquals(
+            self.get_prepared_statements(connection),
+            [(name, "PREPARE %s AS SELECT 2" % name)])
+        self.assertEquals(connection.execute("SELECT 1").get_one(), (1,))
+
+    def test_prepared_statements_not_preparable(self):
+        connection = self.create_prepared_statements_connection(
+            "prepared_statements=10&prepare_threshold=1")
+        connection.execute("SHOW TRANSACTION ISOLATION LEVEL")
+        self.assertEquals(self.get_prepared_statements(connection), [])
+
+    def test_prepared_statements_failing_prepare(self):
+        """
+        A statement which can't be prepared is still executed as usual,
+        and isn't prepared again.
+        """
+        connection = self.create_prepared_statements_connection(
+            "prepared_statements=10&prepare_threshold=1")
+        statement = "SELECT * FROM unknown_table"
+        self.assertRaises(ProgrammingError, connection.execute, statement)
+        connection.rollback()
+        self.assertFalse(
+            connection._prepared_statements.should_prepare(statement))
+        self.assertEquals(self.get_prepared_statements(connection), [])
+
+    def test_wb_prepared_statements_prepared_again_after_reconnect(self):
+        connection = self.create_prepared_statements_connection(
+            "prepared_statements=10&prepare_threshold=1")
+        connection.execute("SELECT 1")
+        connection._raw_connection.close()
+        connection._raw_connection = connection._database.raw_connect()
+        self.assertEquals(connection.execute("SELECT 1").get_one(), (1,))
+        name = connection._prepared_statements.get_name("SELECT 1")
+        self.assertEquals(
+            self.get_prepared_statements(connection),
+            [(name, "PREPARE %s AS SELECT 1" % name)])
+
+    def test_prepared_statements_deallocated_when_pooled(self):
+        database = create_database(
+            os.environ["STORM_POSTGRES_URI"] +
+            "?prepared_statements=10&prepare_threshold=1&pool_max_size=1")
+        self.addCleanup(database.pool.close)
+        connection = database.connect()
+        connection.execute("SELECT 1")
+        connection.close()
+        connection = database.connect()
+        self.addCleanup(connection.close)
+        self.assertEquals(self.get_prepared_statements(connection), [])
+
+    def test_prepared_statements_on_reused_raw_connection(self):
+        """
+        Statements left prepared in the session of a raw connection don't
+        clash with the ones of the next connection using it.
+        """
+        connection1 = self.create_prepared_statements_connection(
+            "prepared_statements=10&prepare_threshold=1")
+        connection1.execute("SELECT 1")
+        connection2 = self.create_prepared_statements_connection(
+            "prepared_statements=10&prepare_threshold=1")
+        raw_connection = connection2._raw_connection
+        connection2._raw_connection = connection1._raw_connection
+        raw_connection.close()
+        self.assertEquals(connection2.execute("SELECT 2").get_one(), (2,))
+        self.assertNotEquals(
+            connection2._prepared_statements.get_name("SELECT 2"), None)
+        self.assertEquals(
+            len(self.get_prepared_statements(connection2)), 2)
+
+    def test_execute_stream_uses_named_cursor(self):
+        self.connection.execute("INSERT INTO number VALUES (1, 2, 3)")
+        self.connection.execute("INSERT INTO number VALUES (4, 5, 6)")
+        result = self.connection.execute(
+            "SELECT one FROM number ORDER BY one", stream=True)
+        self.assertEquals(result._raw_cursor.name, "storm_stream_1")
+        result.set_arraysize(1)
+        self.assertEquals(list(result), [(1,), (4,)])
+
+    def test_execute_stream_with_prepared_statements(self):
+        connection = self.create_prepared_statements_connection(
+            "prepared_statements=10&prepare_threshold=1")
+        statement = "SELECT 1"
+        connection.execute(statement)
+        result = connection.execute(statement, stream=True)
+        self.assertEquals(result.get_all(), [(1,)])
+
+    def test_execute_stream_in_autocommit_mode(self):
+        database = create_database(
+            os.environ["STORM_POSTGRES_URI"] + "?isolation=autocommit")
+        connection = database.connect()
+        self.addCleanup(connection.close)
+        result = connection.execute("SELECT 1", stream=True)
+        self.assertEquals(result._raw_cursor.name, None)
+        self.assertEquals(result.get_all(), [(1,)])
+
     def test_is_disconnection_error_with_ssl_syscall_error(self):
         """
         If the underlying driver raises a ProgrammingError with 'SSL SYSCALL
@@ -598,6 +848,110 @@ class PostgresTest(DatabaseTest, TestHelper):
         self.assertTrue(self.connection.is_disconnection_error(exc))
 
 
+class ConvertToNumberedParamsTest(TestHelper):
+
+    def test_convert(self):
+        self.assertEquals(
+            convert_to_numbered_params("SELECT %s, %s, '%%'", 2),
+            "SELECT $1, $2, '%'")
+
+    def test_convert_without_params(self):
+        self.assertEquals(convert_to_numbered_params("SELECT '%'", 0),
+                          "SELECT '%'")
+
+    def test_convert_with_wrong_params_count(self):
+        self.assertEquals(convert_to_numbered_params("SELECT %s", 2), None)
+
+    def test_convert_with_named_params(self):
+        self.assertEquals(
+            convert_to_numbered_params("SELECT %(name)s", 1), None)
+
+
+class GetParameterTypeTest(TestHelper):
+
+    def is_supported(self):
+        return psycopg2 is not dummy
+
+    def test_integers(self):
+        self.assertEquals(get_parameter_type(1), "integer")
+        self.assertEquals(get_parameter_type(-2**31 + 1), "integer")
+        self.assertEquals(get_parameter_type(-2**31), "bigint")
+        self.assertEquals(get_parameter_type(2**40), "bigint")
+        self.assertEquals(get_parameter_type(2**63), "numeric")
+
+    def test_floats_and_decimals(self):
+        self.assertEquals(get_parameter_type(1.5), "numeric")
+        self.assertEquals(get_parameter_type(float("nan")),
+                          "double precision")
+        self.assertEquals(get_parameter_type(Decimal("1.5")), "numeric")
+
+    def test_boolean(self):
+        self.assertEquals(get_parameter_type(True), "boolean")
+
+    def test_strings_and_null(self):
+        self.assertEquals(get_parameter_type("text"), "unknown")
+        self.assertEquals(get_parameter_type(None), "unknown")
+
+    def test_binary(self):
+        self.assertEquals(get_parameter_type(psycopg2.Binary("data")),
+                          "bytea")
+
+    def test_unknown(self):
+        self.assertEquals(get_parameter_type([1, 2]), None)
+
+
+class PreparedStatementsTest(TestHelper):
+
+    def test_should_prepare(self):
+        prepared_statements = PreparedStatements(10, 3)
+        self.assertFalse(prepared_statements.should_prepare("SELECT 1"))
+        self.assertFalse(prepared_statements.should_prepare("SELECT 1"))
+        self.assertTrue(prepared_statements.should_prepare("SELECT 1"))
+
+    def test_should_prepare_with_param_types(self):
+        prepared_statements = PreparedStatements(10, 2)
+        self.assertFalse(
+            prepared_statements.should_prepare("SELECT %s", ("integer",)))
+        self.assertFalse(
+            prepared_statements.should_prepare("SELECT %s", ("bigint",)))
+        self.assertTrue(
+            prepared_statements.should_prepare("SELECT %s", ("integer",)))
+
+    def test_add(self):
+        prepared_statements = PreparedStatements(2, 1)
+        name1, evicted_name = prepared_statements.add("SELECT 1")
+        self.assertEquals(evicted_name, None)
+        name2, evicted_name = prepared_statements.add("SELECT 2")
+        self.assertEquals(evicted_name, None)
+        self.assertEquals(prepared_statements.get_name("SELECT 1"), name1)
+        name3, evicted_name = prepared_statements.add("SELECT 3")
+        self.assertEquals(evicted_name, name2)
+        self.assertEquals(prepared_statements.get_name("SELECT 2"), None)
+        self.assertEquals(len(set([name1, name2, name3])), 3)
+
+    def test_names_are_unique_across_instances(self):
+        name1 = PreparedStatements(10, 1).add("SELECT 1")[0]
+        name2 = PreparedStatements(10, 1).add("SELECT 1")[0]
+        self.assertNotEquals(name1, name2)
+        self.assertTrue(name1.startswith("storm_"))
+
+    def test_set_unpreparable(self):
+        prepared_statements = PreparedStatements(10, 1)
+        prepared_statements.add("SELECT 1")
+        prepared_statements.set_unpreparable("SELECT 1")
+        self.assertEquals(prepared_statements.get_name("SELECT 1"), None)
+        self.assertFalse(prepared_statements.should_prepare("SELECT 1"))
+
+    def test_reset(self):
+        prepared_statements = PreparedStatements(10, 1)
+        prepared_statements.add("SELECT 1")
+        raw_connection = object()
+        prepared_statements.reset(raw_connection)
+        self.assertTrue(prepared_statements.raw_connection is raw_connection)
+        self.assertEquals(prepared_statements.get_name("SELECT 1"), None)
+        self.assertEquals(prepared_statements.add("SELECT 1")[1], None)
+
+
 _max_prepared_transactions = None
 
 
@@ -779,6 +1133,12 @@ class PostgresTimeoutTracerTest(TimeoutTracerTestBase):
         result = self.connection.execute("SHOW statement_timeout")
         self.assertEquals(result.get_one(), ("10500ms",))
 
+    def test_set_statement_timeout_with_named_cursor(self):
+        result = self.connection.execute("SELECT 1", stream=True)
+        self.assertEquals(result.get_one(), (1,))
+        result = self.connection.execute("SHOW statement_timeout")
+        self.assertEquals(result.get_one(), ("10500ms",))
+
     def test_connection_raw_execute_error(self):
         statement = "SELECT pg_sleep(0.5)"
         self.remaining_time = 0.001
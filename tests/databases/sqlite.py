@@ -75,6 +75,25 @@ class SQLiteMemoryTest(DatabaseTest, TestHelper):
             self.assertEquals(result.get_one()[0],
                               synchronous_values[value])
 
+    def test_get_all_converts_buffers(self):
+        self.connection.execute("INSERT INTO bin_test VALUES (1, ?)",
+                                (buffer("\xff\x00"),))
+        self.connection.execute("INSERT INTO bin_test VALUES (2, NULL)")
+        result = self.connection.execute(
+            "SELECT id, b FROM bin_test ORDER BY id")
+        rows = result.get_all()
+        self.assertEquals(rows, [(1, "\xff\x00"), (2, None)])
+        self.assertEquals(type(rows[0][1]), str)
+
+    def test_iter_converts_buffers(self):
+        self.connection.execute("INSERT INTO bin_test VALUES (1, ?)",
+                                (buffer(""),))
+        result = self.connection.execute("SELECT b FROM bin_test")
+        result.set_arraysize(1)
+        rows = list(result)
+        self.assertEquals(rows, [("",)])
+        self.assertEquals(type(rows[0][0]), str)
+
     def test_sqlite_specific_reserved_words(self):
         """Check sqlite-specific reserved words are recognized.
 
@@ -992,6 +992,25 @@ class CompileTest(TestHelper):
         self.assertEquals(statement, "DELETE FROM func2() WHERE func1()")
         self.assertEquals(state.parameters, [])
 
+    def test_case(self):
+        expr = Case([(Func1(), "Hello"), (Func2(), "World")])
+        state = State()
+        statement = compile(expr, state)
+        self.assertEquals(statement,
+                          "CASE WHEN func1() THEN ? WHEN func2() THEN ? END")
+        self.assertVariablesEqual(
+            state.parameters,
+            [RawStrVariable("Hello"), RawStrVariable("World")])
+
+    def test_case_with_expression_and_default(self):
+        expr = Case([(1, "Hello")], expression=Func1(), default=Func2())
+        state = State()
+        statement = compile(expr, state)
+        self.assertEquals(statement,
+                          "CASE func1() WHEN ? THEN ? ELSE func2() END")
+        self.assertVariablesEqual(
+            state.parameters, [IntVariable(1), RawStrVariable("Hello")])
+
     def test_delete_with_strings(self):
         expr = Delete("1 = 2", table1)
         state = State()
@@ -2375,6 +2394,139 @@ class CompilePythonTest(TestHelper):
         self.assertTrue(match({col1: value}.get))
 
 
+class StatementCacheTest(TestHelper):
+
+    def setUp(self):
+        TestHelper.setUp(self)
+        self.cache = StatementCache(compile)
+        self.column = Column(column1, table1)
+
+    def test_compile(self):
+        variable = Variable(1)
+        statement, parameters = self.cache.compile(
+            Select(self.column, self.column == variable, limit=1))
+        self.assertEquals(statement, 'SELECT "table 1".column1 FROM "table 1" '
+                                     'WHERE "table 1".column1 = ? LIMIT 1')
+        self.assertEquals(len(parameters), 1)
+        self.assertTrue(parameters[0] is variable)
+        self.assertEquals(self.cache.get_stats(),
+                          {"statements": 1, "hits": 0, "misses": 1})
+
+    def test_compile_same_shape(self):
+        self.cache.compile(Select(self.column, self.column == Variable(1)))
+        variable = Variable(2)
+        statement, parameters = self.cache.compile(
+            Select(self.column, self.column == variable))
+        self.assertEquals(statement, 'SELECT "table 1".column1 FROM "table 1" '
+                                     'WHERE "table 1".column1 = ?')
+        self.assertEquals(len(parameters), 1)
+        self.assertTrue(parameters[0] is variable)
+        self.assertEquals(self.cache.get_stats(),
+                          {"statements": 1, "hits": 1, "misses": 1})
+
+    def test_compile_parameters_order(self):
+        column = Column(column1)
+        expr = Update({column: Variable(1)},
+                      Column(column2) == Variable(2), table1)
+        self.cache.compile(expr)
+        variable1 = expr.map[column] = Variable(3)
+        variable2 = expr.where.expr2 = Variable(4)
+        statement, parameters = self.cache.compile(expr)
+        self.assertEquals(statement, 'UPDATE "table 1" SET column1=? '
+                                     'WHERE column2 = ?')
+        self.assertEquals(len(parameters), 2)
+        self.assertTrue(parameters[0] is variable1)
+        self.assertTrue(parameters[1] is variable2)
+
+    def test_compile_different_inline_values(self):
+        statement1, parameters = self.cache.compile(
+            Select(self.column, limit=1))
+        statement2, parameters = self.cache.compile(
+            Select(self.column, limit=2))
+        self.assertEquals(statement1,
+                          'SELECT "table 1".column1 FROM "table 1" LIMIT 1')
+        self.assertEquals(statement2,
+                          'SELECT "table 1".column1 FROM "table 1" LIMIT 2')
+        self.assertEquals(self.cache.get_stats()["statements"], 2)
+
+    def test_compile_different_columns(self):
+        statement1, parameters = self.cache.compile(Column(column1, table1))
+        statement2, parameters = self.cache.compile(Column(column2, table1))
+        self.assertEquals(statement1, '"table 1".column1')
+        self.assertEquals(statement2, '"table 1".column2')
+
+    def test_compile_builtin_values(self):
+        self.cache.compile(Func1(1))
+        statement, parameters = self.cache.compile(Func1(2))
+        self.assertEquals(statement, "func1(?)")
+        self.assertVariablesEqual(parameters, [IntVariable(2)])
+        statement, parameters = self.cache.compile(Func1(2))
+        self.assertVariablesEqual(parameters, [IntVariable(2)])
+        self.assertEquals(self.cache.get_stats(),
+                          {"statements": 2, "hits": 1, "misses": 2})
+
+    def test_compile_same_variable_several_times(self):
+        variable = Variable(1)
+        self.cache.compile(Func1(variable, variable))
+        variable1 = Variable(2)
+        variable2 = Variable(3)
+        statement, parameters = self.cache.compile(
+            Func1(variable1, variable2))
+        self.assertEquals(statement, "func1(?, ?)")
+        self.assertTrue(parameters[0] is variable1)
+        self.assertTrue(parameters[1] is variable2)
+        self.assertEquals(self.cache.get_stats()["misses"], 2)
+
+    def test_compile_variable_compiled_by_value(self):
+        class MyVariable(Variable):
+            pass
+
+        my_compile = compile.create_child()
+        @my_compile.when(MyVariable)
+        def compile_my_variable(compile, variable, state):
+            return str(variable.get())
+
+        cache = StatementCache(my_compile)
+        statement, parameters = cache.compile(Func1(MyVariable(1)))
+        self.assertEquals(statement, "func1(1)")
+        statement, parameters = cache.compile(Func1(MyVariable(2)))
+        self.assertEquals(statement, "func1(2)")
+        self.assertEquals(cache.get_stats(),
+                          {"statements": 0, "hits": 0, "misses": 0})
+
+    def test_compile_with_custom_expression(self):
+        class MyExpr(Expr):
+            def __init__(self, name):
+                self.name = name
+
+        my_compile = compile.create_child()
+        @my_compile.when(MyExpr)
+        def compile_my_expr(compile, expr, state):
+            return expr.name
+
+        cache = StatementCache(my_compile)
+        statement, parameters = cache.compile(MyExpr("a"))
+        self.assertEquals(statement, "a")
+        statement, parameters = cache.compile(MyExpr("b"))
+        self.assertEquals(statement, "b")
+
+    def test_size(self):
+        cache = StatementCache(compile, size=2)
+        for i in range(5):
+            cache.compile(Column(column1, "table %d" % i))
+        self.assertEquals(cache.get_stats()["statements"], 3)
+        # The last statement is still cached.
+        cache.compile(Column(column1, "table 4"))
+        self.assertEquals(cache.get_stats()["hits"], 1)
+
+    def test_clear(self):
+        self.cache.compile(self.column)
+        self.cache.clear()
+        self.assertEquals(self.cache.get_stats()["statements"], 0)
+        self.cache.compile(self.column)
+        self.assertEquals(self.cache.get_stats()["misses"], 2)
+
+
 class LazyValueExprTest(TestHelper):
 
     def test_expr_is_lazy_value(self):
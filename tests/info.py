@@ -22,8 +22,8 @@ from weakref import ref
 import gc
 
 from storm.exceptions import ClassInfoError
-from storm.properties import Property
-from storm.variables import Variable
+from storm.properties import Int, Pickle, Property, Unicode
+from storm.variables import LazyValue, Variable
 from storm.expr import Undef, Select, compile
 from storm.info import *
 
@@ -168,6 +168,88 @@ class ClassInfoTest(TestHelper):
         cls_info = ClassInfo(Class)
         self.assertEquals(cls_info.primary_key_pos, (2, 0))
 
+    def test_eager_columns(self):
+        self.assertTrue(self.cls_info.eager_columns is self.cls_info.columns)
+        self.assertEquals(self.cls_info.lazy_columns, ())
+        self.assertEquals(self.cls_info.eager_primary_key_pos, (0,))
+
+    def test_eager_columns_with_lazy_columns(self):
+        class Class(object):
+            __storm_table__ = "table"
+            prop1 = Property("column1", lazy=True)
+            prop2 = Property("column2", primary=True)
+            prop3 = Property("column3", lazy_group=1)
+        cls_info = ClassInfo(Class)
+        self.assertEquals(cls_info.eager_columns, (Class.prop2,))
+        self.assertEquals(cls_info.lazy_columns, (Class.prop1, Class.prop3))
+        self.assertEquals(cls_info.primary_key_pos, (1,))
+        self.assertEquals(cls_info.eager_primary_key_pos, (0,))
+
+    def test_lazy_primary_key(self):
+        class Class(object):
+            __storm_table__ = "table"
+            prop1 = Property("column1", primary=True, lazy=True)
+        self.assertRaises(ClassInfoError, ClassInfo, Class)
+
+    def test_primary_key_types(self):
+        class Class(object):
+            __storm_table__ = "table"
+            __storm_primary__ = "prop1", "prop2"
+            prop1 = Int("column1")
+            prop2 = Unicode("column2")
+        cls_info = ClassInfo(Class)
+        self.assertEquals(cls_info.primary_key_types,
+                          ((int, long), (unicode,)))
+
+    def test_primary_key_types_with_conversion(self):
+        class Class(object):
+            __storm_table__ = "table"
+            prop1 = Property("column1", primary=True)
+        self.assertEquals(ClassInfo(Class).primary_key_types, None)
+
+    def test_primary_key_types_with_validator(self):
+        class Class(object):
+            __storm_table__ = "table"
+            prop1 = Int("column1", primary=True,
+                        validator=lambda obj, attr, value: value)
+        self.assertEquals(ClassInfo(Class).primary_key_types, None)
+
+    def test_get_primary_values(self):
+        class Class(object):
+            __storm_table__ = "table"
+            prop1 = Int("column1", primary=True)
+        cls_info = ClassInfo(Class)
+        self.assertEquals(cls_info.get_primary_values([1]), (1,))
+        self.assertEquals(cls_info.get_primary_values((2L,)), (2L,))
+        self.assertEquals(cls_info.get_primary_values((1.5,)), None)
+        self.assertEquals(cls_info.get_primary_values((None,)), None)
+        self.assertEquals(self.cls_info.get_primary_values((1,)), None)
+
+    def test_not_compact(self):
+        self.assertEquals(self.cls_info.compact, False)
+        self.assertEquals(self.cls_info.deferred_columns, ())
+        self.assertEquals(self.cls_info.deferred_idx, {})
+        self.assertEquals(self.cls_info.immediate_columns,
+                          self.cls_info.columns)
+
+    def test_compact(self):
+        class Class(object):
+            __storm_table__ = "table"
+            __storm_compact__ = True
+            prop1 = Property("column1", primary=True)
+            prop2 = Property("column2")
+            prop3 = Property("column3", lazy=True)
+            prop4 = Pickle("column4")
+            prop5 = Int("column5", default=1)
+            prop6 = Unicode("column6", default_factory=unicode)
+        cls_info = ClassInfo(Class)
+        self.assertEquals(cls_info.compact, True)
+        self.assertEquals(cls_info.deferred_columns, (Class.prop2,))
+        self.assertEquals(cls_info.deferred_idx, {id(Class.prop2): 0})
+        self.assertEquals(cls_info.immediate_columns,
+                          (Class.prop1, Class.prop3, Class.prop4,
+                           Class.prop5, Class.prop6))
+
 
 class ObjectInfoTest(TestHelper):
 
@@ -519,6 +601,79 @@ class ObjectInfoTest(TestHelper):
         self.assertTrue("tainted" in deleted[0])
 
 
+class CompactObjectInfoTest(TestHelper):
+
+    def setUp(self):
+        TestHelper.setUp(self)
+        class Class(object):
+            __storm_table__ = "table"
+            __storm_compact__ = True
+            prop1 = Property("column1", primary=True)
+            prop2 = Property("column2")
+        self.Class = Class
+        self.obj = Class()
+        self.obj_info = get_obj_info(self.obj)
+        self.variables = self.obj_info.variables
+
+    def test_variables(self):
+        self.assertTrue(isinstance(self.variables, CompactVariables))
+        self.assertTrue(self.variables.is_built(self.Class.prop1))
+        self.assertFalse(self.variables.is_built(self.Class.prop2))
+        self.assertTrue(self.Class.prop2 in self.variables)
+        self.assertEquals(len(self.variables), 2)
+        self.assertEquals(list(self.variables),
+                          [self.Class.prop1, self.Class.prop2])
+
+    def test_variable_built_when_used(self):
+        variable = self.variables[self.Class.prop2]
+        self.assertTrue(isinstance(variable, Variable))
+        self.assertTrue(variable.column is self.Class.prop2)
+        self.assertTrue(variable.event is self.obj_info.event)
+        self.assertTrue(self.variables.is_built(self.Class.prop2))
+        self.assertTrue(self.variables[self.Class.prop2] is variable)
+
+    def test_variable_built_when_set(self):
+        self.obj.prop2 = 2
+        self.assertTrue(self.variables.is_built(self.Class.prop2))
+        self.assertEquals(self.variables[self.Class.prop2].get(), 2)
+
+    def test_set_values(self):
+        columns, values = self.variables.set_values(
+            (self.Class.prop1, self.Class.prop2), (1, 2),
+            lambda variable, value: variable.set(value, from_db=True))
+        self.assertEquals(columns, [self.Class.prop1])
+        self.assertEquals(values, [1])
+        self.assertFalse(self.variables.is_built(self.Class.prop2))
+        self.assertTrue(self.variables.is_defined(self.Class.prop2))
+        self.assertEquals(self.variables.get_unbuilt_values(), [2])
+
+        variable = self.variables[self.Class.prop2]
+        self.assertEquals(variable.get(), 2)
+        self.assertFalse(variable.has_changed())
+        self.assertEquals(self.variables.get_unbuilt_values(), [])
+
+    def test_set_values_keep_defined(self):
+        set_variable = lambda variable, value: variable.set(value)
+        self.variables.set_values((self.Class.prop2,), (2,), set_variable)
+        self.variables.set_values((self.Class.prop2,), (3,), set_variable,
+                                  keep_defined=True)
+        self.assertEquals(self.obj.prop2, 2)
+
+    def test_set_lazy(self):
+        lazy_value = LazyValue()
+        self.variables.set_lazy(self.Class.prop2, lazy_value)
+        self.assertFalse(self.variables.is_built(self.Class.prop2))
+        self.assertFalse(self.variables.is_defined(self.Class.prop2))
+        self.assertTrue(
+            self.variables.get_lazy(self.Class.prop2) is lazy_value)
+        self.assertTrue(
+            self.variables[self.Class.prop2].get_lazy() is lazy_value)
+
+    def test_checkpoint_does_not_build_variables(self):
+        self.obj_info.checkpoint()
+        self.assertFalse(self.variables.is_built(self.Class.prop2))
+
+
 class ClassAliasTest(TestHelper):
 
     def setUp(self):
@@ -20,6 +20,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+from array import array
 from cStringIO import StringIO
 import decimal
 import gc
@@ -30,19 +31,21 @@ import weakref
 from storm.references import Reference, ReferenceSet, Proxy
 from storm.database import Result, STATE_DISCONNECTED
 from storm.properties import (
-    Int, Float, RawStr, Unicode, Property, Pickle, UUID)
-from storm.properties import PropertyPublisherMeta, Decimal
+    Bool, Int, Float, RawStr, Unicode, Property, Pickle, UUID)
+from storm.properties import PropertyPublisherMeta, Decimal, LazyGroup
 from storm.variables import PickleVariable
 from storm.expr import (
     Asc, Desc, Select, LeftJoin, SQL, Count, Sum, Avg, And, Or, Eq, Lower)
 from storm.variables import Variable, UnicodeVariable, IntVariable
-from storm.info import get_obj_info, ClassAlias
+from storm.info import get_obj_info, get_cls_info, ClassAlias
 from storm.exceptions import (
-    ClosedError, ConnectionBlockedError, FeatureError, LostObjectError,
-    NoStoreError, NotFlushedError, NotOneError, OrderLoopError, UnorderedError,
-    WrongStoreError, DisconnectionError)
-from storm.cache import Cache
-from storm.store import AutoReload, EmptyResultSet, Store, ResultSet
+    ClosedError, ConnectionBlockedError, DatabaseError, FeatureError,
+    LostObjectError, NoStoreError, NotFlushedError, NotOneError,
+    OrderLoopError, UnorderedError, WrongStoreError, DisconnectionError)
+from storm.cache import Cache, MemoryBoundCache, NegativeCache
+from storm.store import (
+    AutoReload, EmptyResultSet, ReadOnlyRow, Store, ResultSet,
+    fetch_concurrently)
 from storm.tracer import debug
 
 from tests.info import Wrapper
@@ -110,6 +113,21 @@ class FooIndRefSetOrderTitle(Foo):
                         order_by=Bar.title)
 
 
+class CompactFoo(object):
+    __storm_table__ = "foo"
+    __storm_compact__ = True
+    id = Int(primary=True)
+    title = Unicode()
+
+class CompactBar(object):
+    __storm_table__ = "bar"
+    __storm_compact__ = True
+    id = Int(primary=True)
+    title = Unicode()
+    foo_id = Int()
+    foo = Reference(foo_id, CompactFoo.id)
+
+
 class FooValue(object):
     __storm_table__ = "foovalue"
     id = Int(primary=True)
@@ -340,6 +358,245 @@ class StoreTest(object):
         self.store.get(Foo, 10)
         self.store._connection = connection
 
+    def test_wb_get_compiles_primary_key_select_once(self):
+        self.store.get(Foo, 10)
+        cls_info = get_cls_info(Foo)
+        compile = self.store._connection.compile
+        statement = cls_info.primary_key_selects[compile]
+        self.assertIn("foo.id = ?", statement)
+        self.assertIn("LIMIT 1", statement)
+
+        # The statement compiled for the class is used as is.
+        self.addCleanup(cls_info.primary_key_selects.pop, compile)
+        cls_info.primary_key_selects[compile] = (
+            "SELECT foo.id, foo.title FROM foo "
+            "WHERE foo.id = ? AND foo.title = 'Title 20'")
+        foo = self.store.get(Foo, 20)
+        self.assertEquals(foo.title, "Title 20")
+        self.assertEquals(self.store.get(Foo, 30), None)
+
+    def test_get_with_lazy_columns(self):
+        class LazyFoo(object):
+            __storm_table__ = "foo"
+            id = Int(primary=True)
+            title = Unicode(lazy=True)
+
+        foo = self.store.get(LazyFoo, 20)
+        statement = get_cls_info(LazyFoo).primary_key_selects[
+            self.store._connection.compile]
+        self.assertNotIn("title", statement)
+        self.assertEquals(foo.title, "Title 20")
+
+    def test_get_many(self):
+        foos = self.store.get_many(Foo, [30, 40, 10, 30])
+        self.assertEquals([foo and foo.title for foo in foos],
+                          ["Title 10", None, "Title 30", "Title 10"])
+        self.assertIdentical(foos[0], foos[3])
+        self.assertIdentical(self.store.get(Foo, 10), foos[2])
+
+    def test_get_many_empty(self):
+        self.assertEquals(self.store.get_many(Foo, []), [])
+
+    def test_get_many_uses_a_single_query(self):
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        self.store.get_many(Foo, [10, 20, 30])
+        self.assertEquals(stream.getvalue().count("SELECT"), 1)
+
+    def test_get_many_alive_objects_dont_need_the_database(self):
+        foo = self.store.get(Foo, 10)
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        self.assertEquals(self.store.get_many(Foo, [10]), [foo])
+        self.assertEquals(stream.getvalue(), "")
+
+    def test_get_many_with_compound_primary_key(self):
+        links = self.store.get_many(Link, [(10, 100), (10, 400), (20, 200)])
+        self.assertEquals([link and (link.foo_id, link.bar_id)
+                           for link in links],
+                          [(10, 100), None, (20, 200)])
+
+    def test_get_many_respects_max_parameters(self):
+        self.store._connection.max_parameters = 2
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        foos = self.store.get_many(Foo, [10, 20, 30])
+        self.assertEquals(stream.getvalue().count("SELECT"), 2)
+        self.assertEquals([foo.id for foo in foos], [10, 20, 30])
+
+    def test_get_many_invalidated_object_removed_from_database(self):
+        foo = self.store.get(Foo, 10)
+        self.store.invalidate(foo)
+        self.store.execute("DELETE FROM foo WHERE id = 10")
+        self.assertEquals(self.store.get_many(Foo, [10, 20])[0], None)
+
+    def test_get_many_flushes(self):
+        foo = Foo()
+        foo.id = 40
+        foo.title = u"Title 40"
+        self.store.add(foo)
+        self.assertEquals(self.store.get_many(Foo, [40]), [foo])
+
+    def create_store_with_negative_cache(self):
+        store = Store(self.database, negative_cache=NegativeCache())
+        self.stores.append(store)
+        return store
+
+    def test_get_negative_cache(self):
+        store = self.create_store_with_negative_cache()
+        self.assertEquals(store.get(Foo, 40), None)
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        self.assertEquals(store.get(Foo, 40), None)
+        self.assertEquals(store.get_many(Foo, [40]), [None])
+        self.assertEquals(stream.getvalue(), "")
+        self.assertEquals(store.get_cache_stats()["negative_hits"], 2)
+
+    def test_get_many_negative_cache(self):
+        store = self.create_store_with_negative_cache()
+        store.get_many(Foo, [10, 40])
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        self.assertEquals(store.get(Foo, 40), None)
+        self.assertEquals(stream.getvalue(), "")
+
+    def test_negative_cache_forgets_added_objects(self):
+        store = self.create_store_with_negative_cache()
+        self.assertEquals(store.get(Foo, 40), None)
+        foo = Foo()
+        foo.id = 40
+        store.add(foo)
+        self.assertIdentical(store.get(Foo, 40), foo)
+
+    def test_negative_cache_forgets_on_invalidate(self):
+        store = self.create_store_with_negative_cache()
+        self.assertEquals(store.get(Foo, 40), None)
+        store.execute("INSERT INTO foo (id, title) VALUES (40, 'Title 40')")
+        store.invalidate()
+        self.assertEquals(store.get(Foo, 40).title, "Title 40")
+
+    def test_negative_cache_forgets_on_execute(self):
+        store = self.create_store_with_negative_cache()
+        self.assertEquals(store.get(Foo, 40), None)
+        store.execute("INSERT INTO foo (id, title) VALUES (40, 'Title 40')")
+        self.assertEquals(store.get(Foo, 40).title, "Title 40")
+
+    def test_negative_cache_forgets_on_invalidate_object_of_class(self):
+        store = self.create_store_with_negative_cache()
+        self.assertEquals(store.get(Foo, 40), None)
+        store.execute("INSERT INTO foo (id, title) VALUES (40, 'Title 40')")
+        store.invalidate(store.get(Foo, 10))
+        self.assertEquals(store.get(Foo, 40).title, "Title 40")
+
+    def test_negative_cache_forgets_on_rollback(self):
+        store = self.create_store_with_negative_cache()
+        self.assertEquals(store.get(Foo, 40), None)
+        store.rollback()
+        self.assertEquals(store._negative_cache.get_cached(), [])
+
+    def test_negative_cache_forgets_on_result_set_set(self):
+        store = self.create_store_with_negative_cache()
+        self.assertEquals(store.get(Foo, 40), None)
+        store.find(Foo, id=10).set(id=40)
+        self.assertEquals(store.get(Foo, 40).title, "Title 30")
+
+    def test_negative_cache_forgets_on_result_set_remove(self):
+        store = self.create_store_with_negative_cache()
+        self.assertEquals(store.get(Foo, 40), None)
+        store.find(Foo, id=10).remove()
+        self.assertEquals(store._negative_cache.get_cached(), [])
+
+    def test_get_cache_stats(self):
+        stats = self.store.get_cache_stats()
+        self.assertEquals(stats["get_hits"], 0)
+        self.assertEquals(stats["get_misses"], 0)
+
+        foo = self.store.get(Foo, 10)
+        self.store.get(Foo, 10)
+        self.store.get(Foo, 40)
+        stats = self.store.get_cache_stats()
+        self.assertEquals(stats["get_hits"], 1)
+        self.assertEquals(stats["get_misses"], 2)
+
+    def test_get_cache_stats_alive_hits(self):
+        foo = self.store.get(Foo, 10)
+        list(self.store.find(Foo))
+        self.assertEquals(self.store.get_cache_stats()["alive_hits"], 1)
+
+    def test_get_cache_stats_invalidations(self):
+        foo = self.store.get(Foo, 10)
+        self.store.invalidate(foo)
+        self.assertEquals(self.store.get_cache_stats()["invalidations"], 1)
+
+        # The invalidated object needs to be checked in the database.
+        self.store.get(Foo, 10)
+        self.assertEquals(self.store.get_cache_stats()["get_misses"], 2)
+
+    def test_get_cache_stats_includes_cache_stats(self):
+        self.get_cache(self.store).set_size(1)
+        foo = self.store.get(Foo, 10)
+        bar = self.store.get(Foo, 20)
+        self.assertEquals(self.store.get_cache_stats()["evictions"], 1)
+
+    def test_reset_cache_stats(self):
+        self.get_cache(self.store).set_size(1)
+        foo = self.store.get(Foo, 10)
+        bar = self.store.get(Foo, 20)
+        self.store.get(Foo, 20)
+        self.store.commit()
+        self.store.reset_cache_stats()
+        stats = self.store.get_cache_stats()
+        self.assertEquals(stats["get_hits"], 0)
+        self.assertEquals(stats["get_misses"], 0)
+        self.assertEquals(stats["invalidations"], 0)
+        self.assertEquals(stats["evictions"], 0)
+
+    def test_memory_bound_cache_counts_lazy_values(self):
+        class LazyFoo(object):
+            __storm_table__ = "foo"
+            id = Int(primary=True)
+            title = Unicode(lazy=True)
+        self.store.execute("UPDATE foo SET title=? WHERE id=10",
+                           (u"x" * 100000,))
+        self.store.commit()
+        cache = MemoryBoundCache(1000000)
+        store = Store(self.database, cache)
+        foo = store.get(LazyFoo, 10)
+        self.assertTrue(cache.get_stats()["size"] < 100000)
+        self.assertEquals(len(foo.title), 100000)
+        self.assertTrue(cache.get_stats()["size"] > 100000)
+
+    def test_cache_without_optional_methods(self):
+        class MinimalCache(object):
+            def __init__(self):
+                self.cached = []
+            def add(self, obj_info):
+                self.cached.append(obj_info)
+            def remove(self, obj_info):
+                return False
+            def clear(self):
+                del self.cached[:]
+            def set_size(self, size):
+                pass
+            def get_cached(self):
+                return self.cached
+        store = Store(self.database, MinimalCache())
+        foo = store.get(Foo, 10)
+        foo.title = u"Title 40"
+        store.flush()
+        self.assertEquals(store.get(Foo, 10).title, u"Title 40")
+
     def test_cache_cleanup(self):
         # Disable the cache, which holds strong references.
         self.get_cache(self.store).set_size(0)
@@ -600,6 +857,36 @@ class StoreTest(object):
                           (30, "Title 10"),
                          ])
 
+    def capture_results(self):
+        results = []
+        execute = self.store._connection.execute
+        def capturing_execute(*args, **kwargs):
+            result = execute(*args, **kwargs)
+            results.append(result)
+            return result
+        self.store._connection.execute = capturing_execute
+        self.addCleanup(delattr, self.store._connection, "execute")
+        return results
+
+    def test_find_iter_with_fetch_size(self):
+        results = self.capture_results()
+        result = self.store.find(Foo).order_by(Foo.id).config(fetch_size=2)
+        self.assertEquals([foo.id for foo in result], [10, 20, 30])
+        self.assertEquals(results[0]._raw_cursor.arraysize, 2)
+
+    def test_find_values_with_fetch_size(self):
+        results = self.capture_results()
+        result = self.store.find(Foo).order_by(Foo.id).config(fetch_size=1)
+        self.assertEquals(list(result.values(Foo.id)), [10, 20, 30])
+        self.assertEquals(results[0]._raw_cursor.arraysize, 1)
+
+    def test_find_iter_with_connection_fetch_size(self):
+        results = self.capture_results()
+        self.store._connection.fetch_size = 2
+        self.assertEquals(sorted(foo.id for foo in self.store.find(Foo)),
+                          [10, 20, 30])
+        self.assertEquals(results[0]._raw_cursor.arraysize, 2)
+
     def test_find_from_cache(self):
         foo = self.store.get(Foo, 10)
         self.assertTrue(self.store.find(Foo, id=10).one() is foo)
@@ -1144,6 +1431,65 @@ class StoreTest(object):
         values = self.store.find(Foo).order_by(Foo.id)[1:2].values(Foo.id)
         self.assertEquals(list(values), [20])
 
+    def test_find_values_columnar(self):
+        result = self.store.find(Foo).order_by(Foo.id)
+        ids, titles = result.values_columnar(Foo.id, Foo.title)
+        self.assertEquals(ids, [10, 20, 30])
+        self.assertEquals(titles, ["Title 30", "Title 20", "Title 10"])
+        self.assertEquals([type(title) for title in titles],
+                          [unicode, unicode, unicode])
+
+    def test_find_values_columnar_in_batches(self):
+        result = self.store.find(Bar).order_by(Bar.id).config(fetch_size=2)
+        self.assertEquals(result.values_columnar(Bar.foo_id, Bar.id),
+                          [[10, 20, 30], [100, 200, 300]])
+
+    def test_find_values_columnar_converts_values(self):
+        class FloatFoo(object):
+            __storm_table__ = "foo"
+            id = Float(primary=True)
+            flag = Bool(name="id")
+        result = self.store.find(FloatFoo).order_by(FloatFoo.id)
+        ids, flags = result.values_columnar(FloatFoo.id, FloatFoo.flag)
+        self.assertEquals(ids, [10.0, 20.0, 30.0])
+        self.assertEquals([type(id) for id in ids], [float, float, float])
+        self.assertEquals(flags, [True, True, True])
+
+    def test_find_values_columnar_with_arrays(self):
+        class FloatFoo(object):
+            __storm_table__ = "foo"
+            id = Float(primary=True)
+            int_id = Int(name="id")
+            title = Unicode()
+        result = self.store.find(FloatFoo).order_by(FloatFoo.id)
+        result.config(fetch_size=2)
+        float_ids, int_ids, titles = result.values_columnar(
+            FloatFoo.id, FloatFoo.int_id, FloatFoo.title, arrays=True)
+        self.assertEquals(float_ids, array("d", [10, 20, 30]))
+        self.assertEquals(int_ids, array("l", [10, 20, 30]))
+        self.assertEquals(titles, ["Title 30", "Title 20", "Title 10"])
+
+    def test_find_values_columnar_with_arrays_and_nulls(self):
+        self.store.execute("INSERT INTO bar VALUES (400, NULL, 'Title 0')")
+        result = self.store.find(Bar).order_by(Bar.id).config(fetch_size=2)
+        [foo_ids] = result.values_columnar(Bar.foo_id, arrays=True)
+        self.assertEquals(foo_ids, [10, 20, 30, None])
+
+    def test_find_values_columnar_with_no_arguments(self):
+        result = self.store.find(Foo)
+        self.assertRaises(FeatureError, result.values_columnar)
+
+    def test_find_values_columnar_with_unknown_argument(self):
+        result = self.store.find(Foo)
+        self.assertRaises(TypeError, result.values_columnar, Foo.id,
+                          array=True)
+
+    def test_find_values_columnar_with_set_expression(self):
+        result1 = self.store.find(Foo, Foo.id == 10)
+        result2 = self.store.find(Foo, Foo.id == 20)
+        result3 = result1.union(result2)
+        self.assertRaises(FeatureError, result3.values_columnar, Foo.id)
+
     def test_find_values_with_set_expression(self):
         """
         A L{FeatureError} is raised if L{ResultSet.values} is used with a
@@ -3648,6 +3994,658 @@ class StoreTest(object):
         bar.title = u"Title 100"
         self.store.add(bar)
 
+    def test_prefetch_reference(self):
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        bars = list(self.store.find(Bar).order_by(Bar.id).prefetch(Bar.foo))
+        self.assertEquals(stream.getvalue().count("SELECT"), 2)
+        self.assertEquals([bar.foo.title for bar in bars],
+                          ["Title 30", "Title 20", "Title 10"])
+        self.assertEquals(stream.getvalue().count("SELECT"), 2)
+
+    def test_prefetch_reference_with_null_key(self):
+        self.store.execute("UPDATE bar SET foo_id = NULL WHERE id = 100")
+        bars = list(self.store.find(Bar).order_by(Bar.id).prefetch(Bar.foo))
+        self.assertEquals(bars[0].foo, None)
+        self.assertEquals(bars[1].foo.id, 20)
+
+    def test_prefetch_reference_on_remote(self):
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        foos = list(self.store.find(FooRef).order_by(FooRef.id)
+                                           .prefetch(FooRef.bar))
+        self.assertEquals([foo.bar.title for foo in foos],
+                          ["Title 300", "Title 200", "Title 100"])
+        self.assertEquals(stream.getvalue().count("SELECT"), 2)
+
+    def test_prefetch_reference_set(self):
+        self.store.execute("INSERT INTO bar VALUES (400, 10, 'Title 400')")
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        result = self.store.find(FooRefSetOrderID).order_by(
+            FooRefSetOrderID.id)
+        foos = list(result.prefetch(FooRefSetOrderID.bars))
+        self.assertEquals([[bar.id for bar in foo.bars] for foo in foos],
+                          [[100, 400], [200], [300]])
+        self.assertEquals(stream.getvalue().count("SELECT"), 2)
+
+    def test_prefetch_indirect_reference_set(self):
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        result = self.store.find(FooIndRefSetOrderID).order_by(
+            FooIndRefSetOrderID.id)
+        foos = list(result.prefetch(FooIndRefSetOrderID.bars))
+        self.assertEquals([[bar.id for bar in foo.bars] for foo in foos],
+                          [[100, 200, 300], [100, 200], [300]])
+        self.assertEquals(stream.getvalue().count("SELECT"), 2)
+
+    def test_prefetch_reference_set_default_order(self):
+        class MyBar(Bar):
+            __storm_order__ = "-title"
+
+        class MyFoo(Foo):
+            bars = ReferenceSet(Foo.id, MyBar.foo_id)
+
+        self.store.execute("INSERT INTO bar VALUES (400, 10, 'Title 400')")
+        result = self.store.find(MyFoo).order_by(MyFoo.id)
+        expected = [[bar.id for bar in foo.bars] for foo in result]
+        self.assertEquals(expected, [[400, 100], [200], [300]])
+
+        self.store.invalidate()
+        foos = list(result.prefetch(MyFoo.bars))
+        self.assertEquals([[bar.id for bar in foo.bars] for foo in foos],
+                          expected)
+
+    def test_prefetch_reference_set_released_on_invalidate(self):
+        self.store.execute("INSERT INTO bar VALUES (400, 10, 'Title 400')")
+        result = self.store.find(FooRefSetOrderID).order_by(
+            FooRefSetOrderID.id)
+        foos = list(result.prefetch(FooRefSetOrderID.bars))
+        bar_ref = weakref.ref(self.store.get(Bar, 400))
+        self.store.invalidate()
+        gc.collect()
+        self.assertEquals(bar_ref(), None)
+        self.assertEquals([bar.id for bar in foos[0].bars], [100, 400])
+
+    def test_prefetch_reference_set_after_changes(self):
+        result = self.store.find(FooRefSetOrderID).order_by(
+            FooRefSetOrderID.id)
+        foos = list(result.prefetch(FooRefSetOrderID.bars))
+        bar = self.store.get(Bar, 200)
+        bar.foo_id = 10
+        self.assertEquals([bar.id for bar in foos[0].bars], [100, 200])
+        self.assertEquals([bar.id for bar in foos[1].bars], [])
+
+    def test_prefetch_reference_set_after_commit(self):
+        result = self.store.find(FooRefSetOrderID).order_by(
+            FooRefSetOrderID.id)
+        foos = list(result.prefetch(FooRefSetOrderID.bars))
+        self.store.commit()
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        self.assertEquals([bar.id for bar in foos[0].bars], [100])
+        self.assertEquals(stream.getvalue().count("SELECT"), 1)
+
+    def test_prefetch_several_references(self):
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        result = self.store.find(SelfRef).order_by(SelfRef.id)
+        result.prefetch(SelfRef.selfref, SelfRef.selfref_on_remote)
+        selfrefs = list(result)
+        self.assertEquals([selfref.selfref and selfref.selfref.id
+                           for selfref in selfrefs], [None, None, 15])
+        self.assertEquals(selfrefs[0].selfref_on_remote.id, 35)
+        # The remote objects of the first reference were all alive.
+        self.assertEquals(stream.getvalue().count("SELECT"), 2)
+
+    def test_prefetch_in_batches(self):
+        import storm.store
+        self.addCleanup(setattr, storm.store, "PREFETCH_BATCH_SIZE",
+                        storm.store.PREFETCH_BATCH_SIZE)
+        storm.store.PREFETCH_BATCH_SIZE = 2
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        bars = list(self.store.find(Bar).order_by(Bar.id).prefetch(Bar.foo))
+        self.assertEquals(stream.getvalue().count("SELECT"), 3)
+        self.assertEquals([bar.foo.id for bar in bars], [10, 20, 30])
+
+    def test_prefetch_unsupported(self):
+        result = self.store.find((Foo, Bar))
+        self.assertRaises(FeatureError, result.prefetch, Bar.foo)
+        result = self.store.find(Foo)
+        self.assertRaises(FeatureError, result.prefetch, Foo.title)
+
+    def test_stream(self):
+        result = self.store.find(Foo).order_by(Foo.id)
+        self.assertEquals([(foo.id, foo.title) for foo in result.stream()],
+                          [(10, "Title 30"),
+                           (20, "Title 20"),
+                           (30, "Title 10")])
+
+    def test_stream_batch_size(self):
+        result = self.store.find(Foo).order_by(Foo.id).stream(batch_size=2)
+        self.assertEquals([foo.id for foo in result], [10, 20, 30])
+
+    def test_stream_tuples(self):
+        result = self.store.find((Foo, Bar), Bar.foo_id == Foo.id)
+        result.order_by(Foo.id)
+        self.assertEquals([(foo.id, bar.id)
+                           for foo, bar in result.stream(batch_size=1)],
+                          [(10, 100), (20, 200), (30, 300)])
+
+    def test_stream_with_prefetch(self):
+        result = self.store.find(Bar).order_by(Bar.id).prefetch(Bar.foo)
+        bars = list(result.stream())
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.assertEquals([bar.foo.id for bar in bars], [10, 20, 30])
+        self.assertEquals(stream.getvalue(), "")
+
+    def test_readonly(self):
+        result = self.store.find(Foo).order_by(Foo.id).readonly()
+        rows = list(result)
+        self.assertEquals([(row.id, row.title) for row in rows],
+                          [(10, "Title 30"), (20, "Title 20"),
+                           (30, "Title 10")])
+        self.assertEquals(rows[0], (10, "Title 30"))
+        self.assertTrue(isinstance(rows[0], ReadOnlyRow))
+        self.assertEquals(rows[0]._cls, Foo)
+        self.assertEquals(rows[0]._fields, ("id", "title"))
+        self.assertEquals(type(rows[0].title), unicode)
+        self.assertEquals(repr(rows[0]), "<Foo row id=10, title=u'Title 30'>")
+
+    def test_readonly_rows_are_immutable(self):
+        row = self.store.find(Foo, id=10).readonly().one()
+        self.assertRaises(AttributeError, setattr, row, "title", u"Title 40")
+        self.assertRaises(AttributeError, setattr, row, "other", 1)
+
+    def test_readonly_with_reserved_attribute_names(self):
+        class MyFoo(object):
+            __storm_table__ = "foo"
+            id = Int(primary=True)
+            count = Unicode("title")
+
+        result = self.store.find(MyFoo).readonly()
+        try:
+            result.any()
+        except FeatureError, error:
+            self.assertEquals(str(error), "Read-only rows of MyFoo can't "
+                                          "have attributes named count")
+        else:
+            self.fail("FeatureError not raised")
+
+    def test_readonly_rows_are_not_tracked(self):
+        row = self.store.find(Foo, id=10).readonly().one()
+        self.assertEquals(self.store._alive.keys(), [])
+        self.assertEquals(self.store._cache.get_cached(), [])
+        foo = self.store.get(Foo, 10)
+        foo.title = u"Title 40"
+        self.assertEquals(row.title, "Title 30")
+        self.assertEquals(
+            self.store.find(Foo, id=10).readonly().one().title, "Title 40")
+
+    def test_readonly_converts_values(self):
+        class FloatFoo(object):
+            __storm_table__ = "foo"
+            id = Float(primary=True)
+            flag = Bool(name="id")
+        row = self.store.find(FloatFoo, FloatFoo.id == 10).readonly().one()
+        self.assertEquals(row.id, 10.0)
+        self.assertEquals(type(row.id), float)
+        self.assertEquals(row.flag, True)
+
+    def test_readonly_tuples_and_expressions(self):
+        result = self.store.find((Foo, Bar, Bar.title),
+                                 Bar.foo_id == Foo.id)
+        result = result.order_by(Foo.id).readonly()
+        foo, bar, title = result.first()
+        self.assertEquals((foo.id, foo.title), (10, "Title 30"))
+        self.assertEquals((bar.id, bar.foo_id), (100, 10))
+        self.assertEquals(title, "Title 300")
+        self.assertEquals(type(title), unicode)
+
+    def test_readonly_with_left_join(self):
+        class Bar(object):
+            __storm_table__ = "bar"
+            id = Int(primary=True, allow_none=False)
+            title = Unicode(allow_none=False)
+            foo_id = Int(allow_none=False)
+
+        self.store.remove(self.store.get(Bar, 200))
+
+        tables = self.store.using(Foo, LeftJoin(Bar, Bar.foo_id == Foo.id))
+        result = tables.find((Foo, Bar)).order_by(Foo.id).readonly()
+        self.assertEquals([(foo.id, bar and bar.id) for foo, bar in result],
+                          [(10, 100), (20, None), (30, 300)])
+
+    def test_readonly_with_lazy_columns(self):
+        class LazyBar(object):
+            __storm_table__ = "bar"
+            id = Int(primary=True)
+            foo_id = Int()
+            title = Unicode(lazy=True)
+        row = self.store.find(LazyBar, id=100).readonly().one()
+        self.assertEquals(row, (10, 100))
+        self.assertEquals(row._fields, ("foo_id", "id"))
+        self.assertRaises(AttributeError, getattr, row, "title")
+
+    def test_readonly_with_prefetch(self):
+        result = self.store.find(Bar).prefetch(Bar.foo)
+        self.assertRaises(FeatureError, result.readonly)
+        result = self.store.find(Bar).readonly()
+        self.assertRaises(FeatureError, result.prefetch, Bar.foo)
+
+    def test_compact(self):
+        foo = self.store.get(CompactFoo, 10)
+        variables = get_obj_info(foo).variables
+        self.assertFalse(variables.is_built(CompactFoo.title))
+        self.assertEquals(foo.id, 10)
+        self.assertEquals(foo.title, "Title 30")
+        self.assertTrue(variables.is_built(CompactFoo.title))
+        self.assertEquals(type(foo.title), unicode)
+
+    def test_compact_find(self):
+        result = self.store.find(CompactFoo).order_by(CompactFoo.id)
+        self.assertEquals([(foo.id, foo.title) for foo in result],
+                          [(10, "Title 30"), (20, "Title 20"),
+                           (30, "Title 10")])
+
+    def test_compact_flush_unchanged(self):
+        foo = self.store.get(CompactFoo, 10)
+        self.store.flush()
+        variables = get_obj_info(foo).variables
+        self.assertFalse(variables.is_built(CompactFoo.title))
+        foo.title
+        self.assertEquals(self.store._dirty, {})
+
+    def test_compact_change(self):
+        foo = self.store.get(CompactFoo, 10)
+        foo.title = u"Title 40"
+        self.store.flush()
+        self.assertEquals(self.get_items(), [
+            (10, "Title 40"),
+            (20, "Title 20"),
+            (30, "Title 10"),
+            ])
+
+    def test_compact_add(self):
+        foo = CompactFoo()
+        foo.id = 40
+        foo.title = u"Title 40"
+        self.store.add(foo)
+        self.store.flush()
+        self.assertEquals(self.get_items()[-1], (40, "Title 40"))
+
+    def test_compact_add_without_values(self):
+        foo = CompactFoo()
+        foo.id = 40
+        self.store.add(foo)
+        self.store.flush()
+        self.assertEquals(foo.title, "Default Title")
+
+    def test_compact_add_with_defaults(self):
+        class MyCompactFoo(object):
+            __storm_table__ = "foo"
+            __storm_compact__ = True
+            id = Int(primary=True, default_factory=lambda: 40)
+            title = Unicode(default=u"Title 40")
+        foo = self.store.add(MyCompactFoo())
+        self.store.flush()
+        self.assertEquals(self.get_items()[-1], (40, "Title 40"))
+        self.store.commit()
+        self.assertEquals(foo.title, "Title 40")
+
+    def test_compact_autoreload_after_commit(self):
+        foo = self.store.get(CompactFoo, 10)
+        self.store.commit()
+        variables = get_obj_info(foo).variables
+        self.assertFalse(variables.is_built(CompactFoo.title))
+        self.store.execute("UPDATE foo SET title='Title 40' WHERE id=10")
+        self.assertEquals(foo.title, "Title 40")
+
+    def test_compact_invalidate(self):
+        foo = self.store.get(CompactFoo, 10)
+        self.store.invalidate(foo)
+        self.store.execute("UPDATE foo SET title='Title 40' WHERE id=10")
+        self.assertEquals(foo.title, "Title 40")
+
+    def test_compact_reload(self):
+        foo = self.store.get(CompactFoo, 10)
+        self.store.execute("UPDATE foo SET title='Title 40' WHERE id=10")
+        self.store.reload(foo)
+        self.assertEquals(foo.title, "Title 40")
+
+    def test_compact_alive_hit_keeps_values(self):
+        foo = self.store.get(CompactFoo, 10)
+        foo.title = u"Title 40"
+        self.store.execute("UPDATE foo SET title='Title 50' WHERE id=10")
+        self.assertTrue(self.store.find(CompactFoo, id=10).one() is foo)
+        self.assertEquals(foo.title, "Title 40")
+
+    def test_compact_reference(self):
+        bar = self.store.get(CompactBar, 100)
+        self.assertEquals(bar.foo.title, "Title 30")
+        bar.foo = self.store.get(CompactFoo, 20)
+        self.store.flush()
+        self.assertEquals(bar.foo_id, 20)
+
+    def test_get_changed_columns(self):
+        bar = self.store.get(Bar, 100)
+        self.assertEquals(self.store.get_changed_columns(bar), set())
+        bar.title = u"Title 400"
+        self.assertEquals(self.store.get_changed_columns(bar),
+                          set([Bar.title]))
+        bar.foo_id = 20
+        self.assertEquals(self.store.get_changed_columns(bar),
+                          set([Bar.title, Bar.foo_id]))
+        self.store.flush()
+        self.assertEquals(self.store.get_changed_columns(bar), set())
+
+    def test_get_changed_columns_value_restored(self):
+        foo = self.store.get(Foo, 10)
+        foo.title = u"Title 40"
+        foo.title = u"Title 30"
+        self.assertEquals(self.store.get_changed_columns(foo), set())
+
+    def test_get_changed_columns_pending_add(self):
+        foo = Foo()
+        foo.title = u"Title 40"
+        self.store.add(foo)
+        self.assertEquals(self.store.get_changed_columns(foo),
+                          set([Foo.title]))
+
+    def test_get_changed_columns_with_expression(self):
+        foo = self.store.get(Foo, 10)
+        foo.title = SQL("'Title 40'")
+        self.assertEquals(self.store.get_changed_columns(foo),
+                          set([Foo.title]))
+
+    def test_get_changed_columns_from_hook(self):
+        changed = []
+        class MyFoo(Foo):
+            def __storm_pre_flush__(self):
+                changed.append(Store.of(self).get_changed_columns(self))
+        foo = self.store.get(MyFoo, 10)
+        foo.title = u"Title 40"
+        self.store.flush()
+        self.assertEquals(changed, [set([MyFoo.title])])
+
+    def test_get_changed_columns_wrong_store(self):
+        foo = Foo()
+        self.assertRaises(WrongStoreError,
+                          self.store.get_changed_columns, foo)
+
+    def test_wb_changed_columns_cleared_on_reload(self):
+        foo = self.store.get(Foo, 10)
+        foo.title = u"Title 40"
+        self.assertEquals(get_obj_info(foo)["changed_columns"],
+                          set([Foo.title]))
+        self.store.reload(foo)
+        self.assertFalse("changed_columns" in get_obj_info(foo))
+        self.assertEquals(self.store.get_changed_columns(foo), set())
+
+    def test_get_with_long_key(self):
+        foo = self.store.get(Foo, 10)
+        self.assertTrue(self.store.get(Foo, 10L) is foo)
+
+    def test_get_with_converted_key(self):
+        foo = self.store.get(Foo, 10)
+        self.assertTrue(self.store.get(Foo, 10.0) is foo)
+        self.assertTrue(self.store.get(Foo, decimal.Decimal("10")) is foo)
+
+    def test_get_many_with_converted_key(self):
+        foo = self.store.get(Foo, 10)
+        self.assertEquals(self.store.get_many(Foo, [10.0, 20L]),
+                          [foo, self.store.get(Foo, 20)])
+
+    def test_wb_primary_values_kept(self):
+        foo = self.store.get(Foo, 10)
+        obj_info = get_obj_info(foo)
+        self.assertEquals(obj_info["primary_values"], (10,))
+        foo.id = 40
+        self.store.flush()
+        self.assertEquals(obj_info["primary_values"], (40,))
+        self.assertTrue(self.store.get(Foo, 40) is foo)
+        self.store.remove(foo)
+        self.store.flush()
+        self.assertFalse("primary_values" in obj_info)
+
+    def test_fetch_concurrently(self):
+        foos, bars = fetch_concurrently(
+            self.store.find(Foo).order_by(Foo.id),
+            self.store.find(Bar, Bar.id > 100).order_by(Bar.id))
+        self.assertEquals([(foo.id, foo.title) for foo in foos],
+                          [(10, "Title 30"), (20, "Title 20"),
+                           (30, "Title 10")])
+        self.assertEquals([bar.id for bar in bars], [200, 300])
+        self.assertTrue(foos[0] is self.store.get(Foo, 10))
+        self.assertTrue(bars[0] is self.store.get(Bar, 200))
+
+    def test_fetch_concurrently_from_several_stores(self):
+        store = self.create_store()
+        foos, bars = fetch_concurrently(self.store.find(Foo, id=10),
+                                        store.find(Bar, id=100))
+        self.assertTrue(Store.of(foos[0]) is self.store)
+        self.assertTrue(Store.of(bars[0]) is store)
+
+    def test_fetch_concurrently_expressions_and_readonly(self):
+        titles, rows = fetch_concurrently(
+            self.store.find(Foo.title).order_by(Foo.id),
+            self.store.find(Foo, id=20).readonly())
+        self.assertEquals(titles, ["Title 30", "Title 20", "Title 10"])
+        self.assertEquals(rows, [(20, "Title 20")])
+        self.assertTrue(isinstance(rows[0], ReadOnlyRow))
+
+    def test_fetch_concurrently_with_prefetch(self):
+        bars, = fetch_concurrently(
+            self.store.find(Bar).order_by(Bar.id).prefetch(Bar.foo))
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+        self.assertEquals([bar.foo.id for bar in bars], [10, 20, 30])
+        self.assertEquals(stream.getvalue(), "")
+
+    def test_fetch_concurrently_with_empty_result_set(self):
+        self.assertEquals(
+            fetch_concurrently(self.store.find(Foo).config(limit=1),
+                               EmptyResultSet()),
+            [[self.store.get(Foo, 10)], []])
+
+    def test_fetch_concurrently_error(self):
+        class Missing(object):
+            __storm_table__ = "missing"
+            id = Int(primary=True)
+        self.assertRaises(DatabaseError, fetch_concurrently,
+                          self.store.find(Foo), self.store.find(Missing))
+
+    def test_fetch_concurrently_sees_uncommitted_changes(self):
+        foo = self.store.get(Foo, 10)
+        foo.title = u"Title 40"
+        self.store.flush()
+        new_foo = Foo()
+        new_foo.id = 40
+        new_foo.title = u"Title 40"
+        self.store.add(new_foo)
+        store = self.create_store()
+        foos, bars = fetch_concurrently(
+            self.store.find(Foo, title=u"Title 40").order_by(Foo.id),
+            store.find(Bar, id=100))
+        self.assertEquals(foos, [foo, new_foo])
+        self.assertEquals([bar.id for bar in bars], [100])
+
+    def test_fetch_concurrently_max_workers(self):
+        import storm.store
+        real_threading = storm.store.threading
+        targets = []
+        class Threading(object):
+            def Thread(self, target):
+                targets.append(target)
+                return real_threading.Thread(target=target)
+        self.addCleanup(setattr, storm.store, "threading", real_threading)
+        storm.store.threading = Threading()
+        results = fetch_concurrently(
+            max_workers=2,
+            *[self.store.find(Foo, id=id) for id in (10, 20, 30)])
+        self.assertEquals(len(targets), 2)
+        self.assertEquals([[foo.id for foo in foos] for foos in results],
+                          [[10], [20], [30]])
+
+    def test_fetch_concurrently_invalid_arguments(self):
+        result = self.store.find(Foo)
+        self.assertRaises(ValueError, fetch_concurrently, result,
+                          max_workers=0)
+        self.assertRaises(TypeError, fetch_concurrently, result,
+                          workers=2)
+
+    def test_fetch_concurrently_without_result_sets(self):
+        self.assertEquals(fetch_concurrently(), [])
+
+    def test_stream_invalid_batch_size(self):
+        result = self.store.find(Foo)
+        self.assertRaises(ValueError, result.stream, 0)
+
+    def test_lazy_columns_not_loaded(self):
+        class LazyBar(object):
+            __storm_table__ = "bar"
+            id = Int(primary=True)
+            foo_id = Int()
+            title = Unicode(lazy=True)
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        bar = self.store.get(LazyBar, 100)
+        bars = list(self.store.find(LazyBar, LazyBar.id != 100))
+        self.assertNotIn("title", stream.getvalue())
+        self.assertEquals(stream.getvalue().count("SELECT"), 2)
+
+        self.assertEquals(bar.title, "Title 300")
+        self.assertEquals(sorted(bar.title for bar in bars),
+                          ["Title 100", "Title 200"])
+        self.assertEquals(stream.getvalue().count("SELECT"), 5)
+
+        # Once loaded, the value is kept.
+        self.assertEquals(bar.title, "Title 300")
+        self.assertEquals(stream.getvalue().count("SELECT"), 5)
+
+    def test_lazy_columns_with_lazy_group(self):
+        lazy_group = LazyGroup()
+
+        class LazyBar(object):
+            __storm_table__ = "bar"
+            id = Int(primary=True)
+            foo_id = Int(lazy_group=lazy_group)
+            title = Unicode(lazy_group=lazy_group)
+
+        bar = self.store.get(LazyBar, 100)
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        self.assertEquals(bar.title, "Title 300")
+        self.assertEquals(bar.foo_id, 10)
+        self.assertEquals(stream.getvalue().count("SELECT"), 1)
+
+    def test_lazy_columns_with_separate_lazy_groups(self):
+        class LazyBar(object):
+            __storm_table__ = "bar"
+            id = Int(primary=True)
+            foo_id = Int(lazy_group=1)
+            title = Unicode(lazy_group=2)
+
+        bar = self.store.get(LazyBar, 100)
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        self.assertEquals(bar.title, "Title 300")
+        self.assertNotIn("foo_id", stream.getvalue())
+        self.assertEquals(bar.foo_id, 10)
+        self.assertEquals(stream.getvalue().count("SELECT"), 2)
+
+    def test_lazy_columns_loaded_with_autoreload_columns(self):
+        class LazyBar(object):
+            __storm_table__ = "bar"
+            id = Int(primary=True)
+            foo_id = Int()
+            title = Unicode(lazy=True)
+
+        bar = self.store.get(LazyBar, 100)
+        self.store.autoreload(bar)
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        self.assertEquals(bar.title, "Title 300")
+        self.assertEquals(bar.foo_id, 10)
+        self.assertEquals(stream.getvalue().count("SELECT"), 1)
+
+    def test_lazy_columns_set_and_flush(self):
+        class LazyBar(object):
+            __storm_table__ = "bar"
+            id = Int(primary=True)
+            foo_id = Int()
+            title = Unicode(lazy=True)
+
+        bar = self.store.get(LazyBar, 100)
+        bar.title = u"New title"
+        self.store.flush()
+        self.assertEquals(self.store.get(Bar, 100).title, "New title")
+
+        bar = self.store.get(LazyBar, 200)
+        bar.foo_id = 30
+        self.store.flush()
+        self.assertEquals(self.store.get(Bar, 200).title, "Title 200")
+        self.assertEquals(bar.title, "Title 200")
+
+    def test_lazy_columns_reload(self):
+        class LazyBar(object):
+            __storm_table__ = "bar"
+            id = Int(primary=True)
+            foo_id = Int()
+            title = Unicode(lazy=True)
+
+        bar = self.store.get(LazyBar, 100)
+        bar.title = u"New title"
+        self.store.reload(bar)
+        self.assertEquals(get_obj_info(bar).variables[LazyBar.title]
+                          .get_lazy(), AutoReload)
+        self.assertEquals(bar.title, "Title 300")
+
+    def test_lazy_columns_with_tuple_find(self):
+        class LazyBar(object):
+            __storm_table__ = "bar"
+            id = Int(primary=True)
+            foo_id = Int()
+            title = Unicode(lazy=True)
+
+        result = self.store.find((LazyBar, Foo), LazyBar.foo_id == Foo.id)
+        result.order_by(LazyBar.id)
+        self.assertEquals([(bar.id, bar.title, foo.title)
+                           for bar, foo in result],
+                          [(100, "Title 300", "Title 30"),
+                           (200, "Title 200", "Title 20"),
+                           (300, "Title 100", "Title 10")])
+
     def test_reference_set(self):
         self.add_reference_set_bar_400()
 
@@ -5931,6 +6929,210 @@ class StoreTest(object):
         for i in range(len(foos)-1):
             self.assertTrue(foos[i].id < foos[i+1].id)
 
+    def test_flush_inserts_same_class_in_a_single_statement(self):
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        for id in (40, 50, 60):
+            foo = Foo()
+            foo.id = id
+            foo.title = u"Title %d" % id
+            self.store.add(foo)
+        self.store.flush()
+
+        self.assertEquals(stream.getvalue().count("INSERT INTO foo"), 1)
+        self.assertEquals(self.get_items(), [
+                          (10, "Title 30"),
+                          (20, "Title 20"),
+                          (30, "Title 10"),
+                          (40, "Title 40"),
+                          (50, "Title 50"),
+                          (60, "Title 60"),
+                         ])
+
+    def test_flush_inserts_register_objects_as_alive(self):
+        foos = []
+        for i in range(3):
+            foo = Foo()
+            foo.title = u"Title %d" % i
+            foos.append(self.store.add(foo))
+        self.store.flush()
+
+        for foo in foos:
+            self.assertTrue(foo.id is not None)
+            self.assertIdentical(self.store.get(Foo, foo.id), foo)
+        self.assertEquals(len(set(foo.id for foo in foos)), 3)
+
+    def test_flush_inserts_with_different_columns(self):
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        foo1 = Foo()
+        foo1.id = 40
+        foo1.title = u"Title 40"
+        foo2 = Foo()
+        foo2.id = 50
+        self.store.add(foo1)
+        self.store.add(foo2)
+        self.store.flush()
+
+        self.assertEquals(stream.getvalue().count("INSERT INTO foo"), 2)
+        self.assertEquals(foo1.title, u"Title 40")
+        self.assertEquals(foo2.title, u"Default Title")
+
+    def test_flush_inserts_respect_flush_order(self):
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        foo1 = Foo()
+        foo1.id = 40
+        foo2 = Foo()
+        foo2.id = 50
+        self.store.add(foo1)
+        self.store.add(foo2)
+        self.store.add_flush_order(foo2, foo1)
+        self.store.flush()
+
+        statements = [line for line in stream.getvalue().splitlines()
+                      if "INSERT INTO foo" in line]
+        self.assertEquals(len(statements), 2)
+        self.assertTrue("50" in statements[0])
+        self.assertTrue("40" in statements[1])
+
+    def test_flush_inserts_failing_then_rollback(self):
+        foo1 = Foo()
+        foo1.id = 40
+        foo1.title = u"Title 40"
+        foo2 = Foo()
+        foo2.id = 10
+        foo2.title = u"Title 10"
+        self.store.add(foo1)
+        self.store.add(foo2)
+        self.assertRaises(DatabaseError, self.store.flush)
+        self.store.rollback()
+
+        self.assertEquals(Store.of(foo1), None)
+        self.assertEquals(Store.of(foo2), None)
+        self.assertEquals(self.get_items(), [
+                          (10, "Title 30"),
+                          (20, "Title 20"),
+                          (30, "Title 10"),
+                         ])
+
+    def test_flush_inserts_run_flushed_hooks(self):
+        flushed = []
+        class MyFoo(Foo):
+            def __storm_flushed__(self):
+                flushed.append(self.id)
+
+        foos = []
+        for id in (40, 50, 60):
+            foo = MyFoo()
+            foo.id = id
+            foos.append(self.store.add(foo))
+        self.store.flush()
+
+        self.assertEquals(flushed, [40, 50, 60])
+
+    def test_flush_removes_same_class_in_a_single_statement(self):
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        foos = [self.store.get(Foo, id) for id in (10, 20)]
+        for foo in foos:
+            self.store.remove(foo)
+        self.store.flush()
+
+        self.assertEquals(stream.getvalue().count("DELETE FROM foo"), 1)
+        self.assertEquals(self.get_items(), [(30, "Title 10")])
+        self.assertEquals(self.store.get(Foo, 10), None)
+
+    def test_flush_removes_with_compound_primary_key(self):
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        links = [self.store.get(Link, (10, 100)),
+                 self.store.get(Link, (20, 200))]
+        for link in links:
+            self.store.remove(link)
+        self.store.flush()
+
+        self.assertEquals(stream.getvalue().count("DELETE FROM link"), 1)
+        result = self.store.execute("SELECT foo_id, bar_id FROM link "
+                                    "ORDER BY foo_id, bar_id")
+        self.assertEquals(list(result),
+                          [(10, 200), (10, 300), (20, 100), (30, 300)])
+
+    def test_flush_updates_same_class_in_a_single_statement(self):
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        foos = [self.store.get(Foo, id) for id in (10, 20)]
+        foos[0].title = u"New Title 10"
+        foos[1].title = u"New Title 20"
+        self.store.flush()
+
+        self.assertEquals(stream.getvalue().count("UPDATE foo"), 1)
+        self.assertEquals(self.get_items(), [
+                          (10, "New Title 10"),
+                          (20, "New Title 20"),
+                          (30, "Title 10"),
+                         ])
+
+    def test_flush_updates_with_several_columns(self):
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        foo_values = [self.store.get(FooValue, id) for id in (1, 2)]
+        foo_values[0].value1 = 10
+        foo_values[0].value2 = 11
+        foo_values[1].value1 = 20
+        foo_values[1].value2 = 21
+        self.store.flush()
+
+        self.assertEquals(stream.getvalue().count("UPDATE foovalue"), 1)
+        result = self.store.execute("SELECT value1, value2 FROM foovalue "
+                                    "WHERE id IN (1, 2, 3) ORDER BY id")
+        self.assertEquals(list(result), [(10, 11), (20, 21), (2, 1)])
+
+    def test_flush_updates_changing_the_primary_key(self):
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        foos = [self.store.get(Foo, id) for id in (10, 20)]
+        foos[0].id = 40
+        foos[1].id = 50
+        self.store.flush()
+
+        self.assertEquals(stream.getvalue().count("UPDATE foo"), 2)
+        self.assertEquals(self.get_items(), [
+                          (30, "Title 10"),
+                          (40, "Title 30"),
+                          (50, "Title 20"),
+                         ])
+        self.assertIdentical(self.store.get(Foo, 40), foos[0])
+
+    def test_flush_updates_run_flushed_hooks(self):
+        flushed = []
+        class MyFoo(Foo):
+            def __storm_flushed__(self):
+                flushed.append(self.id)
+
+        foos = [self.store.get(MyFoo, id) for id in (10, 20)]
+        for foo in foos:
+            foo.title = u"New Title"
+        self.store.flush()
+
+        self.assertEquals(sorted(flushed), [10, 20])
+
     def test_update_order_is_preserved_when_possible(self):
         class MyFoo(Foo):
             sequence = 0
@@ -5967,6 +7169,75 @@ class StoreTest(object):
         for i, foo in enumerate(foos):
             self.assertEquals(foo.flush_order, i)
 
+    def test_flush_order_with_long_chain(self):
+        flushed = []
+        class MyFoo(Foo):
+            def __storm_flushed__(self):
+                flushed.append(self.id)
+
+        foos = []
+        for id in range(1000, 1500):
+            foo = MyFoo()
+            foo.id = id
+            foos.append(self.store.add(foo))
+        for before, after in zip(foos[1:], foos[:-1]):
+            self.store.add_flush_order(before, after)
+        self.store.flush()
+
+        self.assertEquals(flushed, range(1499, 999, -1))
+
+    def test_flush_order_with_object_dirtied_by_flushed_hook(self):
+        class MyFoo(Foo):
+            def __storm_flushed__(self):
+                if self.title == u"First":
+                    self.title = u"Second"
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        foo1 = self.store.get(MyFoo, 10)
+        foo2 = self.store.get(Foo, 20)
+        foo1.title = u"First"
+        foo2.title = u"Third"
+        self.store.add_flush_order(foo1, foo2)
+        self.store.flush()
+
+        statements = [line for line in stream.getvalue().splitlines()
+                      if "UPDATE foo" in line]
+        self.assertEquals(len(statements), 3)
+        self.assertTrue("First" in statements[0])
+        self.assertTrue("Second" in statements[1])
+        self.assertTrue("Third" in statements[2])
+
+    def test_flush_order_with_objects_dirtied_by_flushed_hook(self):
+        """
+        Objects made dirty together by a flushed hook are flushed in the
+        order requested for them, without a false ordering loop.
+        """
+        foo1 = self.store.get(Foo, 10)
+        foo2 = self.store.get(Foo, 20)
+        class MyFoo(Foo):
+            def __storm_flushed__(self):
+                foo1.title = u"First"
+                foo2.title = u"Second"
+
+        stream = StringIO()
+        self.addCleanup(debug, False)
+        debug(True, stream)
+
+        foo3 = self.store.get(MyFoo, 30)
+        foo3.title = u"Changed"
+        self.store.add_flush_order(foo1, foo2)
+        self.store.flush()
+
+        statements = [line for line in stream.getvalue().splitlines()
+                      if "UPDATE foo" in line]
+        self.assertEquals(len(statements), 3)
+        self.assertTrue("Changed" in statements[0])
+        self.assertTrue("First" in statements[1])
+        self.assertTrue("Second" in statements[2])
+
     def test_cache_poisoning(self):
         """
         When a object update a field value to the previous value, which is in
@@ -6107,6 +7378,10 @@ class EmptyResultSetTest(object):
     def test_iter(self):
         self.assertEquals(list(self.result), list(self.empty))
 
+    def test_stream(self):
+        self.assertEquals(list(self.result.stream()),
+                          list(self.empty.stream()))
+
     def test_copy(self):
         self.assertNotEquals(self.result.copy(), self.result)
         self.assertNotEquals(self.empty.copy(), self.empty)
@@ -6221,6 +7496,17 @@ class EmptyResultSetTest(object):
         self.assertEquals(list(self.result.values(Foo.title)), [])
         self.assertEquals(list(self.empty.values(Foo.title)), [])
 
+    def test_readonly(self):
+        self.assertEquals(list(self.result.readonly()),
+                          list(self.empty.readonly()))
+
+    def test_values_columnar(self):
+        self.assertEquals(self.result.values_columnar(Foo.id, Foo.title),
+                          [[], []])
+        self.assertEquals(self.empty.values_columnar(Foo.id, Foo.title),
+                          [[], []])
+        self.assertRaises(FeatureError, self.empty.values_columnar)
+
     def test_set_no_args(self):
         self.assertEquals(self.result.set(), None)
         self.assertEquals(self.empty.set(), None)
@@ -1,6 +1,7 @@
 import datetime
 import os
 import sys
+import threading
 from unittest import TestCase
 
 from tests import has_fixtures
@@ -23,7 +24,8 @@ except ImportError:
 from storm.tracer import (trace, install_tracer, get_tracers, remove_tracer,
                           remove_tracer_type, remove_all_tracers, debug,
                           BaseStatementTracer, DebugTracer, TimeoutTracer,
-                          TimelineTracer, TimeoutError, _tracers)
+                          TimelineTracer, TimeoutError, StatsTracer,
+                          LatencyHistogram, normalize_statement, _tracers)
 from storm.database import Connection, create_database
 from storm.expr import Variable
 
@@ -667,3 +669,213 @@ class CaptureTracerTest(TestHelper, TestWithFixtures):
         [error] = errors
         self.assertEqual("boom", str(error))
         self.assertEqual([], get_tracers())
+
+
+class LatencyHistogramTest(TestCase):
+
+    def test_empty(self):
+        histogram = LatencyHistogram()
+        self.assertEqual(0, histogram.count)
+        self.assertEqual([], histogram.get_buckets())
+        self.assertEqual(None, histogram.get_percentile(50))
+
+    def test_small_values_are_exact(self):
+        histogram = LatencyHistogram(precision=3)
+        histogram.record(0.000005)
+        histogram.record(0.000005)
+        histogram.record(0.000007)
+        self.assertEqual(3, histogram.count)
+        self.assertEqual([(0.000005, 2), (0.000007, 1)],
+                         histogram.get_buckets())
+
+    def test_relative_error_is_bounded(self):
+        histogram = LatencyHistogram(precision=7)
+        for value in (0.0013, 0.027, 0.51, 3.3, 120.0):
+            histogram.record(value)
+            high = histogram.get_percentile(100)
+            self.assertTrue(value <= high < value * (1 + 2 ** -6))
+            histogram = LatencyHistogram(precision=7)
+
+    def test_buckets_grow_with_values(self):
+        histogram = LatencyHistogram(precision=3)
+        # 100us and 103us fall in the same bucket of width 16us.
+        histogram.record(0.0001)
+        histogram.record(0.000103)
+        self.assertEqual([(0.000111, 2)], histogram.get_buckets())
+
+    def test_get_percentile(self):
+        histogram = LatencyHistogram()
+        for i in range(1, 101):
+            histogram.record(i / 1000000.0)
+        self.assertEqual(0.000001, histogram.get_percentile(0))
+        self.assertEqual(0.00005, histogram.get_percentile(50))
+        self.assertEqual(0.000099, histogram.get_percentile(99))
+        self.assertEqual(0.0001, histogram.get_percentile(100))
+
+    def test_merge(self):
+        histogram1 = LatencyHistogram()
+        histogram1.record(0.000001)
+        histogram2 = LatencyHistogram()
+        histogram2.record(0.000001)
+        histogram2.record(0.000002)
+        histogram1.merge(histogram2)
+        self.assertEqual(3, histogram1.count)
+        self.assertEqual([(0.000001, 2), (0.000002, 1)],
+                         histogram1.get_buckets())
+
+    def test_copy(self):
+        histogram = LatencyHistogram()
+        histogram.record(0.000001)
+        copy = histogram.copy()
+        histogram.record(0.000001)
+        self.assertEqual(1, copy.count)
+        self.assertEqual([(0.000001, 1)], copy.get_buckets())
+
+
+class NormalizeStatementTest(TestCase):
+
+    def test_parameter_marks(self):
+        self.assertEqual(
+            "SELECT * FROM foo WHERE id=? AND title=? AND x=? AND y=?",
+            normalize_statement("SELECT * FROM foo WHERE id=? AND "
+                                "title=%s AND x=$1 AND y=%(y)s"))
+
+    def test_literals(self):
+        self.assertEqual(
+            "SELECT * FROM foo1 WHERE id=? AND title=? AND x > ?",
+            normalize_statement("SELECT * FROM foo1 WHERE id=10 AND "
+                                "title='it''s' AND x > -1.5"))
+
+    def test_lists(self):
+        self.assertEqual(
+            normalize_statement("SELECT 1 FROM foo WHERE id IN (?, ?)"),
+            normalize_statement("SELECT 1 FROM foo WHERE id IN (1,2,3)"))
+
+    def test_whitespace(self):
+        self.assertEqual("SELECT ? FROM foo",
+                         normalize_statement(" SELECT 1\n  FROM foo\n"))
+
+
+class StubCursor(object):
+
+    def __init__(self, rowcount=-1):
+        self.rowcount = rowcount
+
+
+class StatsTracerTest(TestHelper):
+
+    def setUp(self):
+        super(StatsTracerTest, self).setUp()
+        self.tracer = StatsTracer()
+        self.now = 100.0
+        self.tracer._clock = lambda: self.now
+
+    def execute(self, statement, duration, rowcount=-1, error=None):
+        cursor = StubCursor(rowcount)
+        self.tracer.connection_raw_execute("conn", cursor, statement, ())
+        self.now += duration
+        if error is None:
+            self.tracer.connection_raw_execute_success(
+                "conn", cursor, statement, ())
+        else:
+            self.tracer.connection_raw_execute_error(
+                "conn", cursor, statement, (), error)
+
+    def test_snapshot_empty(self):
+        self.assertEqual({}, self.tracer.snapshot())
+
+    def test_aggregates_by_shape(self):
+        self.execute("SELECT * FROM foo WHERE id=?", 0.5, 1)
+        self.execute("SELECT * FROM foo WHERE id=%s", 0.25, 1)
+        self.execute("SELECT * FROM foo WHERE id=1", 1.0, 0)
+        self.execute("DELETE FROM foo", 2.0, 3)
+        snapshot = self.tracer.snapshot()
+        self.assertEqual(["DELETE FROM foo", "SELECT * FROM foo WHERE id=?"],
+                         sorted(snapshot))
+        stats = snapshot["SELECT * FROM foo WHERE id=?"]
+        self.assertEqual("SELECT * FROM foo WHERE id=?", stats.shape)
+        self.assertEqual(3, stats.count)
+        self.assertEqual(0, stats.errors)
+        self.assertEqual(1.75, stats.total_time)
+        self.assertEqual(0.25, stats.min_time)
+        self.assertEqual(1.0, stats.max_time)
+        self.assertAlmostEqual(1.75 / 3, stats.mean_time)
+        self.assertEqual(2, stats.rows)
+        self.assertEqual(3, stats.histogram.count)
+        self.assertTrue(0.5 <= stats.get_percentile(50) < 0.51)
+        self.assertEqual(3, snapshot["DELETE FROM foo"].rows)
+
+    def test_errors(self):
+        self.execute("SELECT 1", 0.5, 1, error=ValueError())
+        [stats] = self.tracer.snapshot().values()
+        self.assertEqual(1, stats.count)
+        self.assertEqual(1, stats.errors)
+        self.assertEqual(0.5, stats.total_time)
+        self.assertEqual(0, stats.rows)
+
+    def test_success_without_execute(self):
+        """
+        Executions started before the tracer was installed are ignored.
+        """
+        self.tracer.connection_raw_execute_success(
+            "conn", StubCursor(), "SELECT 1", ())
+        self.assertEqual({}, self.tracer.snapshot())
+
+    def test_cursor_without_rowcount(self):
+        self.tracer.connection_raw_execute("conn", "cursor", "SELECT 1", ())
+        self.tracer.connection_raw_execute_success(
+            "conn", "cursor", "SELECT 1", ())
+        [stats] = self.tracer.snapshot().values()
+        self.assertEqual(0, stats.rows)
+
+    def test_snapshot_is_not_modified(self):
+        self.execute("SELECT 1", 0.5)
+        snapshot = self.tracer.snapshot()
+        self.execute("SELECT 1", 0.5)
+        self.assertEqual(1, snapshot["SELECT ?"].count)
+        self.assertEqual(2, self.tracer.snapshot()["SELECT ?"].count)
+
+    def test_reset(self):
+        self.execute("SELECT 1", 0.5)
+        self.tracer.reset()
+        self.assertEqual({}, self.tracer.snapshot())
+        self.execute("SELECT 1", 0.5)
+        self.assertEqual(1, self.tracer.snapshot()["SELECT ?"].count)
+
+    def test_snapshot_with_reset(self):
+        self.execute("SELECT 1", 0.5)
+        snapshot = self.tracer.snapshot(reset=True)
+        self.assertEqual(1, snapshot["SELECT ?"].count)
+        self.assertEqual({}, self.tracer.snapshot())
+
+    def test_threads_are_merged(self):
+        def run():
+            tracer.connection_raw_execute("conn", cursor, "SELECT 1", ())
+            tracer.connection_raw_execute_success(
+                "conn", cursor, "SELECT 1", ())
+        tracer = StatsTracer()
+        cursor = StubCursor(1)
+        threads = [threading.Thread(target=run) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        run()
+        stats = tracer.snapshot()["SELECT ?"]
+        self.assertEqual(6, stats.count)
+        self.assertEqual(6, stats.rows)
+        self.assertEqual(6, stats.histogram.count)
+
+    def test_with_database(self):
+        tracer = StatsTracer()
+        install_tracer(tracer)
+        self.addCleanup(remove_tracer, tracer)
+        connection = create_database("sqlite:").connect()
+        connection.execute("CREATE TABLE foo (id INTEGER)")
+        for i in range(3):
+            connection.execute("INSERT INTO foo VALUES (?)", (i,))
+        connection.execute("UPDATE foo SET id=id+1")
+        connection.close()
+        snapshot = tracer.snapshot()
+        self.assertEqual(3, snapshot["INSERT INTO foo VALUES (?)"].count)
+        self.assertEqual(3, snapshot["UPDATE foo SET id=id+?"].rows)